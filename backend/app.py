@@ -3,15 +3,25 @@ JailbrokeGPT Flask Backend
 Main application entry point
 """
 import os
-from flask import Flask, request, jsonify
+import json
+import multiprocessing
+import time
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 from dotenv import load_dotenv
-from model_loader import ModelLoader
-from models import init_db, Message, Conversation, get_db_session
-from auth import token_required
-from routes import routes
+from scheduler import QueueFullError, ModelNotReadyError
+from jobs import BackgroundJobRunner
+from persistence import create_writer
+from memory import VectorMemory, MemoryRetriever
+from models import (
+    init_db, Conversation, get_db_session, remove_db_session, get_pool_stats,
+    set_token_counter, count_messages
+)
+from auth import token_required, admin_required, principal_cache
+from routes import routes, set_delete_listener
+import metrics
+from tracing import span, get_spans, server_timing_header, log_request, RequestProfiler
 from summarization import should_summarize, summarize_conversation, get_context_for_generation, auto_generate_title
-from datetime import datetime
 
 # Load environment variables
 load_dotenv()
@@ -27,33 +37,128 @@ app.register_blueprint(routes, url_prefix='/api')
 MODEL_REPO = os.getenv('MODEL_REPO', 'v8karlo/UNCENSORED-TinyLlama-1.1B-intermediate-step-1431k-3T-Q5_K_M-GGUF')
 MODEL_FILE = os.getenv('MODEL_FILE', 'uncensored-tinyllama-1.1b-intermediate-step-1431k-3t-q5_k_m.gguf')
 MAX_TOKENS = int(os.getenv('MAX_TOKENS', 512))
+N_CTX = int(os.getenv('N_CTX', 2048))
 TEMPERATURE = float(os.getenv('TEMPERATURE', 0.7))
 TOP_P = float(os.getenv('TOP_P', 0.9))
 FLASK_PORT = int(os.getenv('FLASK_PORT', 5000))
 FLASK_HOST = os.getenv('FLASK_HOST', '0.0.0.0')
+# Tokens kept free for the prompt scaffolding ("Recent conversation:", "Assistant:")
+PROMPT_RESERVE_TOKENS = 16
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', 1))
+SPECULATIVE_MODE = os.getenv('SPECULATIVE_MODE', 'off')
+# Model runtime settings (threads, batching, caches, model store) are read by inference_server.py
+# Set to use a separate inference service (unix:///path.sock or http://127.0.0.1:5001)
+INFERENCE_URL = os.getenv('INFERENCE_URL') or None
+INFERENCE_CLIENT_POOL = int(os.getenv('INFERENCE_CLIENT_POOL', 16))
+INFERENCE_CLIENT_TIMEOUT = float(os.getenv('INFERENCE_CLIENT_TIMEOUT', 300))
+# Seconds clients are told to wait while the model is still loading
+MODEL_LOAD_RETRY_AFTER = int(os.getenv('MODEL_LOAD_RETRY_AFTER', 10))
+# durable: commit each message before moving on; write_behind: batch commits every PERSIST_FLUSH_MS
+PERSISTENCE_MODE = os.getenv('PERSISTENCE_MODE', 'durable')
+PERSIST_FLUSH_MS = float(os.getenv('PERSIST_FLUSH_MS', 20))
+PERSIST_MAX_BATCH = int(os.getenv('PERSIST_MAX_BATCH', 256))
+# Long-term memory: set MEMORY_DIR (and EMBEDDING_MODEL for the model) to recall older messages
+MEMORY_DIR = os.getenv('MEMORY_DIR') or None
+MEMORY_TOP_K = int(os.getenv('MEMORY_TOP_K', 4))
+MEMORY_TOKENS = int(os.getenv('MEMORY_TOKENS', 256))
+MEMORY_MIN_SCORE = float(os.getenv('MEMORY_MIN_SCORE', 0.3))
+MEMORY_SCOPE = os.getenv('MEMORY_SCOPE', 'conversation')
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+TRACE_LOG = os.getenv('TRACE_LOG', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_DIR = os.getenv('PROFILE_DIR', './profiles')
+
+# Inference worker processes re-import this module when they are spawned.
+# Only the server process should touch the database or load the model.
+IS_SERVER_PROCESS = multiprocessing.parent_process() is None
 
 # Initialize database
-print("Initializing database...")
-try:
-    init_db()
-    print("Database initialized successfully")
-except Exception as e:
-    print(f"Warning: Database initialization failed: {e}")
-    print("Make sure MySQL is running and configured in .env")
+if IS_SERVER_PROCESS:
+    print("Initializing database...")
+    try:
+        init_db()
+        print("Database initialized successfully")
+    except Exception as e:
+        print(f"Warning: Database initialization failed: {e}")
+        print("Make sure MySQL is running and configured in .env")
 
 # Initialize model loader
 print("Initializing JailbrokeGPT...")
-model_loader = ModelLoader(MODEL_REPO, MODEL_FILE)
+if INFERENCE_URL:
+    # Web role: the model lives in the inference service, llama.cpp is never imported here
+    from inference_client import InferenceClient
+    model_loader = InferenceClient(INFERENCE_URL, pool_size=INFERENCE_CLIENT_POOL, timeout=INFERENCE_CLIENT_TIMEOUT)
+    scheduler = model_loader.scheduler
+    print(f"Using inference service at {INFERENCE_URL}")
+else:
+    from inference_server import create_model_loader, start_model_load
+    scheduler, model_loader = create_model_loader()
+    # Load model in the background; routes that don't need it serve right away
+    if IS_SERVER_PROCESS:
+        start_model_load(model_loader)
+background_jobs = BackgroundJobRunner(scheduler)
+memory_retriever = None
+if MEMORY_DIR:
+    memory_retriever = MemoryRetriever(
+        VectorMemory(MEMORY_DIR),
+        model_loader.embed,
+        k=MEMORY_TOP_K,
+        max_tokens=MEMORY_TOKENS,
+        min_score=MEMORY_MIN_SCORE,
+        scope=MEMORY_SCOPE
+    )
+message_writer = create_writer(PERSISTENCE_MODE, flush_interval=PERSIST_FLUSH_MS / 1000, max_batch=PERSIST_MAX_BATCH)
+profiler = RequestProfiler(PROFILE_DIR)
+if not INFERENCE_URL:
+    # Counting is a local tokenizer call here. In the web role it would be an
+    # HTTP call inside every DB flush, so get_message_tokens fills counts in lazily instead.
+    set_token_counter(model_loader.count_tokens)
 
-# Load model on startup
-try:
-    model_loader.load_model()
-except Exception as e:
-    import traceback
-    print(f"Error loading model: {e}")
-    print("\nFull error details:")
-    traceback.print_exc()
-    print("\nServer will start but model needs to be loaded manually")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile = profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    """Record latency per route (streamed responses: until the stream starts)"""
+    started = g.get('request_started')
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.http_request_seconds.observe(
+            elapsed,
+            method=request.method, route=route, status=str(response.status_code)
+        )
+        if SERVER_TIMING:
+            response.headers['Server-Timing'] = server_timing_header(get_spans(), elapsed * 1000)
+        g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(exception=None):
+    """Log the request's stage timings and save its profile, once streaming has finished too"""
+    started = g.get('request_started')
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    profile = g.pop('profile', None)
+    if profile is not None:
+        try:
+            profiler.finish(profile, request.method, request.path)
+        except Exception as e:
+            print(f"Warning: Could not save request profile: {e}")
+    if TRACE_LOG:
+        log_request(request.method, request.path, g.get('response_status', 500),
+                    elapsed * 1000, get_spans(), g.get('user_id'))
+
+
+@app.teardown_appcontext
+def shutdown_session(exception=None):
+    """Return the request's database connection to the pool"""
+    remove_db_session()
 
 
 # ============================================
@@ -83,6 +188,31 @@ def handle_error(error):
     }), 500
 
 
+@app.errorhandler(QueueFullError)
+def queue_full(error):
+    """Shed load when the inference queue is full"""
+    response = jsonify({
+        'error': 'Server busy',
+        'message': str(error),
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+
+@app.errorhandler(ModelNotReadyError)
+def model_not_ready(error):
+    """Turn away generations until the model has loaded"""
+    response = jsonify({
+        'error': 'Model not ready',
+        'message': str(error),
+        'retry_after': error.retry_after,
+        'load': model_loader.get_load_status()
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 503
+
+
 @app.errorhandler(404)
 def not_found(error):
     """Handle 404 errors"""
@@ -93,14 +223,22 @@ def not_found(error):
 
 
 @app.route('/health', methods=['GET'])
+@app.route('/health/live', methods=['GET'])
 def health():
-    """Health check endpoint"""
+    """Liveness check: the server is up, whether or not the model has loaded"""
     return jsonify({
         'status': 'healthy',
-        'model_loaded': model_loader.model is not None
+        'model_loaded': model_loader.loaded
     })
 
 
+@app.route('/health/ready', methods=['GET'])
+def ready():
+    """Readiness check: 200 once the model can serve chat, 503 with load progress until then"""
+    status = model_loader.get_load_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
 @app.route('/api/chat', methods=['POST'])
 @token_required
 def chat(current_user):
@@ -112,7 +250,10 @@ def chat(current_user):
         "prompt": "Your message here",
         "conversation_id": 1,  # required
         "max_tokens": 512,     # optional
-        "temperature": 0.7     # optional
+        "temperature": 0.7,    # optional
+        "stream": false,       # optional, stream tokens as Server-Sent Events
+        "cache": null,         # optional, force the generation cache on/off
+        "speculative": null    # optional, turn speculative decoding on/off (ignored if SPECULATIVE_MODE=off)
     }
     """
     try:
@@ -128,81 +269,228 @@ def chat(current_user):
         conversation_id = data['conversation_id']
         max_tokens = data.get('max_tokens', MAX_TOKENS)
         temperature = data.get('temperature', TEMPERATURE)
+        stream = bool(data.get('stream', False))
+        cache = data.get('cache')  # None: cache only low-temperature requests
+        speculative = data.get('speculative')  # None: SPECULATIVE_MODE decides
         
         db = get_db_session()
-        try:
-            # Verify conversation belongs to user
+        # Verify conversation belongs to user
+        with span('load_conversation'):
             conversation = db.query(Conversation)\
                 .filter_by(id=conversation_id, user_id=current_user.id)\
                 .first()
-            
-            if not conversation:
-                return jsonify({'error': 'Conversation not found'}), 404
-            
-            # Save user message
-            user_message = Message(
-                conversation_id=conversation_id,
-                role='user',
-                content=prompt
+        
+        if not conversation:
+            return jsonify({'error': 'Conversation not found'}), 404
+        
+        # Turn the request away before saving anything if the model can't take it
+        model_loader.check_ready(retry_after=MODEL_LOAD_RETRY_AFTER)
+        scheduler.check_capacity()
+        
+        # Save user message, and make sure the context below can read it
+        try:
+            message_writer.add_message(conversation_id, 'user', prompt).wait()
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 500
+        message_writer.sync(conversation_id)
+        
+        # Get context for generation (ends with the message just saved),
+        # leaving room in the context window for the reply
+        max_tokens = min(max_tokens, N_CTX // 2)
+        with span('context'):
+            context = get_context_for_generation(
+                conversation_id,
+                token_budget=N_CTX - max_tokens - PROMPT_RESERVE_TOKENS,
+                count_tokens=model_loader.count_tokens,
+                retriever=memory_retriever
             )
-            db.add(user_message)
-            db.commit()
-            
-            # Check if we should summarize
-            if should_summarize(conversation_id):
-                print(f"Summarizing conversation {conversation_id}...")
-                summary_result = summarize_conversation(model_loader, conversation_id)
-                print(f"Summarization result: {summary_result}")
-            
-            # Auto-generate title after first exchange
-            if len(conversation.messages) == 2:  # After first user message and response
-                auto_generate_title(model_loader, conversation_id)
-            
-            # Get context for generation
-            context = get_context_for_generation(conversation_id, max_messages=8)
-            
-            # Format prompt with context
-            if context:
-                formatted_prompt = f"{context}\n\nUser: {prompt}\nAssistant:"
-            else:
-                formatted_prompt = f"User: {prompt}\nAssistant:"
-            
-            # Generate response
-            response = model_loader.generate(
+        
+        # Format prompt with context
+        if context:
+            formatted_prompt = f"{context}\nAssistant:"
+        else:
+            formatted_prompt = f"User: {prompt}\nAssistant:"
+        
+        if stream:
+            tokens = model_loader.generate_stream(
                 prompt=formatted_prompt,
                 max_tokens=max_tokens,
                 temperature=temperature,
-                top_p=TOP_P
+                top_p=TOP_P,
+                user_id=current_user.id,
+                cache=cache,
+                speculative=speculative
             )
-            
-            # Save assistant message
-            assistant_message = Message(
-                conversation_id=conversation_id,
-                role='assistant',
-                content=response
+            return Response(
+                stream_with_context(stream_chat_response(tokens, prompt, conversation_id)),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no'  # Stop nginx from buffering the stream
+                }
             )
-            db.add(assistant_message)
-            
-            # Update conversation timestamp
-            conversation.updated_at = datetime.utcnow()
-            db.commit()
-            
-            return jsonify({
-                'response': response,
-                'prompt': prompt,
-                'conversation_id': conversation_id,
-                'message_id': assistant_message.id
-            })
         
-        finally:
-            db.close()
+        # Generate response
+        response = model_loader.generate(
+            prompt=formatted_prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=TOP_P,
+            user_id=current_user.id,
+            cache=cache,
+            speculative=speculative
+        )
         
+        # Save assistant message (the insert also bumps the conversation timestamp)
+        message_id = message_writer.add_message(conversation_id, 'assistant', response).wait()
+        
+        schedule_housekeeping(conversation_id)
+        
+        return jsonify({
+            'response': response,
+            'prompt': prompt,
+            'conversation_id': conversation_id,
+            'message_id': message_id
+        })
+        
+    except (QueueFullError, ModelNotReadyError):
+        raise  # Handled by queue_full (429) and model_not_ready (503)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
 
+def sse_event(event, data):
+    """Format a single Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def run_summarization(conversation_id):
+    """Background job: summarize a conversation, raising on failure so it is retried"""
+    print(f"Summarizing conversation {conversation_id}...")
+    message_writer.sync(conversation_id)
+    summary_result = summarize_conversation(model_loader, conversation_id, writer=message_writer)
+    print(f"Summarization result: {summary_result}")
+    if 'error' in summary_result:
+        raise RuntimeError(summary_result['error'])
+
+
+def run_title_generation(conversation_id):
+    """Background job: give a new conversation a generated title"""
+    message_writer.sync(conversation_id)
+    auto_generate_title(model_loader, conversation_id, writer=message_writer)
+
+
+def run_embedding(conversation_id):
+    """Background job: add a conversation's new messages to the long-term memory index"""
+    message_writer.sync(conversation_id)
+    memory_retriever.index_conversation(conversation_id)
+
+
+def forget_conversation(user_id, conversation_id):
+    """Queue removal of a deleted conversation's long-term memory vectors"""
+    background_jobs.submit('forget', conversation_id,
+                           lambda: memory_retriever.memory.remove_conversation(user_id, conversation_id))
+
+
+if memory_retriever is not None:
+    set_delete_listener(forget_conversation)
+
+
+def schedule_housekeeping(conversation_id):
+    """
+    Queue summarization, title generation and memory indexing to run after a reply is saved.
+    
+    All are model calls, so they run in the background instead of delaying
+    the reply; clients see the new summary/title on their next fetch.
+    """
+    message_writer.sync(conversation_id)
+    with span('should_summarize'):
+        needs_summary = should_summarize(conversation_id)
+    if needs_summary:
+        background_jobs.submit('summarize', conversation_id,
+                               lambda: run_summarization(conversation_id))
+    
+    # Auto-generate title after first exchange
+    with span('count_messages'):
+        message_count = count_messages(get_db_session(), conversation_id)
+    if message_count == 2:
+        background_jobs.submit('title', conversation_id,
+                               lambda: run_title_generation(conversation_id))
+    
+    if memory_retriever is not None:
+        background_jobs.submit('embed', conversation_id,
+                               lambda: run_embedding(conversation_id))
+
+
+def stream_chat_response(tokens, prompt, conversation_id):
+    """
+    Relay generated tokens to the client as Server-Sent Events.
+    
+    Events:
+        token - {"token": "..."} for every decoded chunk
+        done  - {"response", "prompt", "conversation_id", "message_id"} once finished
+        error - {"error": "..."} if generation failed or the reply couldn't be saved
+    
+    The assistant message is saved once the stream ends. If the client
+    disconnects mid-stream, generation is stopped and whatever was produced
+    so far is saved so the conversation history stays in user/assistant pairs.
+    """
+    chunks = []
+    error = None
+    save_error = None
+    aborted = True
+    message_id = None
+    
+    try:
+        for chunk in tokens:
+            if not chunks:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+            chunks.append(chunk)
+            yield sse_event('token', {'token': chunk})
+        aborted = False
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        error = str(e)
+        aborted = False
+    finally:
+        tokens.close()
+        response = ''.join(chunks).strip()
+        if aborted:
+            print(f"Client disconnected from stream for conversation {conversation_id} "
+                  f"after {len(chunks)} chunks")
+        if response:
+            # Nothing may escape here: the stream still has to end with an error or done event
+            try:
+                message_id = message_writer.add_message(conversation_id, 'assistant', response).wait()
+            except Exception as e:
+                print(f"Failed to save the streamed reply for conversation {conversation_id}: {e}")
+                save_error = f"Failed to save the reply: {e}"
+            else:
+                try:
+                    schedule_housekeeping(conversation_id)
+                except Exception as e:
+                    print(f"Failed to schedule housekeeping for conversation {conversation_id}: {e}")
+    
+    if error or save_error:
+        yield sse_event('error', {
+            'error': '; '.join(message for message in (error, save_error) if message),
+            'message_id': message_id
+        })
+        return
+    
+    yield sse_event('done', {
+        'response': response,
+        'prompt': prompt,
+        'conversation_id': conversation_id,
+        'message_id': message_id
+    })
+
+
 @app.route('/model-info', methods=['GET'])
 def model_info():
     """Get information about the loaded model"""
@@ -212,10 +500,138 @@ def model_info():
         'max_tokens': MAX_TOKENS,
         'temperature': TEMPERATURE,
         'top_p': TOP_P,
-        'loaded': model_loader.model is not None
+        'runtime': model_loader.runtime_settings,
+        'loaded': model_loader.loaded
     })
 
 
+@app.route('/queue-stats', methods=['GET'])
+def queue_stats():
+    """Get inference queue depth and wait time statistics"""
+    return jsonify(scheduler.get_stats())
+
+
+@app.route('/job-stats', methods=['GET'])
+def job_stats():
+    """Get background summarization/title job counters"""
+    return jsonify(background_jobs.get_stats())
+
+
+@app.route('/persistence-stats', methods=['GET'])
+def persistence_stats():
+    """Get message write counters and write-behind batch sizes"""
+    return jsonify(message_writer.get_stats())
+
+
+@app.route('/worker-stats', methods=['GET'])
+def worker_stats():
+    """Get per-worker utilization of the inference worker pool, or batching slot usage"""
+    return jsonify({
+        'n_workers': INFERENCE_WORKERS,
+        'pool': model_loader.get_worker_stats(),
+        'batching': model_loader.get_batch_stats()
+    })
+
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Get generation cache hit rates"""
+    stats = model_loader.get_cache_stats()
+    return jsonify({
+        'enabled': stats is not None,
+        'cache': stats
+    })
+
+
+@app.route('/speculative-stats', methods=['GET'])
+def speculative_stats():
+    """Get speculative decoding draft acceptance rate"""
+    return jsonify({
+        'mode': SPECULATIVE_MODE,
+        'drafts': model_loader.get_speculative_stats()
+    })
+
+
+@app.route('/memory-stats', methods=['GET'])
+def memory_stats():
+    """Get long-term memory index sizes and search counts"""
+    return jsonify({
+        'enabled': memory_retriever is not None,
+        'memory': memory_retriever.get_stats() if memory_retriever else None
+    })
+
+
+@app.route('/auth-stats', methods=['GET'])
+def auth_stats():
+    """Get authenticated-principal cache hit/miss counters"""
+    return jsonify(principal_cache.get_stats())
+
+
+@app.route('/db-stats', methods=['GET'])
+def db_stats():
+    """Get database connection pool statistics"""
+    return jsonify(get_pool_stats())
+
+
+# Values tracked elsewhere are read when /metrics is scraped
+metrics.registry.callback(
+    'jailbrokegpt_inference_queue_depth', 'Generation requests waiting for the model',
+    lambda: scheduler.get_stats()['queue_depth_by_priority'], labelname='priority')
+metrics.registry.callback(
+    'jailbrokegpt_inference_active', 'Generations holding a model slot',
+    lambda: scheduler.get_stats()['active'])
+metrics.registry.callback(
+    'jailbrokegpt_inference_rejected_total', 'Generation requests shed with 429',
+    lambda: scheduler.get_stats()['rejected'], type='counter')
+metrics.registry.callback(
+    'jailbrokegpt_background_jobs_pending', 'Queued summarization/title jobs',
+    lambda: background_jobs.get_stats()['pending'])
+metrics.registry.callback(
+    'jailbrokegpt_db_connections', 'Pooled database connections by state',
+    lambda: {k: v for k, v in get_pool_stats().items() if k in ('checked_out', 'checked_in')},
+    labelname='state')
+metrics.registry.callback(
+    'jailbrokegpt_db_connections_opened_total', 'Database connections opened',
+    lambda: get_pool_stats()['connects'], type='counter')
+metrics.registry.callback(
+    'jailbrokegpt_db_checkouts_total', 'Connections checked out of the pool by sessions',
+    lambda: get_pool_stats()['checkouts'], type='counter')
+metrics.registry.callback(
+    'jailbrokegpt_db_pool_timeouts_total', 'Sessions that timed out waiting for a connection',
+    lambda: get_pool_stats()['timeouts'], type='counter')
+metrics.registry.callback(
+    'jailbrokegpt_model_ready', 'Whether the model has loaded (1) or not (0)',
+    lambda: int(model_loader.loaded))
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus metrics in the text exposition format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+@token_required
+@admin_required
+def admin_profile(current_user):
+    """
+    Profile the next N requests with cProfile (admin only)
+    
+    POST {"requests": 5} arms the profiler (0 cancels); GET reports how many
+    requests are left and the .prof files written to PROFILE_DIR.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            count = int(data.get('requests', 1))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'requests must be an integer'}), 400
+        # This request doesn't count towards N
+        profiler.arm(count)
+        print(f"Profiling the next {count} requests (armed by {current_user.username})")
+    return jsonify(profiler.get_status())
+
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("JailbrokeGPT Backend Server")
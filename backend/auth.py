@@ -1,11 +1,120 @@
 from functools import wraps
-from flask import request, jsonify
+from collections import OrderedDict
+from flask import request, jsonify, g
+from sqlalchemy import event, inspect
 import jwt
 import os
+import threading
+import time
 from datetime import datetime, timedelta
 from models import User, get_db_session
+from tracing import span
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'your-secret-key-change-this-in-production')
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 10000))
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', 60))
+ADMIN_USERNAMES = {name.strip() for name in os.getenv('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+
+class Principal:
+    """
+    Detached snapshot of an authenticated user.
+    
+    Passed to routes as current_user instead of a session-bound User,
+    so it can be cached across requests.
+    """
+    __slots__ = ('id', 'username', 'created_at')
+    
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.created_at = user.created_at
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'username': self.username,
+            'created_at': self.created_at.isoformat()
+        }
+
+
+class PrincipalCache:
+    """
+    Bounded LRU of verified token -> Principal with a TTL.
+    
+    Entries never outlive the token's own expiry. Entries for a user are
+    dropped when the user is deleted or changes password in this process;
+    other processes pick the change up when their entries expire.
+    """
+    
+    def __init__(self, max_size=10000, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # token -> (principal, expires_at)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def get(self, token):
+        """Get the cached principal for a token, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, token, principal, token_expires_at):
+        """Cache a principal until the TTL or the token's expiry, whichever is first"""
+        if self.max_size <= 0:
+            return
+        expires_at = min(time.time() + self.ttl, token_expires_at)
+        with self._lock:
+            self._entries[token] = (principal, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate_user(self, user_id):
+        """Drop every cached token of a user"""
+        with self._lock:
+            stale = [token for token, (principal, _) in self._entries.items() if principal.id == user_id]
+            for token in stale:
+                del self._entries[token]
+            self.invalidations += len(stale)
+    
+    def get_stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'invalidations': self.invalidations
+            }
+
+
+principal_cache = PrincipalCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+@event.listens_for(User, 'after_update')
+def _invalidate_on_password_change(mapper, connection, target):
+    if inspect(target).attrs.password_hash.history.has_changes():
+        principal_cache.invalidate_user(target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _invalidate_on_delete(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
 
 def generate_token(user_id):
     """Generate a JWT token for a user"""
@@ -15,16 +124,20 @@ def generate_token(user_id):
     }
     return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
 
-def verify_token(token):
-    """Verify a JWT token and return user_id"""
+def decode_token(token):
+    """Verify a JWT token and return its payload"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
-        return payload['user_id']
+        return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+def verify_token(token):
+    """Verify a JWT token and return user_id"""
+    payload = decode_token(token)
+    return payload['user_id'] if payload else None
+
 def token_required(f):
     """Decorator to require authentication for routes"""
     @wraps(f)
@@ -42,22 +155,39 @@ def token_required(f):
         if not token:
             return jsonify({'error': 'Authentication token is missing'}), 401
         
-        # Verify token
-        user_id = verify_token(token)
-        if user_id is None:
-            return jsonify({'error': 'Invalid or expired token'}), 401
+        with span('auth'):
+            # Tokens verified recently skip the signature check and the user lookup
+            principal = principal_cache.get(token)
+            if principal is None:
+                # Verify token
+                payload = decode_token(token)
+                if payload is None:
+                    return jsonify({'error': 'Invalid or expired token'}), 401
+                
+                # Get user from database
+                db = get_db_session()
+                user = db.query(User).filter_by(id=payload['user_id']).first()
+                if not user:
+                    return jsonify({'error': 'User not found'}), 401
+                
+                principal = Principal(user)
+                principal_cache.put(token, principal, payload['exp'])
         
-        # Get user from database
-        db = get_db_session()
-        try:
-            user = db.query(User).filter_by(id=user_id).first()
-            if not user:
-                return jsonify({'error': 'User not found'}), 401
-            
-            # Add user to kwargs
-            kwargs['current_user'] = user
-            return f(*args, **kwargs)
-        finally:
-            db.close()
+        # Add user to kwargs
+        g.user_id = principal.id  # For the request trace log
+        kwargs['current_user'] = principal
+        return f(*args, **kwargs)
+    
+    return decorated
+
+
+def admin_required(f):
+    """Decorator to restrict a route to ADMIN_USERNAMES (use below token_required)"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        current_user = kwargs.get('current_user')
+        if current_user is None or current_user.username not in ADMIN_USERNAMES:
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
     
     return decorated
@@ -0,0 +1,276 @@
+"""
+Hardware-aware autotuning for JailbrokeGPT
+Detects the CPU resources this process can actually use and benchmarks
+llama.cpp thread/batch settings on them, remembering the winner per model
+file and host.
+"""
+import glob
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+# Request shape the calibration optimizes for: latency of a typical chat turn
+TYPICAL_PROMPT_TOKENS = 512
+TYPICAL_REPLY_TOKENS = 128
+# Bumped when the measurement changes, so tunings saved by older versions are redone
+TUNING_VERSION = 2
+
+DEFAULT_BATCH_SIZES = (128, 256, 512)
+
+_CALIBRATION_TEXT = (
+    "The quick brown fox jumps over the lazy dog while the committee reviews "
+    "the quarterly report on distributed systems, caching and storage engines. "
+)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _parse_cpulist(text):
+    """Parse a kernel CPU list like '0-3,8-11' into a set of CPU ids"""
+    cpus = set()
+    for part in (text or '').split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def _cgroup_cpu_limit():
+    """CPUs allowed by the cgroup quota, or None if unlimited"""
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _read('/sys/fs/cgroup/cpu.max')
+    if cpu_max:
+        quota, period = cpu_max.split()[:2]
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+
+    # cgroup v1
+    quota = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') or _read('/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us')
+    period = _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us') or _read('/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us')
+    if quota and period and int(quota) > 0:
+        return int(quota) / int(period)
+    return None
+
+
+def detect_hardware() -> dict:
+    """
+    Detect the CPUs available to this process
+
+    Returns:
+        dict with logical_cpus, physical_cores (among the allowed CPUs),
+        cgroup_cpu_limit, numa_nodes (list of CPU lists) and usable_threads
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        allowed = set(os.sched_getaffinity(0))
+    else:
+        allowed = set(range(os.cpu_count() or 1))
+
+    # Hyperthread siblings share a (package, core) pair
+    cores = set()
+    for cpu in allowed:
+        topology = f'/sys/devices/system/cpu/cpu{cpu}/topology'
+        core_id = _read(f'{topology}/core_id')
+        package_id = _read(f'{topology}/physical_package_id')
+        cores.add((package_id, core_id) if core_id is not None else ('cpu', cpu))
+    physical_cores = len(cores) or len(allowed)
+
+    numa_nodes = []
+    for node in sorted(glob.glob('/sys/devices/system/node/node[0-9]*')):
+        node_cpus = _parse_cpulist(_read(f'{node}/cpulist')) & allowed
+        if node_cpus:
+            numa_nodes.append(sorted(node_cpus))
+
+    cpu_limit = _cgroup_cpu_limit()
+    usable = physical_cores
+    if cpu_limit is not None:
+        usable = min(usable, max(1, math.floor(cpu_limit)))
+
+    return {
+        'logical_cpus': len(allowed),
+        'physical_cores': physical_cores,
+        'cgroup_cpu_limit': cpu_limit,
+        'numa_nodes': numa_nodes,
+        'usable_threads': usable
+    }
+
+
+def candidate_settings(hardware: dict, batch_sizes=DEFAULT_BATCH_SIZES) -> list:
+    """
+    Thread/batch combinations worth trying on this hardware
+
+    Thread counts cluster around the usable core count, plus one NUMA
+    node's worth of cores on multi-socket machines.
+    """
+    usable = hardware['usable_threads']
+    threads = {usable, max(1, usable * 3 // 4), max(1, usable // 2)}
+    if usable < hardware['logical_cpus'] and hardware['cgroup_cpu_limit'] is None:
+        # Hyperthreads rarely help decode, but are cheap to check
+        threads.add(hardware['logical_cpus'])
+    if len(hardware['numa_nodes']) > 1:
+        threads.add(min(usable, len(hardware['numa_nodes'][0])))
+
+    return [
+        {'n_threads': t, 'n_batch': b}
+        for t in sorted(threads)
+        for b in batch_sizes
+    ]
+
+
+def measure(model_path: str, n_ctx: int, settings: dict, prompt_tokens: int = TYPICAL_PROMPT_TOKENS,
+            reply_tokens: int = 16) -> dict:
+    """
+    Time prompt evaluation and token generation for one setting
+
+    The prompt must be longer than the batch sizes being compared, or
+    every n_batch evaluates it in one batch and they all look the same.
+
+    Returns:
+        dict with prompt_tps and generate_tps (tokens per second)
+    """
+    from llama_cpp import Llama
+
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_threads=settings['n_threads'],
+        n_threads_batch=settings['n_threads'],
+        n_batch=settings['n_batch'],
+        n_gpu_layers=0,
+        use_mmap=True,
+        verbose=False
+    )
+    try:
+        text = _CALIBRATION_TEXT * (prompt_tokens // 20 + 1)
+        tokens = llm.tokenize(text.encode('utf-8'))[:min(prompt_tokens, n_ctx - reply_tokens - 1)]
+
+        llm.reset()
+        start = time.perf_counter()
+        llm.eval(tokens)
+        prompt_seconds = time.perf_counter() - start
+
+        # Decode one token at a time; which token doesn't matter for speed
+        start = time.perf_counter()
+        for _ in range(reply_tokens):
+            llm.eval([tokens[-1]])
+        generate_seconds = time.perf_counter() - start
+    finally:
+        del llm
+
+    return {
+        'prompt_tps': round(len(tokens) / prompt_seconds, 2),
+        'generate_tps': round(reply_tokens / generate_seconds, 2)
+    }
+
+
+def calibrate(model_path: str, n_ctx: int, hardware: dict, batch_sizes=DEFAULT_BATCH_SIZES) -> dict:
+    """
+    Benchmark every candidate setting and pick the one with the lowest
+    estimated latency for a typical chat turn
+
+    Returns:
+        dict with the chosen settings and all measurements
+    """
+    candidates = candidate_settings(hardware, batch_sizes)
+
+    # Untimed run, so the first candidate doesn't pay for paging in the weights
+    try:
+        measure(model_path, n_ctx, candidates[0], prompt_tokens=32, reply_tokens=1)
+    except Exception as e:
+        print(f"Autotune: warm-up failed: {e}")
+
+    results = []
+    for settings in candidates:
+        try:
+            speed = measure(model_path, n_ctx, settings)
+        except Exception as e:
+            print(f"Autotune: {settings} failed: {e}")
+            continue
+
+        latency = TYPICAL_PROMPT_TOKENS / speed['prompt_tps'] + TYPICAL_REPLY_TOKENS / speed['generate_tps']
+        results.append(dict(settings, **speed, estimated_latency=round(latency, 3)))
+        print(f"Autotune: {settings} -> {speed['prompt_tps']} prompt tok/s, "
+              f"{speed['generate_tps']} gen tok/s")
+
+    if not results:
+        raise RuntimeError("Autotune calibration failed for every setting")
+
+    best = min(results, key=lambda r: r['estimated_latency'])
+    return {
+        'settings': {'n_threads': best['n_threads'], 'n_batch': best['n_batch']},
+        'results': results
+    }
+
+
+class TuningStore:
+    """JSON file of tuned settings keyed by model file and host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model_file, hardware):
+        # Different CPU limits on the same host (e.g. a resized container) need their own tuning
+        return f"v{TUNING_VERSION}:{model_file}@{socket.gethostname()}:{hardware['usable_threads']}/{hardware['logical_cpus']}"
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, model_file, hardware):
+        with self._lock:
+            return self._load().get(self.key(model_file, hardware))
+
+    def put(self, model_file, hardware, tuning):
+        with self._lock:
+            data = self._load()
+            data[self.key(model_file, hardware)] = dict(tuning, hardware=hardware, tuned_at=time.time())
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def get_tuned_settings(model_path: str, n_ctx: int, store: TuningStore, retune: bool = False) -> dict:
+    """
+    Get thread/batch settings for this model and host, calibrating on first use
+
+    Args:
+        model_path: Path to the GGUF model file
+        n_ctx: Context window the model will run with
+        store: Where tuned settings are remembered
+        retune: Calibrate again even if settings are stored
+
+    Returns:
+        dict with n_threads and n_batch
+    """
+    hardware = detect_hardware()
+    model_file = os.path.basename(model_path)
+
+    tuning = None if retune else store.get(model_file, hardware)
+    if tuning is None:
+        print(f"Autotuning for {hardware['usable_threads']} usable cores "
+              f"({hardware['logical_cpus']} logical, {len(hardware['numa_nodes']) or 1} NUMA nodes)...")
+        tuning = calibrate(model_path, n_ctx, hardware)
+        store.put(model_file, hardware, tuning)
+
+    print(f"Autotuned settings: {tuning['settings']}")
+    return tuning['settings']
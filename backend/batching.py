@@ -0,0 +1,357 @@
+"""
+Continuous batching for JailbrokeGPT
+Decodes several generations at once through one llama.cpp model. Each
+generation gets its own KV sequence; new ones join at the next token
+boundary and finished ones leave without stalling the rest.
+"""
+import codecs
+import queue
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class _BatchContext:
+    """
+    A llama.cpp context with one KV sequence per slot, driven through the
+    low-level API that the high-level Llama class doesn't expose.
+    """
+
+    def __init__(self, llm, n_slots, n_ctx_per_slot, n_batch, n_threads):
+        import llama_cpp
+
+        self._lib = llama_cpp
+        self.n_vocab = llm.n_vocab()
+
+        params = llama_cpp.llama_context_default_params()
+        # Each sequence gets n_ctx / n_seq_max of the cache
+        params.n_ctx = n_ctx_per_slot * n_slots
+        params.n_batch = n_batch
+        params.n_ubatch = n_batch
+        params.n_seq_max = n_slots
+        params.n_threads = n_threads
+        params.n_threads_batch = n_threads
+
+        new_context = getattr(llama_cpp, 'llama_init_from_model', None) or llama_cpp.llama_new_context_with_model
+        self.ctx = new_context(llm._model.model, params)
+        if not self.ctx:
+            raise RuntimeError("Failed to create the batched llama.cpp context")
+        self.batch = llama_cpp.llama_batch_init(n_batch, 0, n_slots)
+
+    def decode(self, entries):
+        """
+        Evaluate one batch
+
+        Args:
+            entries: List of (token, position, sequence, want_logits)
+        """
+        batch = self.batch
+        for i, (token, pos, seq, want_logits) in enumerate(entries):
+            batch.token[i] = token
+            batch.pos[i] = pos
+            batch.n_seq_id[i] = 1
+            batch.seq_id[i][0] = seq
+            batch.logits[i] = want_logits
+        batch.n_tokens = len(entries)
+
+        result = self._lib.llama_decode(self.ctx, batch)
+        if result != 0:
+            raise RuntimeError(f"llama_decode failed ({result})")
+
+    def logits(self, index):
+        """Logits for the index-th token of the last batch"""
+        ptr = self._lib.llama_get_logits_ith(self.ctx, index)
+        return np.ctypeslib.as_array(ptr, shape=(self.n_vocab,)).copy()
+
+    def clear(self, seq):
+        """Drop a sequence's KV cells so its slot can be reused"""
+        lib = self._lib
+        if hasattr(lib, 'llama_memory_seq_rm'):
+            lib.llama_memory_seq_rm(lib.llama_get_memory(self.ctx), seq, -1, -1)
+        else:
+            lib.llama_kv_cache_seq_rm(self.ctx, seq, -1, -1)
+
+    def close(self):
+        self._lib.llama_batch_free(self.batch)
+        self._lib.llama_free(self.ctx)
+
+
+# Sampling defaults of Llama.__call__, so batched and single-stream replies match
+DEFAULT_TOP_K = 40
+DEFAULT_MIN_P = 0.05
+DEFAULT_REPEAT_PENALTY = 1.1
+REPEAT_PENALTY_WINDOW = 64  # llama.cpp's penalty_last_n
+
+
+class _Sequence:
+    """One generation in flight"""
+
+    def __init__(self, tokens, max_tokens, temperature, top_p, stop,
+                 top_k=DEFAULT_TOP_K, min_p=DEFAULT_MIN_P, repeat_penalty=DEFAULT_REPEAT_PENALTY):
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.top_k = top_k
+        self.min_p = min_p
+        self.repeat_penalty = repeat_penalty
+        self.stop = [s for s in (stop or []) if s]
+        self.recent = deque(tokens[-REPEAT_PENALTY_WINDOW:], maxlen=REPEAT_PENALTY_WINDOW)
+
+        self.slot = None
+        self.n_past = 0          # Tokens already in the KV cache
+        self.pending = None      # Sampled token not yet evaluated
+        self.generated = 0
+        self.text = ''
+        self.emitted = 0         # Characters of text already sent
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.output = queue.Queue()
+        self.cancelled = False
+
+
+class _BatchStream:
+    """Iterator over one batched generation's text; close() cancels it"""
+
+    def __init__(self, seq):
+        self._seq = seq
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        kind, value = self._seq.output.get()
+        if kind == 'text':
+            return {'choices': [{'text': value}]}
+        self._done = True
+        if kind == 'error':
+            raise RuntimeError(value)
+        raise StopIteration
+
+    def close(self):
+        if not self._done:
+            self._done = True
+            self._seq.cancelled = True
+
+
+class BatchedEngine:
+    """
+    Runs up to n_slots generations together through a single model.
+
+    Every step decodes one token for each generating sequence plus as much
+    of the waiting prompts as fits in n_batch, so new requests are prefilled
+    alongside ongoing ones instead of waiting for them to finish.
+    """
+
+    def __init__(self, llm, n_slots: int, n_ctx: int, n_batch: int = 512, n_threads: int = 4, context=None):
+        """
+        Args:
+            llm: Loaded Llama instance (provides weights and the tokenizer)
+            n_slots: Maximum concurrent generations
+            n_ctx: Context window of each generation
+            n_batch: Maximum tokens evaluated per step
+            n_threads: CPU threads for decoding
+            context: Batch context to decode with (default: a new llama.cpp context)
+        """
+        self.llm = llm
+        self.n_slots = n_slots
+        self.n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.context = context or _BatchContext(llm, n_slots, n_ctx, n_batch, n_threads)
+        self.eos = llm.token_eos()
+
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._active = []
+        self._free_slots = list(range(n_slots))
+        self._rng = np.random.default_rng()
+
+        self.steps = 0
+        self.tokens_generated = 0
+        self.batch_tokens = 0
+
+        self._thread = threading.Thread(target=self._run, name='batched-decode', daemon=True)
+        self._thread.start()
+
+    def __call__(self, prompt: str, stream: bool = False, max_tokens: int = 512, temperature: float = 0.7,
+                 top_p: float = 0.9, stop: list = None, echo: bool = False, top_k: int = DEFAULT_TOP_K,
+                 min_p: float = DEFAULT_MIN_P, repeat_penalty: float = DEFAULT_REPEAT_PENALTY, **params):
+        """
+        Queue a completion. Mirrors Llama.__call__ for the parameters ModelLoader uses.
+
+        Returns:
+            Completion dict, or an iterator of chunk dicts when stream=True
+        """
+        tokens = self.llm.tokenize(prompt.encode('utf-8'), special=True)
+        # Keep the end of prompts that leave no room for the reply
+        tokens = tokens[-max(1, self.n_ctx - max_tokens):]
+        seq = _Sequence(tokens, max_tokens, temperature, top_p, stop,
+                        top_k=top_k, min_p=min_p, repeat_penalty=repeat_penalty)
+
+        with self._cond:
+            self._waiting.append(seq)
+            self._cond.notify()
+
+        chunks = _BatchStream(seq)
+        if stream:
+            return chunks
+        return {'choices': [{'text': ''.join(chunk['choices'][0]['text'] for chunk in chunks)}]}
+
+    def get_stats(self) -> dict:
+        """Get slot usage and average batch size"""
+        with self._cond:
+            return {
+                'n_slots': self.n_slots,
+                'active': len(self._active),
+                'waiting': len(self._waiting),
+                'steps': self.steps,
+                'tokens_generated': self.tokens_generated,
+                'avg_batch_tokens': round(self.batch_tokens / self.steps, 2) if self.steps else 0.0
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._active and not self._waiting:
+                    self._cond.wait()
+                # New requests join at the token boundary
+                while self._waiting and self._free_slots:
+                    seq = self._waiting.pop(0)
+                    seq.slot = self._free_slots.pop(0)
+                    self._active.append(seq)
+                active = list(self._active)
+
+            try:
+                self._step(active)
+            except Exception as e:
+                for seq in active:
+                    self._finish(seq, error=str(e))
+
+    def _step(self, active):
+        """Decode one token for generating sequences and prefill waiting prompts"""
+        for seq in active:
+            if seq.cancelled:
+                self._finish(seq)
+        active = [seq for seq in active if seq.slot is not None]
+
+        entries = []
+        sampled_from = []  # (sequence, batch index of its logits)
+
+        # Generating sequences first, one token each, to keep their latency steady
+        for seq in active:
+            if seq.pending is not None:
+                sampled_from.append((seq, len(entries)))
+                entries.append((seq.pending, seq.n_past, seq.slot, True))
+                seq.n_past += 1
+                seq.pending = None
+
+        # Fill the rest of the batch with prompt chunks
+        for seq in active:
+            remaining = len(seq.tokens) - seq.n_past
+            room = self.n_batch - len(entries)
+            if seq.generated or remaining <= 0 or room <= 0:
+                continue
+            chunk = seq.tokens[seq.n_past:seq.n_past + room]
+            for i, token in enumerate(chunk):
+                last = seq.n_past + i == len(seq.tokens) - 1
+                if last:
+                    sampled_from.append((seq, len(entries)))
+                entries.append((token, seq.n_past + i, seq.slot, last))
+            seq.n_past += len(chunk)
+
+        if not entries:
+            return
+
+        self.context.decode(entries)
+        self.steps += 1
+        self.batch_tokens += len(entries)
+
+        for seq, index in sampled_from:
+            token = self._sample(self.context.logits(index), seq)
+            self._accept(seq, token)
+
+    def _sample(self, logits, seq):
+        """
+        Pick the next token the way Llama.__call__'s sampler chain does:
+        repeat penalty, top_k, top_p, min_p, then temperature
+        """
+        logits = logits.astype(np.float64)
+        if seq.repeat_penalty != 1.0 and seq.recent:
+            recent = np.fromiter(set(seq.recent), dtype=np.int64)
+            penalized = logits[recent]
+            logits[recent] = np.where(penalized > 0, penalized / seq.repeat_penalty,
+                                      penalized * seq.repeat_penalty)
+
+        if seq.temperature <= 0:
+            return int(np.argmax(logits))
+
+        # Candidates best first, cut to top_k
+        k = seq.top_k if 0 < seq.top_k < len(logits) else len(logits)
+        candidates = np.argpartition(-logits, k - 1)[:k]
+        candidates = candidates[np.argsort(-logits[candidates])]
+        probs = np.exp(logits[candidates] - logits[candidates[0]])
+        probs /= probs.sum()
+
+        if seq.top_p < 1.0:
+            cut = int(np.searchsorted(np.cumsum(probs), seq.top_p)) + 1
+            candidates, probs = candidates[:cut], probs[:cut]
+        if seq.min_p > 0.0:
+            keep = probs >= seq.min_p * probs[0]
+            candidates, probs = candidates[keep], probs[keep]
+
+        scaled = logits[candidates] / seq.temperature
+        probs = np.exp(scaled - scaled.max())
+        probs /= probs.sum()
+        return int(self._rng.choice(candidates, p=probs))
+
+    def _accept(self, seq, token):
+        """Add a sampled token to a sequence and send whatever text is final"""
+        if token == self.eos:
+            self._finish(seq)
+            return
+
+        seq.generated += 1
+        seq.recent.append(token)
+        self.tokens_generated += 1
+        seq.text += seq.decoder.decode(self.llm.detokenize([token]))
+
+        for stop in seq.stop:
+            index = seq.text.find(stop)
+            if index != -1:
+                seq.text = seq.text[:index]
+                self._finish(seq)
+                return
+
+        if seq.generated >= seq.max_tokens or seq.n_past + 1 >= self.n_ctx:
+            self._finish(seq)
+            return
+
+        # Hold back text that could be the start of a stop sequence
+        hold = 0
+        for stop in seq.stop:
+            for n in range(min(len(stop) - 1, len(seq.text)), 0, -1):
+                if seq.text.endswith(stop[:n]):
+                    hold = max(hold, n)
+                    break
+        if len(seq.text) - hold > seq.emitted:
+            seq.output.put(('text', seq.text[seq.emitted:len(seq.text) - hold]))
+            seq.emitted = len(seq.text) - hold
+
+        seq.pending = token
+
+    def _finish(self, seq, error=None):
+        """Send the rest of a sequence's output and free its slot"""
+        if seq.slot is None:
+            return
+        if error is None and seq.emitted < len(seq.text) and not seq.cancelled:
+            seq.output.put(('text', seq.text[seq.emitted:]))
+        seq.output.put(('error', error) if error else ('done', None))
+
+        self.context.clear(seq.slot)
+        with self._cond:
+            self._active.remove(seq)
+            self._free_slots.append(seq.slot)
+        seq.slot = None
@@ -0,0 +1,323 @@
+"""
+Benchmark harness for JailbrokeGPT
+
+    python benchmark.py load --users 8 --turns 5 --output results.json
+        Drives the real Flask app with a fake model (fixed token rate) and a
+        throwaway SQLite database, and reports per-endpoint latency
+        percentiles, requests/s, DB queries per request and tokens/s.
+
+    python benchmark.py generate --runs 5 --max-tokens 128
+        Loads the real model from .env and measures generate() tokens/s and
+        time to first token.
+
+Results are written as JSON so runs can be diffed between commits.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+FAKE_WORDS = ["the", "model", "returns", "a", "fixed", "reply", "for", "benchmarks", "only"]
+
+
+class FakeBackend:
+    """Stands in for Llama: deterministic text at a fixed token rate"""
+
+    def __init__(self, tokens_per_second: float, prompt_tokens_per_second: float, reply_tokens: int):
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.reply_tokens = reply_tokens
+        self._lock = threading.Lock()
+        self.tokens_generated = 0
+
+    def _count(self, n):
+        with self._lock:
+            self.tokens_generated += n
+
+    def __call__(self, prompt, stream=False, max_tokens=512, **params):
+        n = min(max_tokens, self.reply_tokens)
+        words = [FAKE_WORDS[i % len(FAKE_WORDS)] for i in range(n)]
+        time.sleep(len(prompt.split()) / self.prompt_tokens_per_second)
+
+        if stream:
+            def chunks():
+                for i, word in enumerate(words):
+                    time.sleep(1 / self.tokens_per_second)
+                    self._count(1)
+                    yield {'choices': [{'text': (' ' if i else '') + word}]}
+            return chunks()
+
+        time.sleep(n / self.tokens_per_second)
+        self._count(n)
+        return {'choices': [{'text': ' '.join(words)}]}
+
+
+def install_fake_model(tokens_per_second, prompt_tokens_per_second, reply_tokens):
+    """
+    Swap ModelLoader for a subclass backed by FakeBackend. Must run before
+    app is imported, since app builds its ModelLoader at import time.
+
+    Returns:
+        The FakeBackend, for reading its token counter
+    """
+    import model_loader
+
+    backend = FakeBackend(tokens_per_second, prompt_tokens_per_second, reply_tokens)
+
+    class FakeModelLoader(model_loader.ModelLoader):
+        def load_model(self, n_ctx=2048, **kwargs):
+            self.load_started_at = time.time()
+            self.n_ctx = n_ctx
+            self.model = backend
+            self._set_phase('ready')
+            return self.model
+
+        def load_model_async(self, **kwargs):
+            self.load_model(**kwargs)
+
+        def count_tokens(self, text):
+            return len(text.split())
+
+    model_loader.ModelLoader = FakeModelLoader
+    return backend
+
+
+class QueryCounter:
+    """Counts SQL statements per thread, so each request's queries can be attributed"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self._local = threading.local()
+        self.total = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+        self.total += 1
+
+    def current(self):
+        return getattr(self._local, 'count', 0)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+class LoadGenerator:
+    """Simulated users driving the Flask app through its test client"""
+
+    def __init__(self, app, query_counter, users, turns, stream, prompt_words):
+        self.app = app
+        self.queries = query_counter
+        self.users = users
+        self.turns = turns
+        self.stream = stream
+        self.prompt = ' '.join(FAKE_WORDS[i % len(FAKE_WORDS)] for i in range(prompt_words))
+
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.query_counts = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def _request(self, client, name, method, url, **kwargs):
+        before = self.queries.current()
+        start = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        response.get_data()  # Streams are only timed once fully read
+        elapsed = time.perf_counter() - start
+        queries = self.queries.current() - before
+
+        with self._lock:
+            self.latencies[name].append(elapsed * 1000)
+            self.query_counts[name].append(queries)
+            if response.status_code >= 400:
+                self.errors[name] += 1
+        return response
+
+    def _user(self, index, run_id):
+        client = self.app.test_client()
+        credentials = {'username': f'bench_{run_id}_{index}', 'password': 'benchmark'}
+        self._request(client, 'POST /api/auth/register', 'POST', '/api/auth/register', json=credentials)
+        token = self._request(client, 'POST /api/auth/login', 'POST', '/api/auth/login',
+                              json=credentials).get_json()['token']
+        headers = {'Authorization': f'Bearer {token}'}
+
+        conversation = self._request(client, 'POST /api/conversations', 'POST', '/api/conversations',
+                                     json={}, headers=headers).get_json()['conversation']
+        for turn in range(self.turns):
+            self._request(client, 'POST /api/chat', 'POST', '/api/chat', headers=headers, json={
+                'conversation_id': conversation['id'],
+                'prompt': f'{self.prompt} {turn}',
+                'stream': self.stream
+            })
+        self._request(client, 'GET /api/conversations/<id>', 'GET',
+                      f"/api/conversations/{conversation['id']}", headers=headers)
+        self._request(client, 'GET /api/conversations', 'GET', '/api/conversations', headers=headers)
+
+    def run(self):
+        run_id = int(time.time())
+        threads = [threading.Thread(target=self._user, args=(i, run_id)) for i in range(self.users)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start
+
+    def endpoint_stats(self):
+        stats = {}
+        for name, values in sorted(self.latencies.items()):
+            stats[name] = {
+                'requests': len(values),
+                'errors': self.errors[name],
+                'p50_ms': round(percentile(values, 50), 2),
+                'p95_ms': round(percentile(values, 95), 2),
+                'p99_ms': round(percentile(values, 99), 2),
+                'mean_ms': round(statistics.mean(values), 2),
+                'queries_per_request': round(statistics.mean(self.query_counts[name]), 2)
+            }
+        return stats
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_load(args):
+    """Benchmark the app end to end with the fake model and SQLite"""
+    db_dir = tempfile.mkdtemp(prefix='jailbrokegpt-bench-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    os.environ.setdefault('INFERENCE_QUEUE_SIZE', str(max(32, args.users * 2)))
+
+    backend = install_fake_model(args.tokens_per_second, args.prompt_tokens_per_second, args.reply_tokens)
+
+    import app as app_module
+    from models import get_engine, get_pool_stats
+    app_module.scheduler.set_concurrency(args.model_concurrency)
+    queries = QueryCounter(get_engine())
+
+    generator = LoadGenerator(app_module.app, queries, args.users, args.turns, args.stream, args.prompt_words)
+    duration = generator.run()
+    endpoints = generator.endpoint_stats()
+    total_requests = sum(e['requests'] for e in endpoints.values())
+
+    return {
+        'benchmark': 'load',
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'config': {k: v for k, v in vars(args).items() if k != 'func'},
+        'duration_s': round(duration, 3),
+        'requests': total_requests,
+        'requests_per_s': round(total_requests / duration, 2),
+        'tokens_generated': backend.tokens_generated,
+        'tokens_per_s': round(backend.tokens_generated / duration, 2),
+        'db_queries': queries.total,
+        'endpoints': endpoints,
+        'queue': app_module.scheduler.get_stats(),
+        'db_pool': get_pool_stats()
+    }
+
+
+def run_generate(args):
+    """Microbenchmark the real model's generate() and generate_stream()"""
+    from dotenv import load_dotenv
+    from model_loader import ModelLoader
+    load_dotenv()
+
+    loader = ModelLoader(
+        os.getenv('MODEL_REPO', 'v8karlo/UNCENSORED-TinyLlama-1.1B-intermediate-step-1431k-3T-Q5_K_M-GGUF'),
+        os.getenv('MODEL_FILE', 'uncensored-tinyllama-1.1b-intermediate-step-1431k-3t-q5_k_m.gguf')
+    )
+    load_start = time.perf_counter()
+    loader.load_model(n_ctx=int(os.getenv('N_CTX', 2048)), n_threads=int(os.getenv('N_THREADS', 0)) or None,
+                      n_batch=int(os.getenv('N_BATCH', 512)))
+    load_seconds = time.perf_counter() - load_start
+
+    prompt = f"User: {args.prompt}\nAssistant:"
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        first_token = None
+        chunks = []
+        for chunk in loader.generate_stream(prompt, max_tokens=args.max_tokens, temperature=args.temperature):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            chunks.append(chunk)
+        elapsed = time.perf_counter() - start
+        tokens = loader.count_tokens(''.join(chunks))
+        runs.append({
+            'seconds': round(elapsed, 3),
+            'ttft_s': round(first_token, 3) if first_token is not None else None,
+            'tokens': tokens,
+            'tokens_per_s': round(tokens / elapsed, 2) if elapsed else None
+        })
+        print(f"  {tokens} tokens in {elapsed:.2f}s ({runs[-1]['tokens_per_s']} tok/s)")
+
+    return {
+        'benchmark': 'generate',
+        'revision': git_revision(),
+        'timestamp': time.time(),
+        'config': {k: v for k, v in vars(args).items() if k != 'func'},
+        'model_file': loader.model_file,
+        'runtime': loader.runtime_settings,
+        'load_s': round(load_seconds, 3),
+        'runs': runs,
+        'median_tokens_per_s': statistics.median(r['tokens_per_s'] for r in runs if r['tokens_per_s']),
+        'median_ttft_s': statistics.median(r['ttft_s'] for r in runs if r['ttft_s'] is not None)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='JailbrokeGPT benchmarks')
+    parser.add_argument('--output', help='Write results JSON to this file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    load = commands.add_parser('load', help='Load-test the app with a fake model and SQLite')
+    load.add_argument('--users', type=int, default=8, help='Concurrent simulated users')
+    load.add_argument('--turns', type=int, default=5, help='Chat turns per user')
+    load.add_argument('--stream', action='store_true', help='Use streaming chat')
+    load.add_argument('--prompt-words', type=int, default=30)
+    load.add_argument('--tokens-per-second', type=float, default=200.0, help='Fake model decode rate')
+    load.add_argument('--prompt-tokens-per-second', type=float, default=5000.0, help='Fake model prompt rate')
+    load.add_argument('--reply-tokens', type=int, default=64)
+    load.add_argument('--model-concurrency', type=int, default=1, help='Generations the fake model runs at once')
+    load.add_argument('--database-url', help='Database to use instead of a fresh SQLite file')
+    load.set_defaults(func=run_load)
+
+    generate = commands.add_parser('generate', help='Measure real-model tokens/s')
+    generate.add_argument('--runs', type=int, default=5)
+    generate.add_argument('--max-tokens', type=int, default=128)
+    generate.add_argument('--temperature', type=float, default=0.7)
+    generate.add_argument('--prompt', default='Write a Python function that reverses a linked list.')
+    generate.set_defaults(func=run_generate)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
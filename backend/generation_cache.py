@@ -0,0 +1,154 @@
+"""
+Generation cache for JailbrokeGPT
+Exact-match cache of model outputs for deterministic (low temperature)
+generations, with an in-memory LRU tier and an optional SQLite tier.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# A disk hit only rewrites last_access if the stored one is older than this
+# (seconds), so repeat hits don't each cost a write and a commit
+ACCESS_UPDATE_INTERVAL = 60
+
+
+class GenerationCache:
+    """
+    Two-tier cache of generated text keyed by a hash of the generation inputs.
+
+    Both tiers are bounded by size and evict least recently used entries.
+    Memory hits are promoted from the SQLite tier on read.
+    """
+
+    def __init__(self, max_memory_mb: float = 64, db_path: str = None, max_disk_mb: float = 512):
+        """
+        Args:
+            max_memory_mb: Budget for the in-memory tier
+            db_path: SQLite file for the persistent tier (None for memory only)
+            max_disk_mb: Budget for the persistent tier
+        """
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.max_disk_bytes = int(max_disk_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> text
+        self._memory_bytes = 0
+
+        self._db = None
+        self._disk_bytes = 0
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS ix_generations_last_access ON generations (last_access)")
+            self._db.commit()
+            self._disk_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(prompt, model_file, max_tokens, temperature, top_p, stop) -> str:
+        """Hash every input that affects the generated text"""
+        payload = json.dumps([prompt, model_file, max_tokens, temperature, top_p, stop])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """
+        Look up a cached generation
+
+        Returns:
+            The cached text, or None on a miss
+        """
+        with self._lock:
+            text = self._memory.get(key)
+            if text is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return text
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, last_access FROM generations WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    if now - row[1] > ACCESS_UPDATE_INTERVAL:
+                        self._db.execute("UPDATE generations SET last_access = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                    self._put_memory(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, text: str):
+        """Store a generation in both tiers"""
+        with self._lock:
+            self.stores += 1
+            self._put_memory(key, text)
+
+            if self._db is not None:
+                size = len(text.encode('utf-8'))
+                old = self._db.execute("SELECT size FROM generations WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO generations (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, text, size, time.time())
+                )
+                self._disk_bytes += size - (old[0] if old else 0)
+                self._evict_disk()
+                self._db.commit()
+
+    def get_stats(self) -> dict:
+        """Get hit rates and tier sizes"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'stores': self.stores,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_bytes': self._disk_bytes if self._db is not None else None
+            }
+
+    def _put_memory(self, key, text):
+        """Add to the memory tier and evict down to budget (caller holds the lock)"""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = text
+        self._memory_bytes += len(text)
+
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.evictions += 1
+
+    def _evict_disk(self):
+        """Delete least recently used rows until the disk tier fits (caller holds the lock)"""
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM generations ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute("DELETE FROM generations WHERE key = ?", (key,))
+                self._disk_bytes -= size
+                self.evictions += 1
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
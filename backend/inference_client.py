@@ -0,0 +1,410 @@
+"""
+Inference service client for JailbrokeGPT
+Used by the web role in place of ModelLoader when INFERENCE_URL is set:
+same generate()/generate_stream()/count_tokens() interface, but every call
+goes to inference_server.py over pooled keep-alive connections. Nothing
+here imports llama.cpp.
+"""
+import http.client
+import json
+import queue
+import socket
+import threading
+import time
+from scheduler import QueueFullError, ModelNotReadyError, PRIORITY_INTERACTIVE, PRIORITY_NAMES
+from tracing import record_span
+
+# Errors that mean a pooled keep-alive connection was closed by the service
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP over a Unix domain socket"""
+
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class ConnectionPool:
+    """Keeps up to max_size idle keep-alive connections to the service"""
+
+    def __init__(self, url: str, max_size: int = 16, timeout: float = 300.0):
+        """
+        Args:
+            url: unix:///path/to.sock or http://host:port
+            max_size: Idle connections kept for reuse
+            timeout: Socket timeout in seconds (also the longest gap between streamed tokens)
+        """
+        self.url = url
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_size)
+        self.created = 0
+        if url.startswith('unix://'):
+            self._socket_path = url[len('unix://'):]
+        else:
+            self._socket_path = None
+            host, _, port = url.split('://', 1)[-1].rstrip('/').partition(':')
+            self._host, self._port = host, int(port or 80)
+
+    def get(self):
+        """Get an idle connection, or a new one. Returns (connection, reused)"""
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            self.created += 1
+            if self._socket_path:
+                return _UnixHTTPConnection(self._socket_path, self.timeout), False
+            return http.client.HTTPConnection(self._host, self._port, timeout=self.timeout), False
+
+    def put(self, conn):
+        """Return a connection whose response has been fully read"""
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def get_stats(self) -> dict:
+        return {'idle': self._idle.qsize(), 'created': self.created}
+
+
+def _record_remote_spans(response):
+    """Re-record the service's Server-Timing stages (queue, generate) in this request's trace"""
+    header = response.getheader('Server-Timing')
+    if not header:
+        return
+    for entry in header.split(','):
+        name, _, duration = entry.strip().partition(';dur=')
+        if name and name != 'total' and duration:
+            record_span(name, float(duration) / 1000)
+
+
+class RemoteTokenStream:
+    """
+    Iterator over text chunks streamed from the service, like TokenStream.
+    Closing it early drops the connection, which stops generation remotely.
+    """
+
+    def __init__(self, pool, conn, response):
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+        self._started = time.perf_counter()
+        self._first_at = None
+        self._finished = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            line = self._response.readline()
+        except BaseException:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise RuntimeError("Inference service closed the stream")
+        event = json.loads(line)
+        if 'text' in event:
+            if self._first_at is None:
+                self._first_at = time.perf_counter()
+            return event['text']
+        self._finished = True
+        self.close()
+        if 'error' in event:
+            raise RuntimeError(event['error'])
+        raise StopIteration
+
+    def close(self):
+        """Stop reading; hangs up on the service unless the stream had ended"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._finished:
+            self._response.read()  # Consume the chunked terminator so the connection can be reused
+            self._pool.put(self._conn)
+        else:
+            self._conn.close()
+        record_span('generate', time.perf_counter() - self._started)
+        if self._first_at is not None:
+            record_span('first_token', self._first_at - self._started)
+
+
+class RemoteScheduler:
+    """The parts of InferenceScheduler the web role uses, answered from the service's status"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def check_capacity(self):
+        """
+        Fail fast if the service's queue is already full
+
+        Raises:
+            QueueFullError: If the queue is full
+        """
+        stats = self.get_stats()
+        if stats and stats['queue_depth'] >= stats['max_queue']:
+            service = (stats['service_avg_ms'] / 1000) or 1.0
+            retry_after = max(1, int(service * (stats['queue_depth'] + 1) / stats['max_concurrency']) + 1)
+            raise QueueFullError("Inference queue is full", retry_after)
+
+    def waiting(self, priority: int = None) -> int:
+        """Number of requests waiting, optionally only those of one priority class"""
+        stats = self.get_stats()
+        if not stats:
+            return 0
+        if priority is None:
+            return stats['queue_depth']
+        return stats['queue_depth_by_priority'].get(PRIORITY_NAMES.get(priority, str(priority)), 0)
+
+    def get_stats(self) -> dict:
+        """Queue stats from the service, or None if it can't be reached"""
+        status = self.client.get_status()
+        return status.get('queue')
+
+
+class InferenceClient:
+    """Drop-in for ModelLoader that forwards generations to the inference service"""
+
+    def __init__(self, url: str, pool_size: int = 16, timeout: float = 300.0, status_ttl: float = 0.5):
+        """
+        Args:
+            url: Service address, unix:///path/to.sock or http://127.0.0.1:port
+            pool_size: Idle keep-alive connections kept for reuse
+            timeout: Socket timeout in seconds
+            status_ttl: Seconds a /status response is reused for readiness and queue checks
+        """
+        self.url = url
+        self.pool = ConnectionPool(url, max_size=pool_size, timeout=timeout)
+        self.scheduler = RemoteScheduler(self)
+        self.status_ttl = status_ttl
+        self._status = None
+        self._status_at = 0.0
+        self._status_lock = threading.Lock()
+
+    def _request(self, method, path, body=None):
+        """
+        Send a request on a pooled connection
+
+        Returns:
+            (connection, response) with the response body unread
+
+        Raises:
+            ModelNotReadyError: If the service can't be reached
+        """
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        while True:
+            conn, reused = self.pool.get()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                return conn, conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise ModelNotReadyError("Inference service closed the connection")
+                # The service dropped an idle keep-alive connection; try another
+            except OSError as e:
+                conn.close()
+                raise ModelNotReadyError(f"Inference service unavailable: {e}")
+
+    def _read_json(self, conn, response):
+        """Read a JSON response, return the connection to the pool and raise on service errors"""
+        data = json.loads(response.read() or b'{}')
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(conn)
+        self._raise_for_status(response, data)
+        return data
+
+    def _raise_for_status(self, response, data):
+        if response.status == 429:
+            raise QueueFullError(data.get('error', 'Inference queue is full'), data.get('retry_after', 1))
+        if response.status == 503:
+            raise ModelNotReadyError(data.get('error', 'Model not ready'), data.get('retry_after', 5))
+        if response.status >= 400:
+            raise RuntimeError(f"Inference service error {response.status}: {data.get('error', data)}")
+
+    def _call(self, method, path, body=None):
+        conn, response = self._request(method, path, body)
+        _record_remote_spans(response)
+        return self._read_json(conn, response)
+
+    def get_status(self, max_age: float = None) -> dict:
+        """
+        Get the service's /status, reusing a recent copy
+
+        Returns:
+            Status dict, or {} if the service can't be reached
+        """
+        max_age = self.status_ttl if max_age is None else max_age
+        with self._status_lock:
+            if self._status is not None and time.monotonic() - self._status_at < max_age:
+                return self._status
+        try:
+            status = self._call('GET', '/status')
+        except (ModelNotReadyError, RuntimeError) as e:
+            status = {'error': str(e)}
+        with self._status_lock:
+            self._status = status
+            self._status_at = time.monotonic()
+        return status
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.get_status().get('load', {}).get('ready'))
+
+    @property
+    def runtime_settings(self) -> dict:
+        return self.get_status().get('runtime') or {}
+
+    @property
+    def n_ctx(self) -> int:
+        return self.get_status().get('n_ctx')
+
+    def get_load_status(self) -> dict:
+        """Get the service's load phase and progress, for readiness checks"""
+        status = self.get_status()
+        if 'load' in status:
+            return status['load']
+        return {'ready': False, 'phase': 'unreachable', 'progress': 0.0, 'error': status.get('error'),
+                'phase_seconds': None, 'load_seconds': None}
+
+    def check_ready(self, retry_after: int = 5):
+        """
+        Fail fast if the service can't serve generations yet
+
+        Raises:
+            ModelNotReadyError: While loading, if loading failed or if the service is down
+        """
+        load = self.get_load_status()
+        if load['ready']:
+            return
+        if load['phase'] == 'failed':
+            raise ModelNotReadyError(f"Model failed to load: {load['error']}", retry_after)
+        if load['phase'] == 'unreachable':
+            raise ModelNotReadyError(f"Inference service unavailable: {load['error']}", retry_after)
+        raise ModelNotReadyError(f"Model is loading ({load['phase']})", retry_after)
+
+    def get_cache_stats(self) -> dict:
+        return self.get_status().get('cache')
+
+    def get_speculative_stats(self) -> dict:
+        return self.get_status().get('speculative')
+
+    def get_batch_stats(self) -> dict:
+        return self.get_status().get('batching')
+
+    def get_worker_stats(self) -> dict:
+        return self.get_status().get('pool')
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens in text with the service's tokenizer
+
+        Returns:
+            Token count, or None if the service can't be reached
+        """
+        try:
+            return self._call('POST', '/tokenize', {'texts': [text]})['counts'][0]
+        except (ModelNotReadyError, RuntimeError):
+            return None
+
+    def embed(self, texts: list, priority: int = PRIORITY_INTERACTIVE, user_id=None) -> list:
+        """
+        Embed texts with the service's embedding model
+
+        Returns:
+            List of unit-length vectors, or None without an embedding model or if the service can't be reached
+
+        Raises:
+            QueueFullError: If the service is shedding load
+        """
+        try:
+            body = {'texts': texts, 'priority': priority, 'user_id': user_id}
+            return self._call('POST', '/embed', body)['vectors']
+        except (ModelNotReadyError, RuntimeError):
+            return None
+
+    def _generate_body(self, prompt, max_tokens, temperature, top_p, stop, priority, user_id, cache, speculative, stream):
+        return {
+            'prompt': prompt,
+            'max_tokens': max_tokens,
+            'temperature': temperature,
+            'top_p': top_p,
+            'stop': stop,
+            'priority': priority,
+            'user_id': user_id,
+            'cache': cache,
+            'speculative': speculative,
+            'stream': stream
+        }
+
+    def generate(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        stop: list = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        user_id: int = None,
+        cache: bool = None,
+        speculative: bool = None
+    ) -> str:
+        """
+        Generate text from prompt on the inference service (see ModelLoader.generate)
+
+        Raises:
+            QueueFullError: If the service is shedding load
+            ModelNotReadyError: If the model isn't loaded or the service is down
+        """
+        body = self._generate_body(prompt, max_tokens, temperature, top_p, stop, priority,
+                                   user_id, cache, speculative, stream=False)
+        return self._call('POST', '/generate', body)['text']
+
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        stop: list = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        user_id: int = None,
+        cache: bool = None,
+        speculative: bool = None
+    ) -> RemoteTokenStream:
+        """
+        Stream generated text from the inference service (see ModelLoader.generate_stream)
+
+        Returns:
+            RemoteTokenStream of text chunks. Closing it early stops generation.
+
+        Raises:
+            QueueFullError: If the service is shedding load
+            ModelNotReadyError: If the model isn't loaded or the service is down
+        """
+        body = self._generate_body(prompt, max_tokens, temperature, top_p, stop, priority,
+                                   user_id, cache, speculative, stream=True)
+        conn, response = self._request('POST', '/generate', body)
+        _record_remote_spans(response)  # Only the queue wait is known when the stream starts
+        if response.status != 200:
+            self._read_json(conn, response)
+        return RemoteTokenStream(self.pool, conn, response)
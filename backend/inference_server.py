@@ -0,0 +1,244 @@
+"""
+Inference service for JailbrokeGPT
+Owns the model (ModelLoader, scheduler, generation cache) and serves
+generations to the web role over a Unix socket or localhost HTTP, so the
+API processes never load llama.cpp and can be scaled on their own.
+
+    INFERENCE_URL=unix:///tmp/jailbrokegpt-inference.sock python inference_server.py
+
+Without INFERENCE_URL, app.py builds the same loader in-process instead.
+"""
+import json
+import multiprocessing
+import os
+import time
+from flask import Flask, request, jsonify, Response, stream_with_context, g
+from dotenv import load_dotenv
+from model_loader import ModelLoader
+from model_store import ModelStore
+from generation_cache import GenerationCache
+from scheduler import InferenceScheduler, QueueFullError, ModelNotReadyError
+from tracing import get_spans, server_timing_header
+import metrics
+
+load_dotenv()
+
+# Configuration
+MODEL_REPO = os.getenv('MODEL_REPO', 'v8karlo/UNCENSORED-TinyLlama-1.1B-intermediate-step-1431k-3T-Q5_K_M-GGUF')
+MODEL_FILE = os.getenv('MODEL_FILE', 'uncensored-tinyllama-1.1b-intermediate-step-1431k-3t-q5_k_m.gguf')
+N_CTX = int(os.getenv('N_CTX', 2048))
+N_THREADS = int(os.getenv('N_THREADS', 0)) or None  # 0: detect usable cores
+N_BATCH = int(os.getenv('N_BATCH', 512))
+AUTOTUNE = os.getenv('AUTOTUNE', 'false').lower() in ('1', 'true', 'yes')
+AUTOTUNE_PATH = os.getenv('AUTOTUNE_PATH', './models/autotune.json')
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', 1))
+BATCH_SLOTS = int(os.getenv('BATCH_SLOTS', 1))
+SPECULATIVE_MODE = os.getenv('SPECULATIVE_MODE', 'off')
+SPECULATIVE_DRAFT_TOKENS = int(os.getenv('SPECULATIVE_DRAFT_TOKENS', 10))
+SPECULATIVE_DRAFT_MODEL = os.getenv('SPECULATIVE_DRAFT_MODEL') or None
+# GGUF file for long-term memory embeddings, 'main' for the chat model itself, or unset
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL') or None
+KV_CACHE_MB = int(os.getenv('KV_CACHE_MB', 1024))
+KV_CACHE_DIR = os.getenv('KV_CACHE_DIR') or None
+KV_CACHE_DISK_MB = int(os.getenv('KV_CACHE_DISK_MB', 4096))
+INFERENCE_QUEUE_SIZE = int(os.getenv('INFERENCE_QUEUE_SIZE', 32))
+INFERENCE_QUEUE_TIMEOUT = float(os.getenv('INFERENCE_QUEUE_TIMEOUT', 120))
+GENERATION_CACHE_MB = float(os.getenv('GENERATION_CACHE_MB', 0))
+GENERATION_CACHE_PATH = os.getenv('GENERATION_CACHE_PATH') or None
+GENERATION_CACHE_DISK_MB = float(os.getenv('GENERATION_CACHE_DISK_MB', 512))
+GENERATION_CACHE_MAX_TEMPERATURE = float(os.getenv('GENERATION_CACHE_MAX_TEMPERATURE', 0.05))
+MODEL_STORE_DIR = os.getenv('MODEL_STORE_DIR', './models/store')
+MODEL_OFFLINE = os.getenv('MODEL_OFFLINE', 'false').lower() in ('1', 'true', 'yes')
+MODEL_MLOCK = os.getenv('MODEL_MLOCK', 'false').lower() in ('1', 'true', 'yes')
+MODEL_PREFAULT = os.getenv('MODEL_PREFAULT', 'false').lower() in ('1', 'true', 'yes')
+INFERENCE_URL = os.getenv('INFERENCE_URL', 'unix:///tmp/jailbrokegpt-inference.sock')
+
+
+def create_model_loader():
+    """
+    Build the scheduler and ModelLoader from the environment (model not loaded yet)
+
+    Returns:
+        (InferenceScheduler, ModelLoader)
+    """
+    scheduler = InferenceScheduler(
+        max_queue=INFERENCE_QUEUE_SIZE,
+        max_wait=INFERENCE_QUEUE_TIMEOUT
+    )
+    generation_cache = None
+    # Spawned inference workers re-import their parent's main module; only the parent caches
+    if GENERATION_CACHE_MB > 0 and multiprocessing.parent_process() is None:
+        generation_cache = GenerationCache(
+            max_memory_mb=GENERATION_CACHE_MB,
+            db_path=GENERATION_CACHE_PATH,
+            max_disk_mb=GENERATION_CACHE_DISK_MB
+        )
+    model_loader = ModelLoader(
+        MODEL_REPO, MODEL_FILE,
+        scheduler=scheduler,
+        generation_cache=generation_cache,
+        cache_max_temperature=GENERATION_CACHE_MAX_TEMPERATURE,
+        model_store=ModelStore(MODEL_STORE_DIR) if MODEL_STORE_DIR else None,
+        offline=MODEL_OFFLINE
+    )
+    return scheduler, model_loader
+
+
+def start_model_load(model_loader):
+    """Load the model in the background with the configured runtime settings"""
+    model_loader.load_model_async(
+        n_ctx=N_CTX,
+        n_threads=N_THREADS,
+        n_batch=N_BATCH,
+        n_workers=INFERENCE_WORKERS,
+        kv_cache_mb=KV_CACHE_MB,
+        kv_cache_dir=KV_CACHE_DIR,
+        kv_cache_disk_mb=KV_CACHE_DISK_MB,
+        mlock=MODEL_MLOCK,
+        prefault=MODEL_PREFAULT,
+        autotune=AUTOTUNE,
+        tuning_path=AUTOTUNE_PATH,
+        batch_slots=BATCH_SLOTS,
+        speculative=SPECULATIVE_MODE,
+        speculative_tokens=SPECULATIVE_DRAFT_TOKENS,
+        draft_model_path=SPECULATIVE_DRAFT_MODEL,
+        embedding_model=EMBEDDING_MODEL
+    )
+
+
+def create_service(scheduler, model_loader):
+    """
+    Build the inference service's Flask app
+
+    Endpoints (all JSON):
+        GET  /status   - load status, queue and runtime stats
+        POST /tokenize - {"texts": [...]} -> {"counts": [...]}
+        POST /embed    - {"texts": [...]} -> {"vectors": [...]} (null without an embedding model)
+        POST /generate - generate() arguments; with "stream": true the reply
+                         is newline-delimited JSON: {"text"} per chunk, then
+                         {"done": true} or {"error"}
+        GET  /metrics  - Prometheus metrics of this process
+
+    Args:
+        scheduler: The loader's InferenceScheduler
+        model_loader: ModelLoader serving the generations
+
+    Returns:
+        Flask app
+    """
+    service = Flask(__name__)
+
+    @service.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @service.after_request
+    def add_server_timing(response):
+        # Lets the web role report queue and generation time as its own stages
+        response.headers['Server-Timing'] = server_timing_header(
+            get_spans(), (time.perf_counter() - g.request_started) * 1000)
+        return response
+
+    @service.errorhandler(QueueFullError)
+    def queue_full(error):
+        response = jsonify({'error': str(error), 'retry_after': error.retry_after})
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 429
+
+    @service.errorhandler(ModelNotReadyError)
+    def model_not_ready(error):
+        response = jsonify({
+            'error': str(error),
+            'retry_after': error.retry_after,
+            'load': model_loader.get_load_status()
+        })
+        response.headers['Retry-After'] = str(error.retry_after)
+        return response, 503
+
+    @service.route('/status', methods=['GET'])
+    def status():
+        return jsonify({
+            'model_repo': model_loader.model_repo,
+            'model_file': model_loader.model_file,
+            'n_ctx': model_loader.n_ctx,
+            'load': model_loader.get_load_status(),
+            'runtime': model_loader.runtime_settings,
+            'queue': scheduler.get_stats(),
+            'cache': model_loader.get_cache_stats(),
+            'speculative': model_loader.get_speculative_stats(),
+            'batching': model_loader.get_batch_stats(),
+            'pool': model_loader.get_worker_stats()
+        })
+
+    @service.route('/tokenize', methods=['POST'])
+    def tokenize():
+        texts = request.get_json()['texts']
+        return jsonify({'counts': [model_loader.count_tokens(text) for text in texts]})
+
+    @service.route('/embed', methods=['POST'])
+    def embed():
+        data = request.get_json()
+        kwargs = {key: data[key] for key in ('priority', 'user_id') if data.get(key) is not None}
+        return jsonify({'vectors': model_loader.embed(data['texts'], **kwargs)})
+
+    @service.route('/generate', methods=['POST'])
+    def generate():
+        data = request.get_json()
+        kwargs = {key: data[key] for key in (
+            'max_tokens', 'temperature', 'top_p', 'stop', 'priority', 'user_id', 'cache', 'speculative'
+        ) if data.get(key) is not None}
+
+        model_loader.check_ready()
+        if not data.get('stream'):
+            return jsonify({'text': model_loader.generate(data['prompt'], **kwargs)})
+
+        # Queue for the slot before answering, so a full queue is still a 429
+        tokens = model_loader.generate_stream(data['prompt'], **kwargs)
+
+        def relay():
+            try:
+                for text in tokens:
+                    yield json.dumps({'text': text}) + '\n'
+                yield json.dumps({'done': True}) + '\n'
+            except Exception as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+            finally:
+                # Also runs when the web role hangs up, which stops generation
+                tokens.close()
+
+        return Response(stream_with_context(relay()), mimetype='application/x-ndjson')
+
+    @service.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+    return service
+
+
+def main():
+    scheduler, model_loader = create_model_loader()
+    metrics.registry.callback(
+        'jailbrokegpt_inference_queue_depth', 'Generation requests waiting for the model',
+        lambda: scheduler.get_stats()['queue_depth_by_priority'], labelname='priority')
+    metrics.registry.callback(
+        'jailbrokegpt_inference_active', 'Generations holding a model slot',
+        lambda: scheduler.get_stats()['active'])
+    metrics.registry.callback(
+        'jailbrokegpt_model_ready', 'Whether the model has loaded (1) or not (0)',
+        lambda: int(model_loader.loaded))
+    service = create_service(scheduler, model_loader)
+    start_model_load(model_loader)
+
+    print(f"JailbrokeGPT inference service listening on {INFERENCE_URL}")
+    if INFERENCE_URL.startswith('unix://'):
+        path = INFERENCE_URL[len('unix://'):]
+        if os.path.exists(path):
+            os.unlink(path)  # Left behind by a previous run
+        service.run(host=INFERENCE_URL, threaded=True, use_reloader=False)
+    else:
+        host, _, port = INFERENCE_URL.split('://', 1)[-1].partition(':')
+        service.run(host=host, port=int(port or 5001), threaded=True, use_reloader=False)
+
+
+if __name__ == '__main__':
+    main()
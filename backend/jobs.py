@@ -0,0 +1,163 @@
+"""
+Background job runner for JailbrokeGPT
+Runs housekeeping generations (summaries, titles) off the request path.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+from models import remove_db_session
+from scheduler import PRIORITY_INTERACTIVE
+import metrics
+
+
+class _Job:
+    __slots__ = ('key', 'func', 'attempts', 'not_before')
+
+    def __init__(self, key, func):
+        self.key = key
+        self.func = func
+        self.attempts = 0
+        self.not_before = time.monotonic()
+
+
+class BackgroundJobRunner:
+    """
+    Queue of background jobs served by a daemon thread.
+
+    Jobs are keyed by (kind, conversation_id); submitting a job that is
+    already queued is a no-op. Failed jobs are retried with backoff, and
+    nothing starts while interactive requests are waiting for the model.
+    """
+
+    def __init__(self, scheduler, max_retries: int = 2, retry_delay: float = 5.0,
+                 hold_back_interval: float = 0.5):
+        """
+        Args:
+            scheduler: InferenceScheduler to watch for waiting interactive requests
+            max_retries: Times a failing job is retried before it is dropped
+            retry_delay: Seconds before the first retry (doubles each attempt)
+            hold_back_interval: Seconds between checks while interactive work is waiting
+        """
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.hold_back_interval = hold_back_interval
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._pending = set()
+        self._seq = itertools.count()
+        self._running = None
+
+        self._submitted = 0
+        self._deduplicated = 0
+        self._completed = 0
+        self._retried = 0
+        self._failed = 0
+
+        self._thread = threading.Thread(target=self._run, name='background-jobs', daemon=True)
+        self._thread.start()
+
+    def submit(self, kind: str, conversation_id: int, func) -> bool:
+        """
+        Queue a job unless the same one is already waiting
+
+        Args:
+            kind: Job type, e.g. 'summarize' or 'title'
+            conversation_id: Conversation the job works on
+            func: Callable that does the work; raising an exception triggers a retry
+
+        Returns:
+            bool: True if queued, False if an identical job was already pending
+        """
+        key = (kind, conversation_id)
+        with self._cond:
+            if key in self._pending:
+                self._deduplicated += 1
+                return False
+
+            self._push(_Job(key, func))
+            self._submitted += 1
+            return True
+
+    def get_stats(self) -> dict:
+        """Get queue length and job outcome counters"""
+        with self._cond:
+            return {
+                'pending': len(self._heap),
+                'running': '%s:%s' % self._running if self._running else None,
+                'submitted': self._submitted,
+                'deduplicated': self._deduplicated,
+                'completed': self._completed,
+                'retried': self._retried,
+                'failed': self._failed
+            }
+
+    def _push(self, job):
+        """Queue a job (caller holds the lock)"""
+        self._pending.add(job.key)
+        heapq.heappush(self._heap, (job.not_before, next(self._seq), job))
+        self._cond.notify()
+
+    def _wait_for_due_job(self):
+        """Block until the first queued job is due (caller holds the lock)"""
+        while True:
+            if not self._heap:
+                self._cond.wait()
+                continue
+            delay = self._heap[0][0] - time.monotonic()
+            if delay <= 0:
+                return
+            self._cond.wait(delay)
+
+    def _next_job(self):
+        """Block until a job is due and no interactive request is waiting"""
+        while True:
+            with self._cond:
+                self._wait_for_due_job()
+
+            # Checked without the lock: with a remote scheduler this is an HTTP
+            # call, and submit() from request threads mustn't wait on it
+            if self.scheduler.waiting(PRIORITY_INTERACTIVE):
+                time.sleep(self.hold_back_interval)
+                continue
+
+            with self._cond:
+                # Another job may have been queued ahead of it meanwhile; either way one is due
+                if not self._heap or self._heap[0][0] > time.monotonic():
+                    continue
+                _, _, job = heapq.heappop(self._heap)
+                self._pending.discard(job.key)
+                self._running = job.key
+                return job
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            job.attempts += 1
+            started = time.perf_counter()
+            try:
+                job.func()
+                outcome = 'completed'
+            except Exception as e:
+                print(f"Background job {job.key[0]} for conversation {job.key[1]} failed: {e}")
+                outcome = 'retry' if job.attempts <= self.max_retries else 'failed'
+            finally:
+                # Jobs run on this thread, so they get a session of their own
+                remove_db_session()
+            metrics.job_seconds.observe(time.perf_counter() - started, kind=job.key[0],
+                                        outcome='ok' if outcome == 'completed' else 'error')
+
+            with self._cond:
+                self._running = None
+                if outcome == 'completed':
+                    self._completed += 1
+                elif outcome == 'failed':
+                    self._failed += 1
+                elif job.key not in self._pending:
+                    # Back off and try again, unless a fresh copy was queued meanwhile
+                    self._retried += 1
+                    job.not_before = time.monotonic() + self.retry_delay * (2 ** (job.attempts - 1))
+                    self._push(job)
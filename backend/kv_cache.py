@@ -0,0 +1,127 @@
+"""
+Conversation KV-cache for JailbrokeGPT
+Keeps each conversation's evaluated llama.cpp state between turns, so the
+next turn only has to evaluate the tokens appended since the last reply.
+"""
+from collections import OrderedDict
+
+from llama_cpp import Llama, LlamaRAMCache, LlamaDiskCache
+
+
+class ConversationKVCache(LlamaRAMCache):
+    """
+    Memory-bounded LRU of llama.cpp states keyed by the tokens they evaluated.
+
+    Llama looks up the cached state sharing the longest prefix with a new
+    prompt and only evaluates the remainder. Saving a newer state for the
+    same conversation replaces the older one, so each conversation holds a
+    single entry. States evicted from RAM spill to an optional disk tier,
+    whose keys are indexed in RAM so lookups and saves don't scan the disk.
+    """
+
+    def __init__(self, capacity_bytes: int, disk_cache: LlamaDiskCache = None, min_prefix_tokens: int = 32):
+        """
+        Args:
+            capacity_bytes: RAM budget for cached states
+            disk_cache: Optional second tier for states evicted from RAM
+                (one process per directory: its keys are indexed here)
+            min_prefix_tokens: Shortest shared prefix worth restoring a state for
+        """
+        super().__init__(capacity_bytes)
+        self.disk_cache = disk_cache
+        self.min_prefix_tokens = min_prefix_tokens
+        # Disk tier keys, oldest spilled first
+        self._disk_keys = OrderedDict()
+        if disk_cache is not None:
+            for cached_key in disk_cache.cache.iterkeys():
+                self._disk_keys[cached_key] = None
+
+    def _find_longest_prefix_key(self, key, keys=None):
+        best_len = self.min_prefix_tokens - 1
+        best_key = None
+        for cached_key in self.cache_state.keys() if keys is None else keys:
+            prefix_len = Llama.longest_token_prefix(cached_key, key)
+            if prefix_len > best_len:
+                best_len = prefix_len
+                best_key = cached_key
+        return best_key
+
+    def __getitem__(self, key):
+        try:
+            return super().__getitem__(key)
+        except KeyError:
+            if self.disk_cache is None:
+                raise
+        # Read without removing it: saving this turn's state supersedes it anyway
+        disk_key = self._find_longest_prefix_key(tuple(key), self._disk_keys)
+        value = None if disk_key is None else self.disk_cache.cache.get(disk_key)
+        if value is None:
+            self._disk_keys.pop(disk_key, None)
+            raise KeyError("Key not found")
+        return value
+
+    def __contains__(self, key):
+        if super().__contains__(key):
+            return True
+        return self._find_longest_prefix_key(tuple(key), self._disk_keys) is not None
+
+    def __setitem__(self, key, value):
+        key = tuple(key)
+
+        # Drop states this one supersedes (earlier turns of the same conversation)
+        for cached_key in list(self.cache_state.keys()):
+            if self._supersedes(key, cached_key):
+                del self.cache_state[cached_key]
+        for cached_key in list(self._disk_keys):
+            if self._supersedes(key, cached_key):
+                self._disk_delete(cached_key)
+
+        self.cache_state[key] = value
+        while self.cache_size > self.capacity_bytes and len(self.cache_state) > 1:
+            evicted_key, evicted_state = self.cache_state.popitem(last=False)
+            if self.disk_cache is not None:
+                self._spill(evicted_key, evicted_state)
+
+    def _spill(self, key, state):
+        """Move a state evicted from RAM to the disk tier, dropping the oldest spilled ones to fit"""
+        self._disk_delete(key)
+        self.disk_cache.cache[key] = state
+        self._disk_keys[key] = None
+        while self.disk_cache.cache_size > self.disk_cache.capacity_bytes and len(self._disk_keys) > 1:
+            self._disk_delete(next(iter(self._disk_keys)))
+
+    def _disk_delete(self, key):
+        self._disk_keys.pop(key, None)
+        self.disk_cache.cache.delete(key)
+
+    def _supersedes(self, key, cached_key):
+        """
+        Whether key continues the conversation cached under cached_key.
+        Only a true prefix counts: other conversations often share a long
+        opening (prompt templates, pasted text) and must keep their state.
+        """
+        if len(cached_key) > len(key):
+            return False
+        return Llama.longest_token_prefix(key, cached_key) == len(cached_key)
+
+
+def create_kv_cache(capacity_mb: int, disk_dir: str = None, disk_capacity_mb: int = 0):
+    """
+    Build a conversation KV-cache for Llama.set_cache()
+
+    Args:
+        capacity_mb: RAM budget in MB (0 disables the cache)
+        disk_dir: Directory for the disk tier (None for RAM only)
+        disk_capacity_mb: Disk tier budget in MB
+
+    Returns:
+        ConversationKVCache, or None if disabled
+    """
+    if capacity_mb <= 0:
+        return None
+
+    disk_cache = None
+    if disk_dir and disk_capacity_mb > 0:
+        disk_cache = LlamaDiskCache(cache_dir=disk_dir, capacity_bytes=disk_capacity_mb << 20)
+
+    return ConversationKVCache(capacity_mb << 20, disk_cache=disk_cache)
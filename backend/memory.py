@@ -0,0 +1,304 @@
+"""
+Long-term memory for JailbrokeGPT
+Messages are embedded once, by a background job after they are saved, into
+a NumPy vector index per user. When building a prompt, the latest message
+is embedded and the most similar older messages are pulled back in, so
+details that fell out of the recent window (or were lost from the summary)
+can be recalled without growing the window.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from models import Message, Conversation, get_db_session
+from scheduler import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+
+# Message ID and conversation ID stored per vector
+_ID_DTYPE = np.dtype([('message_id', '<i8'), ('conversation_id', '<i8')])
+
+
+class _UserIndex:
+    """One user's vectors, appended to two flat files and mirrored in RAM"""
+
+    def __init__(self, path):
+        self.path = path
+        self.vectors = None  # (capacity, dim) float32, unit length; rows [0, size) are used
+        self.ids = np.zeros(0, dtype=_ID_DTYPE)
+        self.size = 0
+        self.watermarks = {}  # conversation_id -> highest indexed message ID
+        self._load()
+
+    @property
+    def dim(self):
+        return None if self.vectors is None else self.vectors.shape[1]
+
+    def _load(self):
+        if not os.path.exists(self.path + '.ids'):
+            return
+        ids = np.fromfile(self.path + '.ids', dtype=_ID_DTYPE)
+        vectors = np.fromfile(self.path + '.vec', dtype='<f4')
+        if not len(ids) or not len(vectors):
+            return
+        dim = len(vectors) // len(ids)
+        # An interrupted append can leave the files one row apart; keep the rows both have
+        n = min(len(ids), len(vectors) // dim)
+        self.ids = ids[:n].copy()
+        self.vectors = vectors[:n * dim].reshape(n, dim).copy()
+        self.size = n
+        for message_id, conversation_id in self.ids:
+            if message_id > self.watermarks.get(int(conversation_id), 0):
+                self.watermarks[int(conversation_id)] = int(message_id)
+
+    def append(self, conversation_id, message_ids, vectors):
+        vectors = np.asarray(vectors, dtype='<f4')
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        if self.vectors is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding size changed from {self.dim} to {vectors.shape[1]}; "
+                             f"delete {self.path}.* to rebuild the index")
+
+        ids = np.zeros(len(message_ids), dtype=_ID_DTYPE)
+        ids['message_id'] = message_ids
+        ids['conversation_id'] = conversation_id
+        with open(self.path + '.vec', 'ab') as f:
+            f.write(vectors.tobytes())
+        with open(self.path + '.ids', 'ab') as f:
+            f.write(ids.tobytes())
+
+        # Grow by doubling so appends stay amortized O(1)
+        needed = self.size + len(vectors)
+        if self.vectors is None:
+            self.vectors = np.empty((max(needed, 64), vectors.shape[1]), dtype='<f4')
+        elif needed > len(self.vectors):
+            grown = np.empty((max(needed, 2 * len(self.vectors)), self.dim), dtype='<f4')
+            grown[:self.size] = self.vectors[:self.size]
+            self.vectors = grown
+        self.vectors[self.size:needed] = vectors
+        self.ids = np.concatenate([self.ids[:self.size], ids])
+        self.size = needed
+        self.watermarks[conversation_id] = max(self.watermarks.get(conversation_id, 0), int(max(message_ids)))
+
+    def remove_conversation(self, conversation_id):
+        """Drop a conversation's vectors and rewrite the files without them; returns how many"""
+        keep = self.ids['conversation_id'][:self.size] != conversation_id
+        removed = self.size - int(keep.sum())
+        self.watermarks.pop(conversation_id, None)
+        if not removed:
+            return 0
+
+        vectors = self.vectors[:self.size][keep]
+        ids = self.ids[:self.size][keep]
+        # Written aside and swapped in, so a crash leaves either the old files or the new ones
+        for suffix, data in (('.vec', vectors), ('.ids', ids)):
+            with open(self.path + suffix + '.tmp', 'wb') as f:
+                f.write(data.tobytes())
+            os.replace(self.path + suffix + '.tmp', self.path + suffix)
+        self.vectors = vectors if len(vectors) else None
+        self.ids = ids
+        self.size = len(ids)
+        return removed
+
+
+class VectorMemory:
+    """
+    Per-user vector indexes of message embeddings, stored under directory.
+
+    Search is a brute-force dot product over the user's vectors, which for
+    the tens of thousands of messages one user has takes well under a
+    millisecond. Up to max_loaded_users indexes are kept in RAM.
+    """
+
+    def __init__(self, directory: str, max_loaded_users: int = 256):
+        """
+        Args:
+            directory: Where the index files are kept (created if missing)
+            max_loaded_users: User indexes kept in RAM (least recently used are dropped)
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_loaded_users = max_loaded_users
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self._searches = 0
+        self._indexed = 0
+        self._removed = 0
+
+    def _index(self, user_id):
+        """Get a user's index, loading it on first use (caller holds the lock)"""
+        index = self._users.get(user_id)
+        if index is None:
+            index = _UserIndex(os.path.join(self.directory, f'user_{user_id}'))
+            self._users[user_id] = index
+            while len(self._users) > self.max_loaded_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return index
+
+    def last_indexed(self, user_id: int, conversation_id: int) -> int:
+        """ID of the newest message of a conversation already in the index (0 if none)"""
+        with self._lock:
+            return self._index(user_id).watermarks.get(conversation_id, 0)
+
+    def add(self, user_id: int, conversation_id: int, message_ids: list, vectors: list):
+        """Add message embeddings to a user's index"""
+        if not message_ids:
+            return
+        with self._lock:
+            self._index(user_id).append(conversation_id, message_ids, vectors)
+            self._indexed += len(message_ids)
+
+    def remove_conversation(self, user_id: int, conversation_id: int) -> int:
+        """
+        Forget a deleted conversation's vectors
+
+        Returns:
+            int: Number of vectors removed
+        """
+        with self._lock:
+            removed = self._index(user_id).remove_conversation(conversation_id)
+            self._removed += removed
+            return removed
+
+    def search(self, user_id: int, vector, k: int = 4, conversation_id: int = None,
+               before_id: int = None, same_conversation: bool = False, min_score: float = 0.0) -> list:
+        """
+        Find the messages most similar to vector
+
+        Args:
+            user_id: Whose index to search
+            vector: Query embedding
+            k: Maximum number of results
+            conversation_id: Conversation the query comes from
+            before_id: Only messages of conversation_id older than this are eligible
+            same_conversation: Only search conversation_id's messages
+            min_score: Lowest cosine similarity returned
+
+        Returns:
+            list: (message_id, score) pairs, best first
+        """
+        query = np.asarray(vector, dtype='<f4')
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            self._searches += 1
+            index = self._index(user_id)
+            if index.size == 0 or index.dim != len(query):
+                return []
+            scores = index.vectors[:index.size] @ query
+            ids = index.ids
+
+        if conversation_id is not None:
+            same = ids['conversation_id'] == conversation_id
+            eligible = ~same if before_id is None else ~same | (ids['message_id'] < before_id)
+            if same_conversation:
+                eligible &= same
+            scores = np.where(eligible, scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids['message_id'][i]), float(scores[i])) for i in top
+                if np.isfinite(scores[i]) and scores[i] >= min_score]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'loaded_users': len(self._users),
+                'loaded_vectors': sum(index.size for index in self._users.values()),
+                'indexed': self._indexed,
+                'removed': self._removed,
+                'searches': self._searches
+            }
+
+
+class MemoryRetriever:
+    """Embeds messages into a VectorMemory and recalls relevant ones for a prompt"""
+
+    def __init__(self, memory: VectorMemory, embed, k: int = 4, max_tokens: int = 256,
+                 min_score: float = 0.3, scope: str = 'conversation', batch_size: int = 32):
+        """
+        Args:
+            memory: Vector index to store and search embeddings in
+            embed: Callable taking a list of texts (and priority and user_id
+                keywords for the scheduler) and returning vectors, or None if unavailable
+            k: Most messages recalled per prompt
+            max_tokens: Prompt tokens set aside for recalled messages
+            min_score: Lowest cosine similarity worth recalling
+            scope: 'conversation' to recall from the same conversation only,
+                'user' to recall from all of the user's conversations
+            batch_size: Messages embedded per call when indexing
+        """
+        if scope not in ('conversation', 'user'):
+            raise ValueError(f"Unknown memory scope: {scope}")
+        self.memory = memory
+        self.embed = embed
+        self.k = k
+        self.max_tokens = max_tokens
+        self.min_score = min_score
+        self.scope = scope
+        self.batch_size = batch_size
+
+    def index_conversation(self, conversation_id: int) -> int:
+        """
+        Embed a conversation's messages that aren't in the index yet
+
+        Returns:
+            int: Number of messages indexed
+
+        Raises:
+            RuntimeError: If no embedding model is available
+        """
+        db = get_db_session()
+        user_id = db.query(Conversation.user_id).filter_by(id=conversation_id).scalar()
+        if user_id is None:
+            return 0
+
+        indexed = 0
+        while True:
+            after_id = self.memory.last_indexed(user_id, conversation_id)
+            rows = db.query(Message.id, Message.content)\
+                .filter(Message.conversation_id == conversation_id, Message.id > after_id)\
+                .order_by(Message.id)\
+                .limit(self.batch_size)\
+                .all()
+            if not rows:
+                return indexed
+            vectors = self.embed([content for _, content in rows], priority=PRIORITY_BACKGROUND, user_id=user_id)
+            if vectors is None:
+                raise RuntimeError("No embedding model available")
+            self.memory.add(user_id, conversation_id, [message_id for message_id, _ in rows], vectors)
+            indexed += len(rows)
+
+    def recall(self, db, conversation, text: str, before_id: int) -> list:
+        """
+        Find older messages relevant to text
+
+        Args:
+            db: Database session
+            conversation: Conversation the prompt is for
+            text: What to find related messages for (usually the latest message)
+            before_id: Oldest message already in the prompt; it and newer ones
+                of this conversation are skipped
+
+        Returns:
+            list: Messages, best match first (empty if embeddings are unavailable)
+        """
+        vectors = self.embed([text], priority=PRIORITY_INTERACTIVE, user_id=conversation.user_id)
+        if not vectors:
+            return []
+        # Extra candidates make up for messages deleted since they were indexed
+        hits = self.memory.search(conversation.user_id, vectors[0], k=self.k * 2,
+                                  conversation_id=conversation.id, before_id=before_id,
+                                  same_conversation=self.scope == 'conversation',
+                                  min_score=self.min_score)
+        if not hits:
+            return []
+
+        # Vectors of deleted conversations stay in the index, but their messages are gone
+        query = db.query(Message).filter(Message.id.in_([message_id for message_id, _ in hits]))
+        by_id = {msg.id: msg for msg in query.all()}
+        return [by_id[message_id] for message_id, _ in hits if message_id in by_id][:self.k]
+
+    def get_stats(self) -> dict:
+        return dict(self.memory.get_stats(), k=self.k, max_tokens=self.max_tokens, scope=self.scope)
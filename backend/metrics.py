@@ -0,0 +1,239 @@
+"""
+Prometheus metrics for JailbrokeGPT
+Counters and histograms rendered in the Prometheus text format at /metrics.
+
+Updates never take a shared lock: each thread writes to its own shard and
+shards are only summed when /metrics is scraped. Values that already live
+elsewhere (queue depth, pool occupancy) are read through callbacks at
+scrape time instead of being tracked twice.
+"""
+import bisect
+import threading
+
+# Seconds; spans fast DB queries up to long generations
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Folding dead threads' shards keeps thread-per-request servers from piling them up
+_MAX_SHARDS = 256
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for metrics that keep one shard of values per writing thread"""
+
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()  # Only for adding and merging shards
+        self._shards = []              # (thread, shard dict)
+        self._retired = {}             # Merged values of finished threads
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+                if len(self._shards) > _MAX_SHARDS:
+                    self._retire_dead()
+        return shard
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def _retire_dead(self):
+        """Fold shards of threads that have exited into _retired (caller holds the lock)"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                for key, value in shard.items():
+                    self._retired[key] = self._merge(self._retired.get(key), value)
+        self._shards = alive
+
+    def _collect(self):
+        """Sum every shard into one {label values: value} dict"""
+        with self._lock:
+            self._retire_dead()
+            totals = {key: self._merge(None, value) for key, value in self._retired.items()}
+            for _, shard in self._shards:
+                for key, value in list(shard.items()):
+                    totals[key] = self._merge(totals.get(key), value)
+        return totals
+
+    def _merge(self, total, value):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._render_samples(self._collect()))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, total, value):
+        return (total or 0) + value
+
+    def _render_samples(self, totals):
+        for key, value in sorted(totals.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in cumulative buckets, plus sum and count"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket counts (last one is +Inf), then sum
+            state = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def _merge(self, total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def _render_samples(self, totals):
+        for key, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(state[-1])}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}'
+
+
+class CallbackMetric:
+    """
+    Gauge or counter whose value is read from a callback at scrape time.
+    The callback returns a number, or a dict of {label value: number}
+    when the metric has one label.
+    """
+
+    def __init__(self, name, help, func, type='gauge', labelname=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.type = type
+        self.labelname = labelname
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        try:
+            value = self.func()
+        except Exception:
+            return lines
+        if value is None:
+            return lines
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                lines.append(f'{self.name}{_format_labels((self.labelname,), (label,))} {_format_value(v)}')
+        else:
+            lines.append(f'{self.name} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, func, type='gauge', labelname=None):
+        return self.register(CallbackMetric(name, help, func, type, labelname))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# HTTP
+http_request_seconds = registry.histogram(
+    'jailbrokegpt_http_request_duration_seconds', 'Request latency by route',
+    ('method', 'route', 'status'))
+
+# Generation
+generation_seconds = registry.histogram(
+    'jailbrokegpt_generation_duration_seconds', 'Time from starting a generation to its last token',
+    ('priority', 'mode'))
+time_to_first_token_seconds = registry.histogram(
+    'jailbrokegpt_time_to_first_token_seconds', 'Time from starting a streamed generation to its first token',
+    ('priority',))
+prompt_tokens = registry.counter(
+    'jailbrokegpt_prompt_tokens_total', 'Prompt tokens sent to the model', ('priority',))
+completion_tokens = registry.counter(
+    'jailbrokegpt_completion_tokens_total', 'Tokens generated by the model', ('priority',))
+tokens_per_second = registry.histogram(
+    'jailbrokegpt_generation_tokens_per_second', 'Decode speed of each generation', ('priority',),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+# Background jobs
+job_seconds = registry.histogram(
+    'jailbrokegpt_job_duration_seconds', 'Background job run time', ('kind', 'outcome'))
+
+# Database
+db_query_seconds = registry.histogram(
+    'jailbrokegpt_db_query_duration_seconds', 'SQL statement latency', ('statement',))
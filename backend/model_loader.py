@@ -3,30 +3,226 @@ Model loader for JailbrokeGPT
 Handles downloading and loading GGUF models via llama.cpp
 """
 import os
-from llama_cpp import Llama
+import threading
+import time
+import numpy as np
+from llama_cpp import Llama, LLAMA_POOLING_TYPE_MEAN
 from huggingface_hub import hf_hub_download
+from scheduler import InferenceScheduler, ModelNotReadyError, PRIORITY_INTERACTIVE, PRIORITY_NAMES
+from worker_pool import InferenceWorkerPool
+from kv_cache import create_kv_cache
+from generation_cache import GenerationCache
+from model_store import ModelStore, ModelStoreError, prefault_file
+from autotune import TuningStore, detect_hardware, get_tuned_settings
+from batching import BatchedEngine
+from speculative import create_draft_model
+from tracing import record_span, span
+import metrics
+
+# Stop sequences used when the caller doesn't supply any
+DEFAULT_STOP = ["</s>", "User:", "Human:"]
+
+# Load phases in order, with the progress reported once each one starts
+LOAD_PHASES = {
+    'idle': 0.0,
+    'resolving': 0.05,   # Finding (or downloading) the GGUF file
+    'tuning': 0.1,       # Calibrating thread/batch settings (autotune only)
+    'mapping': 0.4,      # mmap'ing the weights and building the context
+    'warming': 0.8,      # First decode, pages the weights in
+    'ready': 1.0,
+}
+
+
+def _mean_pool(vector):
+    """Average per-token embeddings into one unit vector (pooled ones are returned as is)"""
+    if not vector or not isinstance(vector[0], list):
+        return vector
+    pooled = np.mean(np.asarray(vector, dtype=np.float32), axis=0)
+    return (pooled / max(float(np.linalg.norm(pooled)), 1e-12)).tolist()
+
+
+class TokenStream:
+    """
+    Iterator over streamed completion text.
+    
+    Holds a scheduler slot until the stream is exhausted or closed.
+    If on_complete is given, it's called with the full text once the
+    stream runs to the end (not when it's closed early). on_finish is
+    called on close with the time of the first chunk and the chunk count.
+    """
+    
+    def __init__(self, completion, release, on_complete=None, on_finish=None):
+        self._completion = completion
+        self._release = release
+        self._on_complete = on_complete
+        self._on_finish = on_finish
+        self._chunks = []
+        self._first_at = None
+        self._closed = False
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            while True:
+                chunk = next(self._completion)
+                text = chunk['choices'][0]['text']
+                if text:
+                    if self._first_at is None:
+                        self._first_at = time.perf_counter()
+                    self._chunks.append(text)
+                    return text
+        except StopIteration:
+            self.close()
+            if self._on_complete is not None:
+                self._on_complete(''.join(self._chunks))
+            raise
+        except BaseException:
+            self.close()
+            raise
+    
+    def close(self):
+        """Stop generation and free the scheduler slot"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            # Stops llama.cpp from decoding further tokens if the consumer went away
+            self._completion.close()
+        finally:
+            self._release()
+            if self._on_finish is not None:
+                self._on_finish(self._first_at, len(self._chunks))
 
 
 class ModelLoader:
-    def __init__(self, model_repo: str, model_file: str):
+    def __init__(
+        self,
+        model_repo: str,
+        model_file: str,
+        scheduler: InferenceScheduler = None,
+        generation_cache: GenerationCache = None,
+        cache_max_temperature: float = 0.0,
+        model_store: ModelStore = None,
+        offline: bool = False
+    ):
         """
         Initialize model loader
         
         Args:
             model_repo: HuggingFace repository (e.g., 'v8karlo/UNCENSORED-TinyLlama...')
             model_file: Name of the GGUF file in the repo
+            scheduler: Scheduler that queues generation requests (default: one at a time)
+            generation_cache: Exact-match cache of generated text (None disables caching)
+            cache_max_temperature: Highest temperature cached without an explicit cache=True
+            model_store: Local store to resolve the model from before trying the network
+            offline: Never download; the model must already be in the store
         """
         self.model_repo = model_repo
         self.model_file = model_file
         self.model = None
+        self.pool = None
+        self.batcher = None  # Continuous-batching engine when batch_slots > 1
+        self.drafter = None  # Speculative draft model (in-process model only)
+        self.speculative_default = False
+        self.tokenizer = None  # Vocab-only model for counting tokens when using workers
+        self.embedder = None  # Embedding-mode context for long-term memory
+        self._embed_lock = threading.Lock()
+        self.n_ctx = None
+        self.scheduler = scheduler or InferenceScheduler()
+        self.generation_cache = generation_cache
+        self.cache_max_temperature = cache_max_temperature
+        self.model_store = model_store
+        self.offline = offline
+        
+        self.runtime_settings = None  # Thread/batch settings the model was loaded with
+        self.phase = 'idle'
+        self.load_error = None
+        self.load_started_at = None
+        self.phase_started_at = None
+        self.ready_at = None
+        self._load_thread = None
+    
+    @property
+    def loaded(self) -> bool:
+        """Whether a model (or worker pool) is loaded and warmed up"""
+        return self.phase == 'ready'
+    
+    def _set_phase(self, phase):
+        self.phase = phase
+        self.phase_started_at = time.time()
+        if phase == 'ready':
+            self.ready_at = self.phase_started_at
+    
+    def get_load_status(self) -> dict:
+        """Get the load phase and progress, for readiness checks"""
+        now = time.time()
+        return {
+            'ready': self.loaded,
+            'phase': self.phase,
+            'progress': LOAD_PHASES.get(self.phase, 0.0),
+            'error': self.load_error,
+            'phase_seconds': round(now - self.phase_started_at, 1) if self.phase_started_at else None,
+            'load_seconds': round((self.ready_at or now) - self.load_started_at, 1) if self.load_started_at else None
+        }
+    
+    def check_ready(self, retry_after: int = 5):
+        """
+        Fail fast if the model can't serve generations yet
+        
+        Raises:
+            ModelNotReadyError: While loading, or if loading failed
+        """
+        if self.loaded:
+            return
+        if self.phase == 'failed':
+            raise ModelNotReadyError(f"Model failed to load: {self.load_error}", retry_after)
+        raise ModelNotReadyError(f"Model is loading ({self.phase})", retry_after)
+    
+    def _backend(self):
+        """The callable that runs completions: the worker pool, the batching engine or the in-process model"""
+        self.check_ready()
+        if self.pool is not None:
+            return self.pool
+        if self.batcher is not None:
+            return self.batcher
+        return self.model
         
     def download_model(self) -> str:
         """
-        Download model from HuggingFace if not already cached
+        Find the model in the local store, or download it from HuggingFace
+        
+        With a model store, a stored model is resolved from disk alone and a
+        missing one is downloaded into the store, so later starts don't need
+        the network.
         
         Returns:
-            Path to the downloaded model file
+            Path to the model file
+            
+        Raises:
+            ModelStoreError: If offline and the model isn't in the store
         """
+        if self.model_store is not None:
+            path = self.model_store.resolve(self.model_repo, self.model_file)
+            if path is not None:
+                print(f"Using model from local store: {path}")
+                return path
+            if self.offline:
+                raise ModelStoreError(
+                    f"{self.model_repo}/{self.model_file} is not in the model store at "
+                    f"{self.model_store.root}. Import it with: python model_store.py import "
+                    f"{self.model_repo} {self.model_file} <path>"
+                )
+            print(f"Downloading model from {self.model_repo} into the local store...")
+            self.model_store.pull(self.model_repo, self.model_file, cache_dir="./models")
+            return self.model_store.resolve(self.model_repo, self.model_file)
+        
+        if self.offline:
+            raise ModelStoreError("Offline mode needs a model store (MODEL_STORE_DIR)")
+        
         print(f"Downloading model from {self.model_repo}...")
         print("This may take a few minutes on first run...")
         
@@ -39,38 +235,306 @@ class ModelLoader:
         print(f"Model downloaded to: {model_path}")
         return model_path
     
-    def load_model(self, n_ctx: int = 2048, n_threads: int = 4) -> Llama:
+    def load_model(
+        self,
+        n_ctx: int = 2048,
+        n_threads: int = None,
+        n_batch: int = 512,
+        n_workers: int = 1,
+        kv_cache_mb: int = 0,
+        kv_cache_dir: str = None,
+        kv_cache_disk_mb: int = 0,
+        mlock: bool = False,
+        prefault: bool = False,
+        autotune: bool = False,
+        tuning_path: str = './models/autotune.json',
+        batch_slots: int = 1,
+        speculative: str = 'off',
+        speculative_tokens: int = 10,
+        draft_model_path: str = None,
+        embedding_model: str = None
+    ):
         """
         Load the model into memory
         
         Args:
             n_ctx: Context window size (default 2048 for longer conversations)
-            n_threads: Number of CPU threads to use (default 4)
+            n_threads: Number of CPU threads to use (default: the physical
+                cores this process may use, capped by its cgroup CPU quota)
+            n_batch: Prompt tokens evaluated per batch
+            n_workers: Number of worker processes. With more than one, each
+                worker loads the model and gets an even share of the CPU cores
+                (n_threads is then ignored).
+            kv_cache_mb: RAM budget for cached conversation KV states (0 disables).
+                Split evenly between workers.
+            kv_cache_dir: Directory for the optional disk tier of the KV cache
+            kv_cache_disk_mb: Disk budget for the KV cache disk tier. Split
+                evenly between workers, each in a subdirectory of kv_cache_dir.
+            mlock: Lock the weights in RAM so they can't be swapped out
+            prefault: Read the model file into the page cache before loading it
+            autotune: Benchmark thread/batch settings on first start and reuse
+                the best ones (overrides n_threads and n_batch; in-process only)
+            tuning_path: JSON file that remembers tuned settings per model and host
+            batch_slots: Generations decoded together by one in-process model.
+                With more than one, requests share forward passes through
+                the BatchedEngine instead of taking turns (the conversation
+                KV cache isn't used in this mode).
+            speculative: Default speculative decoding mode for the in-process
+                model: 'off', 'prompt_lookup' (draft from n-grams already in the
+                prompt) or 'draft' (draft with a small GGUF model). Any mode but
+                'off' keeps logits for every position, which drafts are checked
+                against; requests can then opt out. With 'off' they can't opt in.
+            speculative_tokens: Tokens drafted per step
+            draft_model_path: Draft GGUF file for speculative='draft'
+            embedding_model: GGUF file to embed messages with for long-term
+                memory, or 'main' to use the chat model's own embedding mode
+                (a second context over the same mmap'd weights). None disables
+                embeddings.
             
         Returns:
-            Loaded Llama model instance
+            Loaded Llama model instance, or the InferenceWorkerPool
         """
+        self.load_started_at = time.time()
+        self.load_error = None
+        self._set_phase('resolving')
         model_path = self.download_model()
+        self.n_ctx = n_ctx
+        
+        if autotune and n_workers <= 1:
+            self._set_phase('tuning')
+            tuned = get_tuned_settings(model_path, n_ctx, TuningStore(tuning_path))
+            n_threads, n_batch = tuned['n_threads'], tuned['n_batch']
+        elif n_threads is None:
+            n_threads = detect_hardware()['usable_threads']
+        self.runtime_settings = {'n_threads': n_threads, 'n_batch': n_batch, 'autotuned': autotune}
+        
+        self._set_phase('mapping')
+        if prefault:
+            print("Reading model into the page cache...")
+            prefault_file(model_path)
+        
+        if embedding_model:
+            self.embedder = Llama(
+                model_path=model_path if embedding_model == 'main' else embedding_model,
+                embedding=True,
+                # Chat models like TinyLlama declare no pooling and would return one vector per token
+                pooling_type=LLAMA_POOLING_TYPE_MEAN,
+                n_ctx=512,
+                n_threads=n_threads,
+                n_batch=512,
+                n_gpu_layers=0,
+                verbose=False
+            )
+            print(f"Embedding model loaded ({embedding_model})")
+        
+        if n_workers > 1:
+            self.tokenizer = Llama(model_path=model_path, vocab_only=True, verbose=False)
+            self.pool = InferenceWorkerPool(model_path, n_workers, llama_kwargs={
+                'n_ctx': n_ctx,
+                'n_batch': n_batch,
+                'n_gpu_layers': 0,
+                'use_mlock': mlock
+            }, kv_cache={
+                'capacity_mb': kv_cache_mb // n_workers,
+                'disk_dir': kv_cache_dir,
+                'disk_capacity_mb': kv_cache_disk_mb // n_workers
+            })
+            # Each worker warms itself up before it reports ready
+            self.pool.start()
+            self.scheduler.set_concurrency(n_workers)
+            self._set_phase('ready')
+            return self.pool
+        
+        batching = batch_slots > 1
+        # Drafts are verified against the logits of every drafted position, which
+        # llama.cpp only keeps if the model is built for it (logits_all)
+        self.speculative_default = speculative != 'off' and not batching
+        if self.speculative_default:
+            self.drafter = create_draft_model(
+                speculative,
+                num_pred_tokens=speculative_tokens,
+                draft_model_path=draft_model_path,
+                n_ctx=n_ctx,
+                n_threads=n_threads
+            )
         
         print("Loading model into memory...")
         self.model = Llama(
             model_path=model_path,
-            n_ctx=n_ctx,
+            draft_model=self.drafter,
+            logits_all=self.drafter is not None,
+            # Generations run in the batching engine's own context, so this one stays small
+            n_ctx=min(n_ctx, 512) if batching else n_ctx,
             n_threads=n_threads,
+            n_threads_batch=n_threads,
+            n_batch=n_batch,
             n_gpu_layers=0,  # CPU only (change to -1 for GPU)
+            use_mlock=mlock,
             verbose=True  # Enable to see loading details
         )
         
+        if batching:
+            self.batcher = BatchedEngine(self.model, batch_slots, n_ctx, n_batch=n_batch, n_threads=n_threads)
+            self.scheduler.set_concurrency(batch_slots)
+            print(f"Continuous batching enabled ({batch_slots} slots)")
+            self._warm_up(self.batcher)
+            print("Model loaded successfully!")
+            return self.model
+        
+        kv_cache = create_kv_cache(kv_cache_mb, kv_cache_dir, kv_cache_disk_mb)
+        if kv_cache is not None:
+            self.model.set_cache(kv_cache)
+            print(f"Conversation KV cache enabled ({kv_cache_mb} MB)")
+        
+        if self.speculative_default:
+            print(f"Speculative decoding enabled ({speculative}, {speculative_tokens} tokens per draft)")
+        
+        self._warm_up(self.model)
         print("Model loaded successfully!")
         return self.model
     
+    def _warm_up(self, backend):
+        """Decode one token so the first real request doesn't pay for paging in the weights"""
+        self._set_phase('warming')
+        backend("Hello", max_tokens=1, echo=False)
+        self._set_phase('ready')
+    
+    def load_model_async(self, **kwargs) -> threading.Thread:
+        """
+        Load the model in a background thread, so the server can start serving
+        other routes right away. Progress is reported by get_load_status().
+        
+        Args:
+            **kwargs: load_model() arguments
+            
+        Returns:
+            The loader thread
+        """
+        def run():
+            try:
+                self.load_model(**kwargs)
+            except Exception as e:
+                import traceback
+                print(f"Error loading model: {e}")
+                print("\nFull error details:")
+                traceback.print_exc()
+                self.load_error = str(e)
+                self._set_phase('failed')
+        
+        self._load_thread = threading.Thread(target=run, name='model-loader', daemon=True)
+        self._load_thread.start()
+        return self._load_thread
+    
+    def count_tokens(self, text: str) -> int:
+        """
+        Count the tokens in text using the model's tokenizer
+        
+        Returns:
+            Token count, or None if no model is loaded
+        """
+        tokenizer = self.model or self.tokenizer
+        if tokenizer is None:
+            return None
+        return len(tokenizer.tokenize(text.encode('utf-8'), add_bos=False))
+    
+    def embed(self, texts: list, priority: int = PRIORITY_INTERACTIVE, user_id=None) -> list:
+        """
+        Embed texts with the embedding model (inputs longer than its context are truncated)
+        
+        Embedding runs on the same CPU cores as generation, so it waits for
+        a scheduler slot like a generation does.
+        
+        Args:
+            texts: Texts to embed
+            priority: Scheduler priority class
+            user_id: Owner of the request, used for fair queuing
+        
+        Returns:
+            List of unit-length vectors, or None if no embedding model is loaded
+        
+        Raises:
+            QueueFullError: If the scheduler is shedding load
+        """
+        if self.embedder is None:
+            return None
+        with self.scheduler.slot(priority, user_id), self._embed_lock, span('embed'):
+            vectors = self.embedder.embed(texts, normalize=True, truncate=True)
+        return [_mean_pool(vector) for vector in vectors]
+    
+    def _cache_key(self, cache, prompt, max_tokens, temperature, top_p, stop):
+        """
+        Generation cache key for a request, or None if it shouldn't be cached
+        
+        cache=None caches only near-deterministic requests (temperature at or
+        below cache_max_temperature); True or False overrides that.
+        """
+        if self.generation_cache is None or cache is False:
+            return None
+        if cache is None and temperature > self.cache_max_temperature:
+            return None
+        return GenerationCache.make_key(prompt, self.model_file, max_tokens, temperature, top_p, stop)
+    
+    def get_cache_stats(self) -> dict:
+        """Get generation cache hit rates, or None when caching is off"""
+        if self.generation_cache is None:
+            return None
+        return self.generation_cache.get_stats()
+    
+    def _configure_speculation(self, backend, speculative):
+        """
+        Attach or detach the draft model for the next completion (caller holds a scheduler slot)
+        
+        Only a model loaded with a speculative mode can verify drafts, so
+        without one the per-request flag is ignored.
+        """
+        if self.drafter is None or backend is not self.model:
+            return
+        use = self.speculative_default if speculative is None else speculative
+        backend.draft_model = self.drafter if use else None
+        if use:
+            self.drafter.start_sequence()
+    
+    def get_speculative_stats(self) -> dict:
+        """Get the draft model's acceptance rate, or None without one"""
+        if self.drafter is None:
+            return None
+        return dict(self.drafter.get_stats(), default_on=self.speculative_default)
+    
+    def _record_generation(self, priority, mode, started, first_at, prompt_tokens, completion_tokens):
+        """Record generation metrics (times are perf_counter values; started is when the slot was granted)"""
+        ended = time.perf_counter()
+        priority = PRIORITY_NAMES.get(priority, str(priority))
+        metrics.generation_seconds.observe(ended - started, priority=priority, mode=mode)
+        if prompt_tokens is not None:
+            metrics.prompt_tokens.inc(prompt_tokens, priority=priority)
+        metrics.completion_tokens.inc(completion_tokens, priority=priority)
+        decode_seconds = ended - (first_at or started)
+        if completion_tokens > 1 and decode_seconds > 0:
+            metrics.tokens_per_second.observe(completion_tokens / decode_seconds, priority=priority)
+    
+    def get_batch_stats(self) -> dict:
+        """Get continuous-batching slot usage, or None when batching is off"""
+        if self.batcher is None:
+            return None
+        return self.batcher.get_stats()
+    
+    def get_worker_stats(self) -> dict:
+        """Get per-worker utilization, or None when running in-process"""
+        if self.pool is None:
+            return None
+        return self.pool.get_stats()
+    
     def generate(
         self,
         prompt: str,
         max_tokens: int = 512,
         temperature: float = 0.7,
         top_p: float = 0.9,
-        stop: list = None
+        stop: list = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        user_id: int = None,
+        cache: bool = None,
+        speculative: bool = None
     ) -> str:
         """
         Generate text from prompt
@@ -81,23 +545,126 @@ class ModelLoader:
             temperature: Sampling temperature (0.0-1.0)
             top_p: Nucleus sampling parameter
             stop: List of stop sequences
+            priority: Scheduler priority class
+            user_id: Requesting user, for fair queuing
+            cache: Use the generation cache (default: only at low temperature)
+            speculative: Use speculative decoding (default: the deployment setting)
             
         Returns:
             Generated text
+            
+        Raises:
+            QueueFullError: If the scheduler is shedding load
         """
-        if self.model is None:
-            raise RuntimeError("Model not loaded. Call load_model() first.")
+        backend = self._backend()
         
         if stop is None:
-            stop = ["</s>", "User:", "Human:"]
-        
-        response = self.model(
-            prompt,
-            max_tokens=max_tokens,
-            temperature=temperature,
-            top_p=top_p,
-            stop=stop,
-            echo=False
-        )
+            stop = DEFAULT_STOP
+        
+        # Cache hits skip the scheduler queue and the model entirely
+        key = self._cache_key(cache, prompt, max_tokens, temperature, top_p, stop)
+        if key is not None:
+            cached = self.generation_cache.get(key)
+            if cached is not None:
+                return cached.strip()
+        
+        requested = time.perf_counter()
+        with self.scheduler.slot(priority, user_id):
+            started = time.perf_counter()
+            self._configure_speculation(backend, speculative)
+            response = backend(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                stop=stop,
+                echo=False
+            )
+        record_span('queue', started - requested)
+        record_span('generate', time.perf_counter() - started)
+        
+        text = response['choices'][0]['text']
+        usage = response.get('usage')
+        if usage:
+            self._record_generation(priority, 'blocking', started, None,
+                                    usage['prompt_tokens'], usage['completion_tokens'])
+        else:
+            self._record_generation(priority, 'blocking', started, None,
+                                    self.count_tokens(prompt), self.count_tokens(text) or 0)
+        if key is not None:
+            self.generation_cache.put(key, text)
+        return text.strip()
+    
+    def generate_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 512,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        stop: list = None,
+        priority: int = PRIORITY_INTERACTIVE,
+        user_id: int = None,
+        cache: bool = None,
+        speculative: bool = None
+    ) -> TokenStream:
+        """
+        Generate text from prompt, yielding chunks as llama.cpp decodes them
+        
+        Args:
+            prompt: Input text prompt
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature (0.0-1.0)
+            top_p: Nucleus sampling parameter
+            stop: List of stop sequences
+            priority: Scheduler priority class
+            user_id: Requesting user, for fair queuing
+            cache: Use the generation cache (default: only at low temperature)
+            speculative: Use speculative decoding (default: the deployment setting)
+            
+        Returns:
+            TokenStream of text chunks. Closing it early stops generation.
+            
+        Raises:
+            QueueFullError: If the scheduler is shedding load
+        """
+        backend = self._backend()
+        
+        if stop is None:
+            stop = DEFAULT_STOP
+        
+        key = self._cache_key(cache, prompt, max_tokens, temperature, top_p, stop)
+        on_complete = None
+        if key is not None:
+            cached = self.generation_cache.get(key)
+            if cached is not None:
+                return TokenStream((chunk for chunk in [{'choices': [{'text': cached}]}]), lambda: None)
+            on_complete = lambda text: self.generation_cache.put(key, text)
+        
+        requested = time.perf_counter()
+        started = self.scheduler.acquire(priority, user_id)
+        record_span('queue', started - requested)
+        try:
+            self._configure_speculation(backend, speculative)
+            completion = backend(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=top_p,
+                stop=stop,
+                echo=False,
+                stream=True
+            )
+        except BaseException:
+            self.scheduler.release(started)
+            raise
+        
+        def on_finish(first_at, chunks):
+            record_span('generate', time.perf_counter() - started)
+            if first_at is not None:
+                record_span('first_token', first_at - started)
+                metrics.time_to_first_token_seconds.observe(
+                    first_at - requested, priority=PRIORITY_NAMES.get(priority, str(priority)))
+            # llama.cpp streams one token per chunk
+            self._record_generation(priority, 'stream', started, first_at, self.count_tokens(prompt), chunks)
         
-        return response['choices'][0]['text'].strip()
+        return TokenStream(completion, lambda: self.scheduler.release(started), on_complete, on_finish)
@@ -0,0 +1,283 @@
+"""
+Local model store for JailbrokeGPT
+Keeps GGUF files in a directory with a manifest (repo, file, sha256, size),
+so the server can find its model without contacting Hugging Face.
+
+Pre-stage a model on an offline machine with:
+    python model_store.py import <repo> <file> <path/to/model.gguf>
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from dotenv import load_dotenv
+
+
+class ModelStoreError(Exception):
+    """Raised when a model can't be found in the store or fails verification"""
+
+
+def sha256_file(path: str, chunk_size: int = 8 << 20) -> str:
+    """Hash a file in chunks, without reading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prefault_file(path: str, chunk_size: int = 8 << 20):
+    """
+    Read a file through once so its pages are in the page cache before
+    llama.cpp mmaps it, instead of faulting them in during the first decode
+    """
+    with open(path, 'rb') as f:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+        while f.read(chunk_size):
+            pass
+
+
+class ModelStore:
+    """
+    Directory of model files plus a manifest.json describing them.
+
+    Each entry records where the file lives, its size and sha256. The
+    checksum is verified once; after that the file's size and mtime are
+    enough to trust it, so resolving a model costs a stat() call.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, root: str):
+        """
+        Args:
+            root: Store directory (created if missing)
+        """
+        self.root = os.path.abspath(root)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(repo, filename):
+        return f"{repo}/{filename}"
+
+    def _manifest_path(self):
+        return os.path.join(self.root, self.MANIFEST)
+
+    def _load_manifest(self):
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'models': {}}
+
+    def _save_manifest(self, manifest):
+        """Write the manifest atomically, so a crash can't leave it half written"""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self._manifest_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._manifest_path())
+
+    def _entry_path(self, entry):
+        return os.path.join(self.root, entry['path'])
+
+    def model_dir(self, repo: str) -> str:
+        """Directory that holds a repo's files inside the store"""
+        return os.path.join(self.root, repo.replace('/', '--'))
+
+    def entries(self) -> list:
+        """Get every manifest entry"""
+        return list(self._load_manifest()['models'].values())
+
+    def resolve(self, repo: str, filename: str, force_verify: bool = False) -> str:
+        """
+        Find a model on disk, verifying its checksum the first time
+
+        Args:
+            repo: HuggingFace repository the file came from
+            filename: Name of the GGUF file
+            force_verify: Hash the file even if it was verified before
+
+        Returns:
+            Absolute path to the model, or None if it isn't in the store
+
+        Raises:
+            ModelStoreError: If the file is missing, truncated or corrupt
+        """
+        with self._lock:
+            manifest = self._load_manifest()
+            entry = manifest['models'].get(self._key(repo, filename))
+            if entry is None:
+                return None
+
+            path = self._entry_path(entry)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                raise ModelStoreError(f"{path} is in the manifest but missing from disk")
+
+            if stat.st_size != entry['size']:
+                raise ModelStoreError(f"{path} is {stat.st_size} bytes, manifest says {entry['size']}")
+
+            # Hash only if never verified or the file changed since
+            if force_verify or entry.get('verified_mtime') != stat.st_mtime:
+                print(f"Verifying checksum of {path}...")
+                if sha256_file(path) != entry['sha256']:
+                    raise ModelStoreError(f"{path} does not match its sha256 in the manifest")
+                entry['verified_mtime'] = stat.st_mtime
+                entry['verified_at'] = time.time()
+                self._save_manifest(manifest)
+
+            return path
+
+    def add(self, repo: str, filename: str, path: str, sha256: str = None) -> dict:
+        """
+        Record a file already inside the store directory in the manifest
+
+        Args:
+            repo: HuggingFace repository the file came from
+            filename: Name of the GGUF file
+            path: Location of the file (must be inside the store)
+            sha256: Expected checksum; computed from the file if not given
+
+        Returns:
+            dict: The manifest entry
+        """
+        path = os.path.abspath(path)
+        if os.path.commonpath([path, self.root]) != self.root:
+            raise ModelStoreError(f"{path} is outside the model store {self.root}")
+
+        digest = sha256_file(path)
+        if sha256 and digest != sha256.lower():
+            raise ModelStoreError(f"{path} has sha256 {digest}, expected {sha256}")
+
+        stat = os.stat(path)
+        entry = {
+            'repo': repo,
+            'file': filename,
+            'path': os.path.relpath(path, self.root),
+            'sha256': digest,
+            'size': stat.st_size,
+            'verified_mtime': stat.st_mtime,
+            'verified_at': time.time()
+        }
+        with self._lock:
+            manifest = self._load_manifest()
+            manifest['models'][self._key(repo, filename)] = entry
+            self._save_manifest(manifest)
+        return entry
+
+    def import_file(self, repo: str, filename: str, source: str, sha256: str = None, move: bool = False) -> dict:
+        """
+        Bring a model file into the store and add it to the manifest
+
+        The file is hard-linked when source and store share a filesystem,
+        and copied otherwise.
+
+        Args:
+            repo: HuggingFace repository the file came from
+            filename: Name of the GGUF file
+            source: Path of the file to import
+            sha256: Expected checksum, if known
+            move: Move the file instead of linking or copying it
+
+        Returns:
+            dict: The manifest entry
+        """
+        target_dir = self.model_dir(repo)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, filename)
+        # HuggingFace cache entries are symlinks into a blob directory
+        source = os.path.realpath(source)
+
+        if source != target:
+            if os.path.exists(target):
+                os.remove(target)
+            if move:
+                print(f"Moving {source} to {target}...")
+                shutil.move(source, target)
+            else:
+                try:
+                    os.link(source, target)
+                except OSError:
+                    print(f"Copying {source} to {target}...")
+                    shutil.copyfile(source, target)
+
+        return self.add(repo, filename, target, sha256=sha256)
+
+    def pull(self, repo: str, filename: str, cache_dir: str = None) -> dict:
+        """
+        Download a model from Hugging Face (or reuse its local HF cache)
+        and import it into the store
+
+        Args:
+            repo: HuggingFace repository
+            filename: Name of the GGUF file
+            cache_dir: HuggingFace cache directory
+
+        Returns:
+            dict: The manifest entry
+        """
+        from huggingface_hub import hf_hub_download
+
+        path = hf_hub_download(repo_id=repo, filename=filename, cache_dir=cache_dir)
+        return self.import_file(repo, filename, path)
+
+
+def main(argv=None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Manage the local model store')
+    parser.add_argument('--store', default=os.getenv('MODEL_STORE_DIR', './models/store'),
+                        help='Store directory (default: MODEL_STORE_DIR)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_cmd = commands.add_parser('import', help='Copy a local GGUF file into the store')
+    import_cmd.add_argument('repo')
+    import_cmd.add_argument('file')
+    import_cmd.add_argument('path')
+    import_cmd.add_argument('--sha256', help='Expected checksum')
+    import_cmd.add_argument('--move', action='store_true', help='Move instead of copying')
+
+    pull_cmd = commands.add_parser('pull', help='Download a model from Hugging Face into the store')
+    pull_cmd.add_argument('repo')
+    pull_cmd.add_argument('file')
+    pull_cmd.add_argument('--cache-dir', default='./models', help='HuggingFace cache directory')
+
+    commands.add_parser('list', help='Show the manifest')
+
+    verify_cmd = commands.add_parser('verify', help='Check a stored model against its checksum')
+    verify_cmd.add_argument('repo')
+    verify_cmd.add_argument('file')
+
+    args = parser.parse_args(argv)
+    store = ModelStore(args.store)
+
+    try:
+        if args.command == 'import':
+            entry = store.import_file(args.repo, args.file, args.path, sha256=args.sha256, move=args.move)
+            print(f"✓ Imported {entry['repo']}/{entry['file']} (sha256 {entry['sha256']})")
+        elif args.command == 'pull':
+            entry = store.pull(args.repo, args.file, cache_dir=args.cache_dir)
+            print(f"✓ Stored {entry['repo']}/{entry['file']} (sha256 {entry['sha256']})")
+        elif args.command == 'list':
+            for entry in store.entries():
+                print(f"{entry['repo']}/{entry['file']}  {entry['size']} bytes  sha256 {entry['sha256']}")
+        elif args.command == 'verify':
+            path = store.resolve(args.repo, args.file, force_verify=True)
+            if path is None:
+                print(f"❌ {args.repo}/{args.file} is not in the store")
+                return 1
+            print(f"✓ {path} verified")
+    except (ModelStoreError, OSError) as e:
+        print(f"❌ Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,20 @@
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, inspect, text, func, select, bindparam, and_, or_, Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session, load_only
+from sqlalchemy.pool import QueuePool
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
+import threading
+import time
+import metrics
+from search import create_search_indexes
 
 Base = declarative_base()
 
+# Characters of the latest message kept in Conversation.last_message_preview
+PREVIEW_LENGTH = 120
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -33,11 +41,20 @@ class User(Base):
 
 class Conversation(Base):
     __tablename__ = 'conversations'
+    __table_args__ = (
+        # Serves the sidebar list, newest first, with keyset pagination
+        Index('ix_conversations_user_updated', 'user_id', 'updated_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     title = Column(String(200), default='New Chat')
     summary = Column(Text, nullable=True)  # For conversation summarization
+    summarized_upto = Column(Integer, nullable=True)  # ID of the last message folded into summary
+    # Kept up to date in the same transaction as each message insert (see _update_conversation_stats)
+    message_count = Column(Integer, nullable=True, default=0)
+    last_message_at = Column(DateTime, nullable=True)
+    last_message_preview = Column(String(PREVIEW_LENGTH), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -50,21 +67,39 @@ class Conversation(Base):
             'user_id': self.user_id,
             'title': self.title,
             'summary': self.summary,
+            'message_count': self.message_count or 0,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
         if include_messages:
             result['messages'] = [msg.to_dict() for msg in self.messages]
         return result
+    
+    def to_list_dict(self):
+        """Compact projection for the conversation list (no summary or messages)"""
+        return {
+            'id': self.id,
+            'title': self.title,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+            'message_count': self.message_count or 0,
+            'last_message_at': self.last_message_at.isoformat() if self.last_message_at else None,
+            'last_message_preview': self.last_message_preview
+        }
 
 
 class Message(Base):
     __tablename__ = 'messages'
+    __table_args__ = (
+        # Serves per-conversation counts, "latest N" and range queries
+        Index('ix_messages_conversation_timestamp', 'conversation_id', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     conversation_id = Column(Integer, ForeignKey('conversations.id'), nullable=False)
     role = Column(String(20), nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
+    token_count = Column(Integer, nullable=True)  # Content length in model tokens
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     conversation = relationship('Conversation', back_populates='messages')
@@ -79,12 +114,258 @@ class Message(Base):
         }
 
 
-# Database initialization
-def init_db():
-    """Initialize the database and create tables"""
+# ============================================
+# Message queries
+# ============================================
+# These run COUNT / ORDER BY ... LIMIT queries on the messages index instead
+# of loading Conversation.messages, so per-turn cost follows the window size
+# rather than the length of the conversation.
+
+def _after(query, after_id):
+    """Restrict a message query to messages newer than after_id (if given)"""
+    if after_id is not None:
+        query = query.filter(Message.id > after_id)
+    return query
+
+
+def count_messages(db, conversation_id, after_id=None):
+    """
+    Count a conversation's messages
+    
+    Args:
+        db: Database session
+        conversation_id: ID of the conversation
+        after_id: Only count messages with a greater ID
+    
+    Returns:
+        int: Number of messages
+    """
+    query = db.query(func.count(Message.id)).filter(Message.conversation_id == conversation_id)
+    return _after(query, after_id).scalar()
+
+
+def get_first_messages(db, conversation_id, limit, after_id=None):
+    """Get the oldest messages of a conversation (after after_id), oldest first"""
+    query = db.query(Message).filter(Message.conversation_id == conversation_id)
+    return _after(query, after_id)\
+        .order_by(Message.timestamp, Message.id)\
+        .limit(limit)\
+        .all()
+
+
+def iter_messages_newest_first(db, conversation_id, after_id=None, page_size=32):
+    """
+    Yield a conversation's messages from newest to oldest, one page at a time
+    
+    Stop iterating as soon as enough messages have been read; later pages
+    are only queried if they are needed.
+    
+    Args:
+        db: Database session
+        conversation_id: ID of the conversation
+        after_id: Stop at messages with this ID or lower
+        page_size: Messages fetched per query
+    """
+    last = None
+    while True:
+        page = get_messages_before(db, conversation_id, last, page_size, after_id=after_id)
+        
+        yield from page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def get_messages_before(db, conversation_id, before, limit, after_id=None):
+    """
+    Get one page of messages older than a given message, newest first
+    
+    Uses keyset pagination on (timestamp, id), so every page is a single
+    index range scan no matter how deep into the history it is.
+    
+    Args:
+        db: Database session
+        conversation_id: ID of the conversation
+        before: Message to page back from (None for the newest page)
+        limit: Maximum number of messages
+        after_id: Stop at messages with this ID or lower
+    
+    Returns:
+        list: Messages, newest first
+    """
+    query = _after(db.query(Message).filter(Message.conversation_id == conversation_id), after_id)
+    if before is not None:
+        query = query.filter(or_(
+            Message.timestamp < before.timestamp,
+            and_(Message.timestamp == before.timestamp, Message.id < before.id)
+        ))
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit).all()
+
+
+# ============================================
+# Conversation queries
+# ============================================
+
+# Columns read for the conversation list; the summary is never loaded
+_LIST_COLUMNS = (
+    Conversation.id, Conversation.title, Conversation.created_at, Conversation.updated_at,
+    Conversation.message_count, Conversation.last_message_at, Conversation.last_message_preview
+)
+
+
+def get_conversations_before(db, user_id, before, limit):
+    """
+    Get one page of a user's conversations, most recently updated first
+    
+    Uses keyset pagination on (updated_at, id) over the
+    (user_id, updated_at) index, loading only the list columns.
+    
+    Args:
+        db: Database session
+        user_id: Owner of the conversations
+        before: Conversation to page back from (None for the newest page)
+        limit: Maximum number of conversations
+    
+    Returns:
+        list: Conversations, most recently updated first
+    """
+    query = db.query(Conversation)\
+        .options(load_only(*_LIST_COLUMNS))\
+        .filter(Conversation.user_id == user_id)
+    if before is not None:
+        query = query.filter(or_(
+            Conversation.updated_at < before.updated_at,
+            and_(Conversation.updated_at == before.updated_at, Conversation.id < before.id)
+        ))
+    return query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit).all()
+
+
+def make_preview(content):
+    """Collapse whitespace and truncate message content for the conversation list"""
+    preview = ' '.join(content.split())
+    if len(preview) > PREVIEW_LENGTH:
+        preview = preview[:PREVIEW_LENGTH - 3] + '...'
+    return preview
+
+
+# Counts tokens with the model tokenizer; set by the app once a model is loaded
+_token_counter = None
+
+
+def set_token_counter(count_tokens):
+    """
+    Register the function used to fill in Message.token_count on insert
+    
+    It runs inside the flush, so it should be a local tokenizer call. Leave
+    it unset when counting is remote; messages are then counted lazily by
+    get_message_tokens when a prompt is built.
+    
+    Args:
+        count_tokens: Callable taking text and returning a token count, or None
+            if no tokenizer is available yet
+    """
+    global _token_counter
+    _token_counter = count_tokens
+
+
+@event.listens_for(Message, 'before_insert')
+def _count_message_tokens(mapper, connection, target):
+    """Tokenize each message once, when it is written"""
+    if target.token_count is None and _token_counter is not None:
+        target.token_count = _token_counter(target.content)
+
+
+@event.listens_for(Message, 'after_insert')
+def _update_conversation_stats(mapper, connection, target):
+    """Bump the conversation's count and preview on the inserting connection, so they commit together"""
+    conversations = Conversation.__table__
+    connection.execute(
+        conversations.update()
+        .where(conversations.c.id == target.conversation_id)
+        .values(
+            message_count=func.coalesce(conversations.c.message_count, 0) + 1,
+            last_message_at=target.timestamp,
+            last_message_preview=make_preview(target.content)
+        )
+    )
+
+
+# ============================================
+# Engine and session management
+# ============================================
+
+class PoolStats:
+    """Counters for connection pool activity"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+    
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+    
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+    
+    def to_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'connects': self.connects,
+                'timeouts': self.timeouts,
+                'wait_total_ms': round(self.wait_total * 1000, 3),
+                'wait_avg_ms': round(self.wait_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3)
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits for a connection"""
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except Exception:
+            timed_out = True
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start, timed_out)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+# One session per thread; Flask removes it when each request ends (see app.py)
+Session = scoped_session(sessionmaker())
+
+
+def get_database_url():
+    """
+    Build the database URL from environment variables.
+    DATABASE_URL, if set, is used as-is (e.g. sqlite:///bench.db for benchmarks).
+    """
     from dotenv import load_dotenv
     load_dotenv()
     
+    if os.getenv('DATABASE_URL'):
+        return os.getenv('DATABASE_URL')
+    
     db_config = {
         'host': os.getenv('DB_HOST', 'localhost'),
         'port': os.getenv('DB_PORT', '3306'),
@@ -93,38 +374,192 @@ def init_db():
         'database': os.getenv('DB_NAME', 'jailbrokegpt')
     }
     
-    # Create engine
-    engine = create_engine(
-        f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}",
-        echo=False
+    return f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_start', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    metrics.db_query_seconds.observe(
+        elapsed, statement=verb if verb in ('SELECT', 'INSERT', 'UPDATE', 'DELETE') else 'OTHER'
     )
+
+
+def get_engine():
+    """
+    Get the process-wide database engine, creating it on first use.
+    
+    Pool settings come from the environment:
+        DB_POOL_SIZE      - connections kept open (default 10)
+        DB_MAX_OVERFLOW   - extra connections allowed under load (default 20)
+        DB_POOL_TIMEOUT   - seconds to wait for a free connection (default 30)
+        DB_POOL_RECYCLE   - seconds before a connection is replaced (default 3600)
+        DB_POOL_PRE_PING  - test connections before use (default true)
+    """
+    global _engine
+    if _engine is not None:
+        return _engine
+    
+    with _engine_lock:
+        if _engine is None:
+            engine = create_engine(
+                get_database_url(),
+                echo=False,
+                poolclass=InstrumentedQueuePool,
+                pool_size=int(os.getenv('DB_POOL_SIZE', 10)),
+                max_overflow=int(os.getenv('DB_MAX_OVERFLOW', 20)),
+                pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+                pool_recycle=int(os.getenv('DB_POOL_RECYCLE', 3600)),
+                pool_pre_ping=os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+            )
+            
+            event.listen(engine, 'connect', lambda *args: pool_stats.incr('connects'))
+            event.listen(engine, 'checkout', lambda *args: pool_stats.incr('checkouts'))
+            event.listen(engine, 'checkin', lambda *args: pool_stats.incr('checkins'))
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+            
+            Session.configure(bind=engine)
+            _engine = engine
+    
+    return _engine
+
+
+def get_pool_stats():
+    """Get connection pool counters and current pool occupancy"""
+    stats = pool_stats.to_dict()
+    if _engine is not None:
+        pool = _engine.pool
+        stats.update({
+            'pool_size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow()
+        })
+    return stats
+
+
+# Database initialization
+def init_db():
+    """Initialize the database and create tables"""
+    engine = get_engine()
     
     # Create all tables
     Base.metadata.create_all(engine)
-    
-    # Create session factory
-    Session = sessionmaker(bind=engine)
+    add_missing_columns(engine)
+    add_missing_indexes(engine)
+    backfill_conversation_stats(engine)
+    create_search_indexes(engine)
     
     return engine, Session
 
 
-def get_db_session():
-    """Get a database session"""
-    from dotenv import load_dotenv
-    load_dotenv()
+def add_missing_columns(engine):
+    """
+    Add nullable columns introduced since the tables were created.
     
-    db_config = {
-        'host': os.getenv('DB_HOST', 'localhost'),
-        'port': os.getenv('DB_PORT', '3306'),
-        'user': os.getenv('DB_USER', 'root'),
-        'password': os.getenv('DB_PASSWORD', ''),
-        'database': os.getenv('DB_NAME', 'jailbrokegpt')
-    }
+    There's no migration tool yet, and create_all() never alters an
+    existing table, so new columns are added here with ALTER TABLE.
+    """
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
     
-    engine = create_engine(
-        f"mysql+pymysql://{db_config['user']}:{db_config['password']}@{db_config['host']}:{db_config['port']}/{db_config['database']}",
-        echo=False
-    )
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {col['name'] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                print(f"Adding column {table.name}.{column.name}")
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+
+def add_missing_indexes(engine):
+    """Create indexes introduced since the tables were created"""
+    inspector = inspect(engine)
+    existing_tables = inspector.get_table_names()
+    
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"Creating index {index.name}")
+                index.create(engine)
+
+
+def backfill_conversation_stats(engine, batch_size=1000):
+    """Fill in message_count and the last-message columns for conversations created before they existed"""
+    conversations = Conversation.__table__
+    messages = Message.__table__
+    of_conversation = messages.c.conversation_id == conversations.c.id
+    latest = select(messages.c.content)\
+        .where(of_conversation)\
+        .order_by(messages.c.timestamp.desc(), messages.c.id.desc())\
+        .limit(1)\
+        .scalar_subquery()
     
-    Session = sessionmaker(bind=engine)
+    with engine.begin() as conn:
+        pending = [row.id for row in conn.execute(
+            select(conversations.c.id).where(conversations.c.message_count.is_(None))
+        )]
+        if not pending:
+            return
+        
+        # Keep the list order; this isn't a user-visible update
+        keep_order = {'updated_at': conversations.c.updated_at}
+        conn.execute(
+            conversations.update()
+            .where(conversations.c.message_count.is_(None))
+            .values(
+                message_count=select(func.count(messages.c.id)).where(of_conversation).scalar_subquery(),
+                last_message_at=select(func.max(messages.c.timestamp)).where(of_conversation).scalar_subquery(),
+                **keep_order
+            )
+        )
+        
+        # Previews go through make_preview, the same rule new messages use
+        for start in range(0, len(pending), batch_size):
+            ids = pending[start:start + batch_size]
+            rows = conn.execute(
+                select(conversations.c.id, latest.label('content')).where(conversations.c.id.in_(ids))
+            )
+            previews = [{'conversation_id': row.id, 'preview': make_preview(row.content)}
+                        for row in rows if row.content is not None]
+            if previews:
+                conn.execute(
+                    conversations.update()
+                    .where(conversations.c.id == bindparam('conversation_id'))
+                    .values(last_message_preview=bindparam('preview'), **keep_order),
+                    previews
+                )
+        print(f"Backfilled message counts for {len(pending)} conversations")
+
+
+def get_db_session():
+    """
+    Get the database session for the current request.
+    
+    The same session is returned for every call on a thread until
+    remove_db_session() is called, so the auth decorator, the route and
+    the summarization helpers share one connection per request.
+    """
+    get_engine()
     return Session()
+
+
+def remove_db_session():
+    """Close the current thread's session and return its connection to the pool"""
+    Session.remove()
@@ -0,0 +1,324 @@
+"""
+Message persistence for JailbrokeGPT
+Durable mode commits every write on the caller's session, as the routes
+always have. Write-behind mode queues message inserts and conversation
+updates and commits them in grouped transactions from a flush thread, so
+concurrent chats share one commit instead of paying one each.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime
+
+from models import Message, Conversation, get_db_session, remove_db_session
+from tracing import span
+
+
+class PendingWrite:
+    """Handle for a queued message insert; wait() returns its ID once committed"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.message_id = None
+        self.error = None
+
+    def resolve(self, message_id=None, error=None):
+        self.message_id = message_id
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout: float = None) -> int:
+        """
+        Block until the write is committed
+
+        Returns:
+            int: ID of the saved message
+
+        Raises:
+            RuntimeError: If the batch holding the write failed or timed out
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for the message to be saved")
+        if self.error is not None:
+            raise RuntimeError(f"Failed to save message: {self.error}")
+        return self.message_id
+
+
+class DurableWriter:
+    """Commits each write before returning, on the caller's request session"""
+
+    mode = 'durable'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._messages = 0
+        self._updates = 0
+        self._commits = 0
+
+    def add_message(self, conversation_id: int, role: str, content: str) -> PendingWrite:
+        """
+        Save a message (this also bumps the conversation's updated_at)
+
+        Returns:
+            PendingWrite, already resolved
+        """
+        db = get_db_session()
+        message = Message(
+            conversation_id=conversation_id,
+            role=role,
+            content=content
+        )
+        db.add(message)
+        with span('db_commit'):
+            db.flush()
+            message_id = message.id  # Read before commit expires it
+            db.commit()
+        self._count(messages=1)
+
+        write = PendingWrite()
+        write.resolve(message_id)
+        return write
+
+    def update_conversation(self, conversation_id: int, **values):
+        """Set columns of a conversation, e.g. title or summary"""
+        db = get_db_session()
+        db.query(Conversation).filter_by(id=conversation_id).update(values)
+        with span('db_commit'):
+            db.commit()
+        self._count(updates=1)
+
+    def sync(self, conversation_id: int = None):
+        """Make earlier writes to a conversation visible to this thread's session (always are here)"""
+
+    def flush(self):
+        """Commit everything queued so far (nothing is ever queued here)"""
+
+    def _count(self, messages=0, updates=0):
+        with self._lock:
+            self._messages += messages
+            self._updates += updates
+            self._commits += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'messages': self._messages,
+                'updates': self._updates,
+                'commits': self._commits,
+                'avg_batch': round((self._messages + self._updates) / self._commits, 2) if self._commits else 0.0
+            }
+
+
+class WriteBehindWriter(DurableWriter):
+    """
+    Queues writes and commits them in batches from a daemon thread.
+
+    A batch is committed every flush_interval seconds, or as soon as
+    max_batch writes are waiting. Writes keep their submission order, and
+    messages are timestamped when they are queued. Readers call
+    sync(conversation_id) first to wait for that conversation's queued
+    writes (read-your-writes); other conversations aren't held up.
+    """
+
+    mode = 'write_behind'
+
+    def __init__(self, flush_interval: float = 0.02, max_batch: int = 256):
+        """
+        Args:
+            flush_interval: Longest time in seconds a write waits before its batch is committed
+            max_batch: Queued writes that trigger an immediate flush
+        """
+        super().__init__()
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self._cond = threading.Condition(self._lock)
+        self._queue = []
+        self._seq = 0               # Sequence number of the last queued write
+        self._flushed_seq = 0       # Every write up to this one has been committed or failed
+        self._latest = {}           # conversation_id -> seq of its last queued write
+        self._flush_now = False
+        self._failed_batches = 0
+        self._failed_writes = 0
+
+        self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _enqueue(self, conversation_id, item):
+        with self._cond:
+            self._seq += 1
+            self._queue.append((self._seq, conversation_id, item))
+            self._latest[conversation_id] = self._seq
+            if len(self._queue) >= self.max_batch:
+                self._flush_now = True
+            self._cond.notify_all()
+
+    def add_message(self, conversation_id: int, role: str, content: str) -> PendingWrite:
+        """
+        Queue a message insert
+
+        Returns:
+            PendingWrite; wait() on it for the message ID
+        """
+        write = PendingWrite()
+        fields = {'role': role, 'content': content, 'timestamp': datetime.utcnow()}
+        self._enqueue(conversation_id, ('message', fields, write))
+        return write
+
+    def update_conversation(self, conversation_id: int, **values):
+        """Queue an update to a conversation's columns"""
+        self._enqueue(conversation_id, ('update', values, None))
+
+    def sync(self, conversation_id: int = None):
+        """
+        Wait until queued writes are committed and start a fresh read on
+        this thread's session, so the caller sees them
+
+        Args:
+            conversation_id: Only wait for this conversation's writes (all if None)
+        """
+        with self._cond:
+            target = self._seq if conversation_id is None else self._latest.get(conversation_id, 0)
+            if target > self._flushed_seq:
+                with span('db_commit'):
+                    while target > self._flushed_seq:
+                        self._cond.wait()
+        # Ends the session's transaction, so a REPEATABLE READ snapshot taken
+        # before the flush doesn't hide the new rows
+        get_db_session().commit()
+
+    def flush(self):
+        """Commit everything queued so far and wait for it"""
+        with self._cond:
+            target = self._seq
+            if target > self._flushed_seq:
+                self._flush_now = True
+                self._cond.notify_all()
+            while target > self._flushed_seq:
+                self._cond.wait()
+
+    def _next_batch(self):
+        """Block until there is something to write and its flush interval has passed"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = time.monotonic() + self.flush_interval
+            while not self._flush_now:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._queue = self._queue, []
+            self._flush_now = False
+            return batch
+
+    def _write(self, batch):
+        """
+        Commit writes in a single transaction
+
+        Returns:
+            dict: PendingWrite -> ID of its message
+        """
+        db = get_db_session()
+        try:
+            added = []
+            for _, conversation_id, (kind, values, write) in batch:
+                if kind == 'update':
+                    # Autoflushes the messages added before it, keeping submission order
+                    db.query(Conversation).filter_by(id=conversation_id).update(values)
+                else:
+                    message = Message(conversation_id=conversation_id, **values)
+                    db.add(message)
+                    added.append((write, message))
+            db.flush()
+            ids = {write: message.id for write, message in added}
+            db.commit()
+            return ids
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            # This thread writes on a session of its own
+            remove_db_session()
+
+    def _write_each(self, batch):
+        """
+        Retry a failed batch one write per transaction, so a bad row only fails itself
+
+        Returns:
+            (ids, errors, failed): PendingWrite -> message ID, PendingWrite ->
+            error, and the number of writes that failed
+        """
+        ids, errors, failed = {}, {}, 0
+        for entry in batch:
+            try:
+                ids.update(self._write([entry]))
+            except Exception as e:
+                print(f"Write-behind write for conversation {entry[1]} failed: {e}")
+                failed += 1
+                write = entry[2][2]
+                if write is not None:
+                    errors[write] = str(e)
+        return ids, errors, failed
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            errors, failed = {}, 0
+            try:
+                ids = self._write(batch)
+                commits = 1
+            except Exception as e:
+                print(f"Write-behind batch of {len(batch)} writes failed, retrying one by one: {e}")
+                ids, errors, failed = self._write_each(batch)
+                commits = len(batch) - failed
+
+            for _, _, (kind, _, write) in batch:
+                if kind == 'message':
+                    write.resolve(ids.get(write), errors.get(write))
+
+            messages = sum(1 for _, _, (kind, _, _) in batch if kind == 'message')
+            with self._cond:
+                self._messages += len(ids)
+                self._updates += len(batch) - messages - (failed - len(errors))
+                self._commits += commits
+                self._failed_writes += failed
+                if failed:
+                    self._failed_batches += 1
+                self._flushed_seq = batch[-1][0]
+                for _, conversation_id, _ in batch:
+                    if self._latest.get(conversation_id, 0) <= self._flushed_seq:
+                        self._latest.pop(conversation_id, None)
+                self._cond.notify_all()
+
+    def get_stats(self) -> dict:
+        stats = super().get_stats()
+        with self._cond:
+            stats.update({
+                'queued': len(self._queue),
+                'failed_batches': self._failed_batches,
+                'failed_writes': self._failed_writes,
+                'flush_interval_ms': self.flush_interval * 1000
+            })
+        return stats
+
+
+def create_writer(mode: str = 'durable', flush_interval: float = 0.02, max_batch: int = 256):
+    """
+    Build the message writer for a persistence mode
+
+    Args:
+        mode: 'durable' (commit before returning) or 'write_behind' (batched)
+        flush_interval: Seconds between write-behind flushes
+        max_batch: Queued writes that trigger an early write-behind flush
+
+    Returns:
+        DurableWriter or WriteBehindWriter
+    """
+    if mode == 'write_behind':
+        return WriteBehindWriter(flush_interval=flush_interval, max_batch=max_batch)
+    if mode != 'durable':
+        raise ValueError(f"Unknown persistence mode: {mode}")
+    return DurableWriter()
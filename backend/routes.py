@@ -1,10 +1,26 @@
-from flask import Blueprint, request, jsonify
-from models import User, Conversation, Message, get_db_session
+import json
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from models import User, Conversation, Message, get_db_session, get_messages_before, get_conversations_before
 from auth import token_required
+from search import search_messages, search_conversation_titles
 from datetime import datetime
 
 routes = Blueprint('routes', __name__)
 
+# Page size limits for GET /conversations/<id>/messages
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Page size limits for GET /conversations
+DEFAULT_CONVERSATION_PAGE_SIZE = 100
+MAX_CONVERSATION_PAGE_SIZE = 500
+
+# Page size limits for GET /search
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+# Ranked results can't be paged by key, so deep offsets are capped
+MAX_SEARCH_OFFSET = 1000
+
 # ============================================
 # Authentication Routes
 # ============================================
@@ -52,8 +68,6 @@ def register():
     except Exception as e:
         db.rollback()
         return jsonify({'error': f'Registration failed: {str(e)}'}), 500
-    finally:
-        db.close()
 
 
 @routes.route('/auth/login', methods=['POST'])
@@ -68,25 +82,21 @@ def login():
     password = data['password']
     
     db = get_db_session()
-    try:
-        # Find user
-        user = db.query(User).filter_by(username=username).first()
-        
-        if not user or not user.check_password(password):
-            return jsonify({'error': 'Invalid username or password'}), 401
-        
-        # Generate token
-        from auth import generate_token
-        token = generate_token(user.id)
-        
-        return jsonify({
-            'message': 'Login successful',
-            'token': token,
-            'user': user.to_dict()
-        }), 200
+    # Find user
+    user = db.query(User).filter_by(username=username).first()
+    
+    if not user or not user.check_password(password):
+        return jsonify({'error': 'Invalid username or password'}), 401
     
-    finally:
-        db.close()
+    # Generate token
+    from auth import generate_token
+    token = generate_token(user.id)
+    
+    return jsonify({
+        'message': 'Login successful',
+        'token': token,
+        'user': user.to_dict()
+    }), 200
 
 
 # ============================================
@@ -96,20 +106,80 @@ def login():
 @routes.route('/conversations', methods=['GET'])
 @token_required
 def get_conversations(current_user):
-    """Get all conversations for the current user"""
+    """
+    Get one page of the current user's conversations, most recently updated first
+    
+    Each item carries message_count and last_message_preview but not the
+    summary, so the sidebar renders from one indexed query.
+    
+    Query parameters:
+        limit: Page size (default 100, max 500)
+        before_id: Return conversations updated before this one (from next_before_id)
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', DEFAULT_CONVERSATION_PAGE_SIZE)), 1), MAX_CONVERSATION_PAGE_SIZE)
+        before_id = request.args.get('before_id', type=int)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
     db = get_db_session()
+    before = None
+    if before_id is not None:
+        before = db.query(Conversation.id, Conversation.updated_at)\
+            .filter_by(id=before_id, user_id=current_user.id)\
+            .first()
+        if not before:
+            return jsonify({'error': 'before_id not found'}), 400
+    
+    # Fetch one extra row to know whether there's another page
+    conversations = get_conversations_before(db, current_user.id, before, limit + 1)
+    has_more = len(conversations) > limit
+    conversations = conversations[:limit]
+    
+    return jsonify({
+        'conversations': [conv.to_list_dict() for conv in conversations],
+        'has_more': has_more,
+        'next_before_id': conversations[-1].id if has_more else None
+    }), 200
+
+
+@routes.route('/search', methods=['GET'])
+@token_required
+def search(current_user):
+    """
+    Full-text search over the current user's messages and conversation titles
+    
+    Every word must match (as a prefix); results are ranked by relevance and
+    snippets mark matches with <mark>.
+    
+    Query parameters:
+        q: Search text
+        limit: Page size (default 20, max 100)
+        offset: Results to skip (from next_offset, max 1000)
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q required'}), 400
+    
     try:
-        conversations = db.query(Conversation)\
-            .filter_by(user_id=current_user.id)\
-            .order_by(Conversation.updated_at.desc())\
-            .all()
-        
-        return jsonify({
-            'conversations': [conv.to_dict() for conv in conversations]
-        }), 200
+        limit = min(max(int(request.args.get('limit', DEFAULT_SEARCH_PAGE_SIZE)), 1), MAX_SEARCH_PAGE_SIZE)
+        offset = min(max(int(request.args.get('offset', 0)), 0), MAX_SEARCH_OFFSET)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    
+    db = get_db_session()
+    # Fetch one extra row to know whether there's another page
+    messages = search_messages(db, current_user.id, query, limit + 1, offset)
+    has_more = len(messages) > limit
     
-    finally:
-        db.close()
+    return jsonify({
+        'query': query,
+        # Title matches are only listed with the first page
+        'conversations': search_conversation_titles(db, current_user.id, query) if offset == 0 else [],
+        'messages': messages[:limit],
+        'has_more': has_more,
+        'next_offset': offset + limit if has_more else None
+    }), 200
 
 
 @routes.route('/conversations', methods=['POST'])
@@ -136,29 +206,119 @@ def create_conversation(current_user):
     except Exception as e:
         db.rollback()
         return jsonify({'error': f'Failed to create conversation: {str(e)}'}), 500
-    finally:
-        db.close()
 
 
 @routes.route('/conversations/<int:conversation_id>', methods=['GET'])
 @token_required
 def get_conversation(conversation_id, current_user):
-    """Get a specific conversation with all messages"""
+    """
+    Get a specific conversation with all messages
+    
+    Pass ?messages=false for metadata only. Long histories should be read
+    with GET /conversations/<id>/messages or /export instead.
+    """
+    include_messages = request.args.get('messages', 'true').lower() != 'false'
+    
     db = get_db_session()
+    conversation = db.query(Conversation)\
+        .filter_by(id=conversation_id, user_id=current_user.id)\
+        .first()
+    
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+    
+    return jsonify({
+        'conversation': conversation.to_dict(include_messages=include_messages)
+    }), 200
+
+
+@routes.route('/conversations/<int:conversation_id>/messages', methods=['GET'])
+@token_required
+def get_conversation_messages(conversation_id, current_user):
+    """
+    Get one page of a conversation's messages, newest first
+    
+    Query parameters:
+        limit: Page size (default 50, max 200)
+        before_id: Return messages older than this message (from next_before_id)
+    """
     try:
-        conversation = db.query(Conversation)\
-            .filter_by(id=conversation_id, user_id=current_user.id)\
+        limit = min(max(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        before_id = request.args.get('before_id', type=int)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    db = get_db_session()
+    conversation = db.query(Conversation.id)\
+        .filter_by(id=conversation_id, user_id=current_user.id)\
+        .first()
+    
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+    
+    before = None
+    if before_id is not None:
+        before = db.query(Message)\
+            .filter_by(id=before_id, conversation_id=conversation_id)\
             .first()
+        if not before:
+            return jsonify({'error': 'before_id not found in this conversation'}), 400
+    
+    # Fetch one extra row to know whether there's another page
+    messages = get_messages_before(db, conversation_id, before, limit + 1)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    
+    return jsonify({
+        'messages': [msg.to_dict() for msg in messages],
+        'has_more': has_more,
+        'next_before_id': messages[-1].id if has_more else None
+    }), 200
+
+
+@routes.route('/conversations/<int:conversation_id>/export', methods=['GET'])
+@token_required
+def export_conversation(conversation_id, current_user):
+    """
+    Export a conversation as NDJSON
+    
+    The first line is the conversation metadata, followed by one line per
+    message, oldest first. Messages are streamed from the database in
+    batches, so the full history is never held in memory.
+    """
+    db = get_db_session()
+    conversation = db.query(Conversation)\
+        .filter_by(id=conversation_id, user_id=current_user.id)\
+        .first()
+    
+    if not conversation:
+        return jsonify({'error': 'Conversation not found'}), 404
+    
+    def generate():
+        yield json.dumps({'conversation': conversation.to_dict()}) + "\n"
         
-        if not conversation:
-            return jsonify({'error': 'Conversation not found'}), 404
-        
-        return jsonify({
-            'conversation': conversation.to_dict(include_messages=True)
-        }), 200
+        messages = db.query(Message)\
+            .filter_by(conversation_id=conversation_id)\
+            .order_by(Message.timestamp, Message.id)\
+            .yield_per(500)
+        for msg in messages:
+            yield json.dumps(msg.to_dict()) + "\n"
     
-    finally:
-        db.close()
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename=conversation-{conversation_id}.ndjson'}
+    )
+
+
+# Called with (user_id, conversation_id) after a conversation is deleted; set by the app
+_delete_listener = None
+
+
+def set_delete_listener(listener):
+    """Register a callback for deleted conversations, e.g. to drop their memory vectors"""
+    global _delete_listener
+    _delete_listener = listener
 
 
 @routes.route('/conversations/<int:conversation_id>', methods=['DELETE'])
@@ -177,13 +337,14 @@ def delete_conversation(conversation_id, current_user):
         db.delete(conversation)
         db.commit()
         
+        if _delete_listener is not None:
+            _delete_listener(current_user.id, conversation_id)
+        
         return jsonify({'message': 'Conversation deleted'}), 200
     
     except Exception as e:
         db.rollback()
         return jsonify({'error': f'Failed to delete conversation: {str(e)}'}), 500
-    finally:
-        db.close()
 
 
 @routes.route('/conversations/<int:conversation_id>/title', methods=['PATCH'])
@@ -216,5 +377,3 @@ def update_conversation_title(conversation_id, current_user):
     except Exception as e:
         db.rollback()
         return jsonify({'error': f'Failed to update title: {str(e)}'}), 500
-    finally:
-        db.close()
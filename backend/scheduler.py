@@ -0,0 +1,238 @@
+"""
+Inference scheduler for JailbrokeGPT
+Queues generation requests in front of the model so concurrent Flask
+threads take turns instead of piling onto the Llama instance at once.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# Priority classes (lower runs first)
+PRIORITY_INTERACTIVE = 0  # User-facing chat replies
+PRIORITY_BACKGROUND = 10  # Summaries, titles and other housekeeping
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: 'interactive',
+    PRIORITY_BACKGROUND: 'background'
+}
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler sheds a request instead of queueing it"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelNotReadyError(Exception):
+    """Raised when a generation is requested before the model has finished loading"""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    __slots__ = ('priority', 'user_id', 'enqueued_at', 'granted')
+
+    def __init__(self, priority, user_id):
+        self.priority = priority
+        self.user_id = user_id
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+
+
+class InferenceScheduler:
+    """
+    Bounded priority queue with per-user fair queuing.
+
+    Callers block in acquire() until a generation slot is free. Waiting
+    requests are served highest priority first, and round-robin between
+    users within a priority so one user's burst can't starve everyone else.
+    """
+
+    def __init__(self, max_queue: int = 32, max_concurrency: int = 1, max_wait: float = 120.0):
+        """
+        Args:
+            max_queue: Maximum number of waiting requests before shedding load
+            max_concurrency: Number of generations allowed to run at once
+            max_wait: Seconds a request may wait for a slot before it is shed
+        """
+        self.max_queue = max_queue
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        # priority -> OrderedDict(user_id -> deque of tickets)
+        self._queues = {}
+        self._waiting = 0
+        self._active = 0
+
+        # Statistics
+        self._admitted = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._waits = deque(maxlen=1000)
+        self._wait_max = 0.0
+        self._service_avg = None
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, user_id=None) -> float:
+        """
+        Wait for a generation slot
+
+        Args:
+            priority: Priority class (PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND)
+            user_id: Owner of the request, used for fair queuing
+
+        Returns:
+            Time the slot was granted, to be passed to release()
+
+        Raises:
+            QueueFullError: If the queue is full or the wait timed out
+        """
+        with self._cond:
+            if self._active < self.max_concurrency and self._waiting == 0:
+                self._active += 1
+                return self._granted(0.0)
+
+            if self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise QueueFullError("Inference queue is full", self._retry_after())
+
+            ticket = _Ticket(priority, user_id)
+            users = self._queues.setdefault(priority, OrderedDict())
+            users.setdefault(user_id, deque()).append(ticket)
+            self._waiting += 1
+
+            deadline = ticket.enqueued_at + self.max_wait
+            while not ticket.granted:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self._remove(ticket)
+                    self._timeouts += 1
+                    raise QueueFullError("Timed out waiting for the model", self._retry_after())
+                self._cond.wait(remaining)
+
+            return self._granted(time.perf_counter() - ticket.enqueued_at)
+
+    def release(self, started: float):
+        """
+        Give a generation slot back and wake the next waiting request
+
+        Args:
+            started: Value returned by acquire()
+        """
+        with self._cond:
+            duration = time.perf_counter() - started
+            if self._service_avg is None:
+                self._service_avg = duration
+            else:
+                self._service_avg = 0.8 * self._service_avg + 0.2 * duration
+
+            self._active -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_INTERACTIVE, user_id=None):
+        """Context manager that holds a generation slot for the duration of the block"""
+        started = self.acquire(priority, user_id)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def set_concurrency(self, max_concurrency: int):
+        """Change how many generations may run at once, e.g. once worker processes are up"""
+        with self._cond:
+            self.max_concurrency = max_concurrency
+            self._dispatch()
+
+    def waiting(self, priority: int = None) -> int:
+        """Number of requests waiting, optionally only those of one priority class"""
+        with self._cond:
+            if priority is None:
+                return self._waiting
+            return sum(len(q) for q in self._queues.get(priority, {}).values())
+
+    def check_capacity(self):
+        """
+        Fail fast if a new request would be shed
+
+        Raises:
+            QueueFullError: If the queue is already full
+        """
+        with self._cond:
+            if self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise QueueFullError("Inference queue is full", self._retry_after())
+
+    def get_stats(self) -> dict:
+        """Get queue depth, wait time and throughput counters"""
+        with self._cond:
+            waits = sorted(self._waits)
+            depth_by_priority = {
+                PRIORITY_NAMES.get(priority, str(priority)): sum(len(q) for q in users.values())
+                for priority, users in self._queues.items()
+            }
+
+            return {
+                'queue_depth': self._waiting,
+                'queue_depth_by_priority': depth_by_priority,
+                'active': self._active,
+                'max_queue': self.max_queue,
+                'max_concurrency': self.max_concurrency,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'timeouts': self._timeouts,
+                'wait_avg_ms': round(sum(waits) * 1000 / len(waits), 3) if waits else 0.0,
+                'wait_p95_ms': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 3) if waits else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+                'service_avg_ms': round(self._service_avg * 1000, 3) if self._service_avg else 0.0
+            }
+
+    def _granted(self, waited: float) -> float:
+        """Record a granted slot (caller holds the lock)"""
+        self._admitted += 1
+        self._waits.append(waited)
+        self._wait_max = max(self._wait_max, waited)
+        return time.perf_counter()
+
+    def _dispatch(self):
+        """Hand free slots to the next waiting tickets (caller holds the lock)"""
+        while self._active < self.max_concurrency and self._waiting:
+            ticket = self._pop_next()
+            ticket.granted = True
+            self._active += 1
+            self._waiting -= 1
+        self._cond.notify_all()
+
+    def _pop_next(self) -> _Ticket:
+        """Take the next ticket: best priority first, then round-robin over users"""
+        priority = min(p for p, users in self._queues.items() if users)
+        users = self._queues[priority]
+
+        user_id, tickets = next(iter(users.items()))
+        ticket = tickets.popleft()
+        if tickets:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+
+        return ticket
+
+    def _remove(self, ticket: _Ticket):
+        """Drop a ticket that gave up waiting (caller holds the lock)"""
+        users = self._queues[ticket.priority]
+        tickets = users[ticket.user_id]
+        tickets.remove(ticket)
+        if not tickets:
+            del users[ticket.user_id]
+        self._waiting -= 1
+
+    def _retry_after(self) -> int:
+        """Estimate seconds until a slot frees up (caller holds the lock)"""
+        service = self._service_avg or 1.0
+        return max(1, math.ceil(service * (self._waiting + 1) / self.max_concurrency))
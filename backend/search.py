@@ -0,0 +1,232 @@
+"""
+Full-text search for JailbrokeGPT
+Searches message content and conversation titles through the database's
+own full-text index: FULLTEXT indexes on MySQL, FTS5 tables kept in sync
+by triggers on SQLite. Ranking happens in the index; only the returned
+page is loaded and highlighted.
+"""
+import html
+import re
+from sqlalchemy import inspect, text
+
+# Characters of message content shown around the first match
+SNIPPET_CHARS = 160
+
+# Search terms beyond this are ignored
+MAX_TERMS = 8
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# InnoDB leaves these out of FULLTEXT indexes (innodb_ft_min_token_size and
+# the default stopword list), and a required term it can't match makes a
+# boolean query match nothing, so they are dropped from MySQL queries
+MYSQL_MIN_TOKEN_SIZE = 3
+MYSQL_STOPWORDS = frozenset((
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from', 'how',
+    'i', 'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what',
+    'when', 'where', 'who', 'will', 'with', 'und', 'www'
+))
+
+_SQLITE_FTS = (
+    # External-content FTS5 tables: the index stores no second copy of the text
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, content='messages', content_rowid='id', tokenize='unicode61')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5("
+    "title, content='conversations', content_rowid='id', tokenize='unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+    "INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN "
+    "INSERT INTO conversations_fts(rowid, title) VALUES (new.id, new.title); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN "
+    "INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.id, old.title); END",
+    "CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF title ON conversations BEGIN "
+    "INSERT INTO conversations_fts(conversations_fts, rowid, title) VALUES ('delete', old.id, old.title); "
+    "INSERT INTO conversations_fts(rowid, title) VALUES (new.id, new.title); END",
+)
+
+_MYSQL_FULLTEXT = {
+    # table: (index name, column)
+    'messages': ('ft_messages_content', 'content'),
+    'conversations': ('ft_conversations_title', 'title'),
+}
+
+
+def create_search_indexes(engine):
+    """
+    Create the full-text indexes if they don't exist yet
+
+    On SQLite, a newly created FTS5 table is filled from the existing rows;
+    MySQL builds a new FULLTEXT index from the table itself.
+    """
+    dialect = engine.dialect.name
+    if dialect == 'mysql':
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table, (index_name, column) in _MYSQL_FULLTEXT.items():
+                existing = {index['name'] for index in inspector.get_indexes(table)}
+                if index_name not in existing:
+                    print(f"Creating full-text index {index_name}")
+                    conn.execute(text(f"ALTER TABLE {table} ADD FULLTEXT INDEX {index_name} ({column})"))
+    elif dialect == 'sqlite':
+        existing_tables = set(inspect(engine).get_table_names())
+        with engine.begin() as conn:
+            for statement in _SQLITE_FTS:
+                conn.execute(text(statement))
+            for table in ('messages_fts', 'conversations_fts'):
+                if table not in existing_tables:
+                    print(f"Building full-text index {table}")
+                    conn.execute(text(f"INSERT INTO {table}({table}) VALUES ('rebuild')"))
+    else:
+        print(f"Warning: full-text search is not supported on {dialect}")
+
+
+def parse_terms(query):
+    """Split a search query into plain word terms (operators and quotes are dropped)"""
+    return [term.lower() for term in _TERM_RE.findall(query)][:MAX_TERMS]
+
+
+def index_terms(dialect, query):
+    """
+    Terms of query the full-text index can match
+
+    Returns:
+        list: Like parse_terms(query), but without words the MySQL index leaves out
+    """
+    terms = [term.lower() for term in _TERM_RE.findall(query)]
+    if dialect == 'mysql':
+        terms = [term for term in terms if len(term) >= MYSQL_MIN_TOKEN_SIZE and term not in MYSQL_STOPWORDS]
+    return terms[:MAX_TERMS]
+
+
+def _match_expression(dialect, terms):
+    """Build the index query: every term must match as a word prefix"""
+    if dialect == 'mysql':
+        return ' '.join(f'+{term}*' for term in terms)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def highlight(content, terms, width=SNIPPET_CHARS):
+    """
+    Cut a snippet of content around the first matching term and mark matches
+
+    Returns:
+        str: HTML-escaped snippet with matches wrapped in <mark>
+    """
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(term) for term in terms) + r')\w*', re.IGNORECASE)
+    first = pattern.search(content)
+    start = 0
+    if first and first.start() > width // 3:
+        start = first.start() - width // 3
+    snippet = content[start:start + width]
+
+    parts = []
+    last = 0
+    for match in pattern.finditer(snippet):
+        parts.append(html.escape(snippet[last:match.start()]))
+        parts.append(f'<mark>{html.escape(match.group(0))}</mark>')
+        last = match.end()
+    parts.append(html.escape(snippet[last:]))
+
+    result = ''.join(parts)
+    if start > 0:
+        result = '...' + result
+    if start + width < len(content):
+        result += '...'
+    return result
+
+
+def search_messages(db, user_id, query, limit=20, offset=0):
+    """
+    Find a user's messages matching query, best match first
+
+    Args:
+        db: Database session
+        user_id: Only messages in this user's conversations
+        query: Search text
+        limit: Maximum number of results
+        offset: Results to skip (for later pages)
+
+    Returns:
+        list: Result dicts with message and conversation fields, score and snippet
+    """
+    dialect = db.get_bind().dialect.name
+    terms = index_terms(dialect, query)
+    if not terms:
+        return []
+    params = {'match': _match_expression(dialect, terms), 'user_id': user_id, 'limit': limit, 'offset': offset}
+
+    if dialect == 'mysql':
+        sql = text(
+            "SELECT m.id, m.conversation_id, m.role, m.content, m.timestamp, c.title, "
+            "MATCH(m.content) AGAINST (:match IN BOOLEAN MODE) AS score "
+            "FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE MATCH(m.content) AGAINST (:match IN BOOLEAN MODE) AND c.user_id = :user_id "
+            "ORDER BY score DESC, m.id DESC LIMIT :limit OFFSET :offset"
+        )
+    else:
+        # bm25() is lower for better matches
+        sql = text(
+            "SELECT m.id, m.conversation_id, m.role, m.content, m.timestamp, c.title, "
+            "-bm25(messages_fts) AS score "
+            "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+            "JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE messages_fts MATCH :match AND c.user_id = :user_id "
+            "ORDER BY bm25(messages_fts), m.id DESC LIMIT :limit OFFSET :offset"
+        )
+
+    return [{
+        'message_id': row.id,
+        'conversation_id': row.conversation_id,
+        'conversation_title': row.title,
+        'role': row.role,
+        'timestamp': _isoformat(row.timestamp),
+        'score': float(row.score),
+        'snippet': highlight(row.content, terms)
+    } for row in db.execute(sql, params)]
+
+
+def search_conversation_titles(db, user_id, query, limit=10):
+    """
+    Find a user's conversations whose title matches query, best match first
+
+    Returns:
+        list: Dicts with id, title, updated_at, score and highlighted title
+    """
+    dialect = db.get_bind().dialect.name
+    terms = index_terms(dialect, query)
+    if not terms:
+        return []
+    params = {'match': _match_expression(dialect, terms), 'user_id': user_id, 'limit': limit}
+
+    if dialect == 'mysql':
+        sql = text(
+            "SELECT c.id, c.title, c.updated_at, MATCH(c.title) AGAINST (:match IN BOOLEAN MODE) AS score "
+            "FROM conversations c "
+            "WHERE MATCH(c.title) AGAINST (:match IN BOOLEAN MODE) AND c.user_id = :user_id "
+            "ORDER BY score DESC, c.updated_at DESC LIMIT :limit"
+        )
+    else:
+        sql = text(
+            "SELECT c.id, c.title, c.updated_at, -bm25(conversations_fts) AS score "
+            "FROM conversations_fts JOIN conversations c ON c.id = conversations_fts.rowid "
+            "WHERE conversations_fts MATCH :match AND c.user_id = :user_id "
+            "ORDER BY bm25(conversations_fts), c.updated_at DESC LIMIT :limit"
+        )
+
+    return [{
+        'id': row.id,
+        'title': row.title,
+        'updated_at': _isoformat(row.updated_at),
+        'score': float(row.score),
+        'highlight': highlight(row.title or '', terms)
+    } for row in db.execute(sql, params)]
+
+
+def _isoformat(value):
+    # Raw SQL on SQLite returns DATETIME columns as strings
+    return value.isoformat() if hasattr(value, 'isoformat') else value
@@ -0,0 +1,127 @@
+"""
+Speculative decoding for JailbrokeGPT
+Draft models that guess upcoming tokens for llama.cpp to verify in a
+single forward pass. Llama checks every drafted token against what it
+would have sampled itself, so the output distribution is unchanged; only
+correct guesses save time.
+"""
+import threading
+
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+from autotune import detect_hardware
+
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Drafts tokens greedily with a small GGUF model sharing the main model's
+    vocabulary (e.g. a 1B model drafting for an 8B one of the same family)
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = 8, n_ctx: int = 2048, n_threads: int = None):
+        """
+        Args:
+            model_path: Path to the draft GGUF file
+            num_pred_tokens: Tokens drafted per step
+            n_ctx: Draft model context window (should match the main model's)
+            n_threads: CPU threads for the draft model (default: the physical
+                cores this process may use). Drafting and verifying take
+                turns, so it can use as many as the main model.
+        """
+        if n_threads is None:
+            n_threads = detect_hardware()['usable_threads']
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False)
+
+    def __call__(self, input_ids, /, **kwargs):
+        # generate() reuses the longest evaluated prefix, so only new tokens are evaluated
+        drafted = []
+        for token in self.llm.generate(input_ids.tolist(), top_k=1, temp=0.0):
+            if token == self.llm.token_eos():
+                break
+            drafted.append(token)
+            if len(drafted) >= self.num_pred_tokens:
+                break
+        return np.array(drafted, dtype=np.intc)
+
+
+class CountingDraftModel(LlamaDraftModel):
+    """
+    Wraps a draft model to measure how many drafted tokens are accepted.
+
+    Llama doesn't report acceptance, but it can be read off the next draft
+    request: the context grows by the accepted drafts plus one sampled token.
+    """
+
+    def __init__(self, inner: LlamaDraftModel):
+        self.inner = inner
+        self._lock = threading.Lock()
+        self._last_len = None
+        self._last_drafted = 0
+
+        self.calls = 0
+        self.drafted = 0
+        self.verified = 0   # Drafted tokens whose outcome is known
+        self.accepted = 0
+
+    def start_sequence(self):
+        """Forget the previous generation, so its last drafts aren't scored against a new prompt"""
+        with self._lock:
+            self._last_len = None
+            self._last_drafted = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        with self._lock:
+            n = len(input_ids)
+            if self._last_len is not None and self._last_len < n <= self._last_len + 1 + self._last_drafted:
+                self.verified += self._last_drafted
+                self.accepted += n - self._last_len - 1
+
+            drafts = self.inner(input_ids, **kwargs)
+
+            self.calls += 1
+            self.drafted += len(drafts)
+            self._last_len = n
+            self._last_drafted = len(drafts)
+            return drafts
+
+    def get_stats(self) -> dict:
+        """Get drafted/accepted token counts and the acceptance rate"""
+        with self._lock:
+            return {
+                'draft_calls': self.calls,
+                'drafted_tokens': self.drafted,
+                'verified_tokens': self.verified,
+                'accepted_tokens': self.accepted,
+                'acceptance_rate': round(self.accepted / self.verified, 4) if self.verified else 0.0
+            }
+
+
+def create_draft_model(mode: str, num_pred_tokens: int = 10, draft_model_path: str = None, n_ctx: int = 2048,
+                       n_threads: int = None):
+    """
+    Build a counting draft model for Llama(draft_model=...)
+
+    Args:
+        mode: 'prompt_lookup' (n-gram matches from the prompt) or 'draft' (small GGUF model)
+        num_pred_tokens: Tokens drafted per step
+        draft_model_path: Draft GGUF file, for mode='draft'
+        n_ctx: Context window for the draft model
+        n_threads: CPU threads for the draft model (default: detected)
+
+    Returns:
+        CountingDraftModel, or None if mode is 'off'
+    """
+    if not mode or mode == 'off':
+        return None
+    if mode == 'prompt_lookup':
+        inner = LlamaPromptLookupDecoding(num_pred_tokens=num_pred_tokens)
+    elif mode == 'draft':
+        if not draft_model_path:
+            raise ValueError("Speculative mode 'draft' needs a draft model path")
+        inner = GGUFDraftModel(draft_model_path, num_pred_tokens=num_pred_tokens, n_ctx=n_ctx, n_threads=n_threads)
+    else:
+        raise ValueError(f"Unknown speculative mode: {mode}")
+    return CountingDraftModel(inner)
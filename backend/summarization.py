@@ -2,195 +2,382 @@
 Conversation summarization module.
 Reduces context window usage by summarizing older messages.
 """
-from models import Message, Conversation, get_db_session
+from models import (
+    Conversation, get_db_session, count_messages, get_first_messages, iter_messages_newest_first
+)
+from scheduler import PRIORITY_BACKGROUND
 
-def summarize_conversation(model_loader, conversation_id, keep_last_n=5):
+# Upper bound on the rolling summary, so it can't crowd out recent messages
+MAX_SUMMARY_CHARS = 2000
+
+
+def summarize_conversation(model_loader, conversation_id, keep_last_n=5, max_batch=20, writer=None):
     """
-    Summarize a conversation by condensing older messages.
+    Fold messages added since the last run into the rolling summary.
+    
+    Conversation.summarized_upto records the last message already covered
+    by the summary, so each run only reads and summarizes newer messages
+    instead of the whole history.
     
     Args:
         model_loader: The model loader instance
         conversation_id: ID of the conversation to summarize
         keep_last_n: Number of recent messages to keep unsummarized
+        max_batch: Maximum number of messages folded in per run
+        writer: Message writer (persistence.py) to save the summary through;
+            committed on this session if None
     
     Returns:
         dict: Summary information
     """
     db = get_db_session()
-    try:
-        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
-        if not conversation:
-            return {'error': 'Conversation not found'}
-        
-        messages = conversation.messages
-        
-        # If fewer than keep_last_n + 3 messages, no need to summarize
-        if len(messages) <= keep_last_n + 3:
-            return {'summarized': False, 'reason': 'Not enough messages'}
-        
-        # Get messages to summarize (all except last keep_last_n)
-        messages_to_summarize = messages[:-keep_last_n]
-        
-        # Build conversation text
-        conversation_text = "\n".join([
-            f"{msg.role.upper()}: {msg.content}"
-            for msg in messages_to_summarize
-        ])
-        
-        # Generate summary using the model
+    conversation = db.query(Conversation).filter_by(id=conversation_id).first()
+    if not conversation:
+        return {'error': 'Conversation not found'}
+    
+    # Get messages to summarize (all new ones except last keep_last_n), oldest first
+    unsummarized = count_messages(db, conversation_id, after_id=conversation.summarized_upto)
+    batch_size = min(unsummarized - keep_last_n, max_batch)
+    messages_to_summarize = []
+    if batch_size > 0:
+        messages_to_summarize = get_first_messages(
+            db, conversation_id, batch_size, after_id=conversation.summarized_upto
+        )
+    
+    # Not worth a model call for just a couple of messages
+    if len(messages_to_summarize) < 3:
+        return {'summarized': False, 'reason': 'Not enough messages'}
+    
+    # Build conversation text
+    conversation_text = "\n".join([
+        f"{msg.role.upper()}: {msg.content}"
+        for msg in messages_to_summarize
+    ])
+    
+    # Generate summary using the model
+    if conversation.summary:
+        summary_prompt = f"""Update the summary of this conversation with the new messages below. Keep it concise, preserving key information and context:
+
+Current summary:
+{conversation.summary}
+
+New messages:
+{conversation_text}
+
+Provide the updated summary (2-4 sentences):"""
+    else:
         summary_prompt = f"""Summarize the following conversation concisely, preserving key information and context:
 
 {conversation_text}
 
 Provide a brief summary (2-3 sentences):"""
+    
+    try:
+        summary = model_loader.generate(
+            prompt=summary_prompt,
+            max_tokens=150,
+            temperature=0.3,
+            priority=PRIORITY_BACKGROUND,
+            user_id=conversation.user_id,
+            cache=True  # Identical messages get the same summary
+        )
         
-        try:
-            summary = model_loader.generate(
-                prompt=summary_prompt,
-                max_tokens=150,
-                temperature=0.3
-            )
-            
-            # Update conversation summary
-            if conversation.summary:
-                # Append to existing summary
-                conversation.summary = f"{conversation.summary}\n\n{summary}"
-            else:
-                conversation.summary = summary
-            
-            db.commit()
-            
-            return {
-                'summarized': True,
-                'summary': summary,
-                'messages_summarized': len(messages_to_summarize),
-                'messages_kept': keep_last_n
-            }
+        # The new summary replaces the old one, which it already folds in
+        values = {'summarized_upto': messages_to_summarize[-1].id}
+        if summary:
+            values['summary'] = summary[:MAX_SUMMARY_CHARS]
+        save_conversation(db, conversation, values, writer)
         
-        except Exception as e:
-            return {'error': f'Failed to generate summary: {str(e)}'}
+        return {
+            'summarized': True,
+            'summary': summary,
+            'messages_summarized': len(messages_to_summarize),
+            'summarized_upto': values['summarized_upto']
+        }
+    
+    except Exception as e:
+        db.rollback()
+        return {'error': f'Failed to generate summary: {str(e)}'}
+
+
+def save_conversation(db, conversation, values, writer=None):
+    """Set conversation columns through the message writer, or commit them on db"""
+    if writer is not None:
+        writer.update_conversation(conversation.id, **values)
+        return
+    for key, value in values.items():
+        setattr(conversation, key, value)
+    db.commit()
+
+
+# Tokens taken by the "Role: " label and newline around each message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# The message window's first message is always a multiple of this index
+WINDOW_STEP = 4
+
+# Line put before recalled messages
+RECALL_HEADER = "Relevant earlier messages:"
+
+# A recalled message too long for what's left of the memory budget is cut
+# to fit only if at least this many of its tokens still fit
+MIN_RECALL_TOKENS = 32
+
+
+def estimate_tokens(text):
+    """Rough token count for when the model tokenizer isn't available"""
+    return len(text) // 4 + 1
+
+
+def get_message_tokens(msg, count_tokens=None):
+    """
+    Get a message's token count, counting and storing it if it's missing.
+    
+    Args:
+        msg: Message row
+        count_tokens: Model tokenizer count function (returns None if unavailable)
+    
+    Returns:
+        int: Tokens the message takes up in the prompt
+    """
+    if msg.token_count is None and count_tokens is not None:
+        msg.token_count = count_tokens(msg.content)
+    
+    tokens = msg.token_count if msg.token_count is not None else estimate_tokens(msg.content)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def truncate_to_tokens(content, content_tokens, max_tokens):
+    """Keep roughly the last max_tokens tokens of a message that can't fit whole"""
+    keep_chars = max(0, len(content) * max_tokens // max(content_tokens, 1))
+    return "[...] " + content[len(content) - keep_chars:]
+
+
+def format_message(role, content):
+    """
+    Format a message as a prompt line
     
-    finally:
-        db.close()
+    Labels are "User:" and "Assistant:" to match the turn the prompt ends
+    with, so a reply reads the same in the next prompt as it was generated.
+    """
+    return f"{role.capitalize()}: {content}"
 
 
-def get_context_for_generation(conversation_id, max_messages=10):
+def recall_messages(db, retriever, conversation, recent_messages, token_budget, count_tokens=None):
+    """
+    Recall older messages relevant to the latest one, within token_budget
+    
+    The budget covers the header line and each message's role label. The
+    best match that doesn't fit whole is cut to fit, if MIN_RECALL_TOKENS
+    of it still do.
+    
+    Returns:
+        list: Prompt lines, the header and then recalled messages oldest
+            first (empty if nothing was recalled)
+    """
+    try:
+        candidates = retriever.recall(db, conversation, recent_messages[-1].content,
+                                      before_id=recent_messages[0].id)
+    except Exception as e:
+        print(f"Memory recall failed for conversation {conversation.id}: {e}")
+        return []
+    
+    header_tokens = (count_tokens and count_tokens(RECALL_HEADER)) or estimate_tokens(RECALL_HEADER)
+    remaining = token_budget - header_tokens
+    
+    # Best matches first
+    recalled = []
+    for msg in candidates:
+        tokens = get_message_tokens(msg, count_tokens)
+        content = msg.content
+        if tokens > remaining:
+            # Leave room for the label and the "[...]" marker
+            fits = remaining - 2 * MESSAGE_OVERHEAD_TOKENS
+            if fits < MIN_RECALL_TOKENS:
+                continue
+            content = truncate_to_tokens(content, tokens - MESSAGE_OVERHEAD_TOKENS, fits)
+            tokens = remaining
+        recalled.append((msg, content))
+        remaining -= tokens
+    
+    if not recalled:
+        return []
+    recalled.sort(key=lambda item: (item[0].timestamp, item[0].id))
+    return [RECALL_HEADER] + [format_message(msg.role, content) for msg, content in recalled]
+
+
+def get_context_for_generation(conversation_id, token_budget=1536, count_tokens=None, retriever=None):
     """
     Get conversation context for model generation.
-    Returns summary + recent messages.
+    Returns summary + recent messages, ending with the latest message.
+    
+    Messages are added from newest to oldest until token_budget is used up,
+    using the token count stored on each message. If the latest message
+    alone doesn't fit, only its end is kept. Messages up to the summary
+    watermark are left out, since the rolling summary already covers them.
+    
+    The prompt only ever grows at the end between turns, so the model's
+    KV cache can reuse everything evaluated for the previous reply. To keep
+    that true, the window's first message (counted from the watermark) is
+    rounded up to a multiple of WINDOW_STEP, so it jumps forward every few
+    messages instead of sliding by one on every turn.
+    
+    With a retriever, retriever.max_tokens of the budget is set aside for
+    older messages similar to the latest one (long-term memory). They go
+    just before the latest message, so the rest of the prompt keeps the
+    prefix the KV cache has already evaluated.
     
     Args:
         conversation_id: ID of the conversation
-        max_messages: Maximum number of recent messages to include
+        token_budget: Tokens available for the context (n_ctx minus room for the reply)
+        count_tokens: Model tokenizer count function, used for messages without a stored count
+        retriever: MemoryRetriever (memory.py) to recall older messages with, or None
     
     Returns:
         str: Context string for model prompt
     """
     db = get_db_session()
-    try:
-        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
-        if not conversation:
-            return ""
-        
-        context_parts = []
-        
-        # Add summary if exists
-        if conversation.summary:
-            context_parts.append(f"Previous conversation summary:\n{conversation.summary}\n")
-        
-        # Add recent messages
-        recent_messages = conversation.messages[-max_messages:]
-        if recent_messages:
-            context_parts.append("Recent conversation:")
-            for msg in recent_messages:
-                context_parts.append(f"{msg.role.upper()}: {msg.content}")
-        
-        return "\n".join(context_parts)
+    conversation = db.query(Conversation).filter_by(id=conversation_id).first()
+    if not conversation:
+        return ""
     
-    finally:
-        db.close()
+    context_parts = []
+    
+    # Add summary if exists
+    if conversation.summary:
+        summary_part = f"Previous conversation summary:\n{conversation.summary}\n"
+        summary_tokens = (count_tokens and count_tokens(summary_part)) or estimate_tokens(summary_part)
+        if summary_tokens <= token_budget // 2:
+            context_parts.append(summary_part)
+            token_budget -= summary_tokens
+    
+    # A fixed share for recalled messages, so it doesn't move the window boundary
+    memory_budget = min(retriever.max_tokens, token_budget // 4) if retriever else 0
+    token_budget -= memory_budget
+    
+    # Walk back from the newest message until the budget is used up.
+    # Messages already folded into the summary are left out.
+    unsummarized = count_messages(db, conversation_id, after_id=conversation.summarized_upto)
+    newest_first = []
+    used = 0
+    for msg in iter_messages_newest_first(db, conversation_id, after_id=conversation.summarized_upto):
+        tokens = get_message_tokens(msg, count_tokens)
+        if used + tokens > token_budget and newest_first:
+            break
+        used += tokens
+        newest_first.append(msg)
+        if used >= token_budget:
+            break
+    
+    # Start from a window boundary, but always include the latest message
+    start = unsummarized - len(newest_first)
+    start = -(-start // WINDOW_STEP) * WINDOW_STEP
+    keep = max(1, unsummarized - start)
+    recent_messages = list(reversed(newest_first[:keep]))
+    
+    recalled = []
+    if memory_budget and recent_messages:
+        recalled = recall_messages(db, retriever, conversation, recent_messages, memory_budget, count_tokens)
+    
+    if recent_messages:
+        context_parts.append("Recent conversation:")
+        for msg in recent_messages:
+            if msg is recent_messages[-1]:
+                context_parts.extend(recalled)
+            content = msg.content
+            tokens = get_message_tokens(msg, count_tokens)
+            if tokens > token_budget:
+                content = truncate_to_tokens(content, tokens, token_budget - MESSAGE_OVERHEAD_TOKENS)
+            context_parts.append(format_message(msg.role, content))
+    
+    # Persist token counts backfilled above
+    if db.dirty:
+        db.commit()
+    
+    return "\n".join(context_parts)
 
 
 def should_summarize(conversation_id, threshold=15):
     """
     Check if a conversation should be summarized.
     
+    Only messages newer than the summary watermark count, so once a
+    conversation is summarized it isn't summarized again until enough
+    new messages have built up.
+    
     Args:
         conversation_id: ID of the conversation
-        threshold: Number of messages before triggering summarization
+        threshold: Number of unsummarized messages before triggering summarization
     
     Returns:
         bool: True if should summarize
     """
     db = get_db_session()
-    try:
-        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
-        if not conversation:
-            return False
-        
-        message_count = len(conversation.messages)
-        return message_count >= threshold
+    conversation = db.query(Conversation).filter_by(id=conversation_id).first()
+    if not conversation:
+        return False
     
-    finally:
-        db.close()
+    return count_messages(db, conversation_id, after_id=conversation.summarized_upto) >= threshold
 
 
-def auto_generate_title(model_loader, conversation_id):
+def auto_generate_title(model_loader, conversation_id, writer=None):
     """
     Auto-generate a title for a conversation based on first few messages.
     
     Args:
         model_loader: The model loader instance
         conversation_id: ID of the conversation
+        writer: Message writer to save the title through; committed on this session if None
     
     Returns:
         str: Generated title or None if failed
     """
     db = get_db_session()
-    try:
-        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
-        if not conversation or len(conversation.messages) < 2:
-            return None
-        
-        # Don't regenerate if title was manually set
-        if conversation.title != 'New Chat':
-            return None
-        
-        # Get first few messages
-        first_messages = conversation.messages[:4]
-        conversation_text = "\n".join([
-            f"{msg.role}: {msg.content[:100]}"  # Truncate long messages
-            for msg in first_messages
-        ])
-        
-        # Generate title
-        title_prompt = f"""Based on this conversation, create a short, descriptive title (3-5 words):
+    conversation = db.query(Conversation).filter_by(id=conversation_id).first()
+    if not conversation:
+        return None
+    
+    # Don't regenerate if title was manually set
+    if conversation.title != 'New Chat':
+        return None
+    
+    # Get first few messages
+    first_messages = get_first_messages(db, conversation_id, 4)
+    if len(first_messages) < 2:
+        return None
+    conversation_text = "\n".join([
+        f"{msg.role}: {msg.content[:100]}"  # Truncate long messages
+        for msg in first_messages
+    ])
+    
+    # Generate title
+    title_prompt = f"""Based on this conversation, create a short, descriptive title (3-5 words):
 
 {conversation_text}
 
 Title:"""
+    
+    try:
+        title = model_loader.generate(
+            prompt=title_prompt,
+            max_tokens=20,
+            temperature=0.5,
+            priority=PRIORITY_BACKGROUND,
+            user_id=conversation.user_id,
+            cache=True  # Identical openings get the same title
+        ).strip()
+        
+        # Clean up title (remove quotes, truncate)
+        title = title.replace('"', '').replace("'", '').strip()
+        if len(title) > 50:
+            title = title[:50] + '...'
         
-        try:
-            title = model_loader.generate(
-                prompt=title_prompt,
-                max_tokens=20,
-                temperature=0.5
-            ).strip()
-            
-            # Clean up title (remove quotes, truncate)
-            title = title.replace('"', '').replace("'", '').strip()
-            if len(title) > 50:
-                title = title[:50] + '...'
-            
-            # Update conversation title
-            conversation.title = title or 'New Chat'
-            db.commit()
-            
-            return title
+        # Update conversation title
+        save_conversation(db, conversation, {'title': title or 'New Chat'}, writer)
         
-        except Exception as e:
-            print(f"Failed to generate title: {e}")
-            return None
+        return title
     
-    finally:
-        db.close()
+    except Exception as e:
+        db.rollback()
+        print(f"Failed to generate title: {e}")
+        return None
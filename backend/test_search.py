@@ -0,0 +1,36 @@
+"""
+Tests for search.py query building
+Run from backend/ with: python -m pytest test_search.py
+"""
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from search import MAX_TERMS, _match_expression, highlight, index_terms
+
+
+def test_mysql_drops_stopwords_and_short_terms():
+    # Every MySQL term is required, so one the index leaves out would match nothing
+    terms = index_terms('mysql', "How to reverse a list in Python?")
+    assert terms == ['reverse', 'list', 'python']
+    assert _match_expression('mysql', terms) == '+reverse* +list* +python*'
+
+
+def test_mysql_query_of_only_stopwords_has_no_terms():
+    assert index_terms('mysql', "what is it") == []
+
+
+def test_sqlite_keeps_every_term():
+    terms = index_terms('sqlite', "How to reverse a list")
+    assert terms == ['how', 'to', 'reverse', 'a', 'list']
+    assert _match_expression('sqlite', terms) == '"how"* "to"* "reverse"* "a"* "list"*'
+
+
+def test_term_limit_counts_only_indexed_terms():
+    query = ' '.join(['the'] * MAX_TERMS + ['python'])
+    assert index_terms('mysql', query) == ['python']
+
+
+def test_highlight_escapes_and_marks_matches():
+    assert highlight("Use <b>list</b>.reverse()", ['reverse']) == \
+        'Use &lt;b&gt;list&lt;/b&gt;.<mark>reverse</mark>()'
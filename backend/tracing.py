@@ -0,0 +1,114 @@
+"""
+Request tracing and profiling for JailbrokeGPT
+Times the stages of each request (auth, DB writes, context building,
+queueing, generation) for the Server-Timing header and a structured log
+line, and profiles the next N requests on demand.
+"""
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+
+@contextmanager
+def span(name):
+    """Time a block as one stage of the current request (no-op outside requests)"""
+    if not has_request_context():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started)
+
+
+def record_span(name, seconds):
+    """Record a stage timed elsewhere"""
+    if has_request_context():
+        g.setdefault('spans', []).append((name, seconds))
+
+
+def get_spans():
+    """Stage durations of the current request in milliseconds, summed by name"""
+    totals = {}
+    for name, seconds in g.get('spans', []):
+        totals[name] = totals.get(name, 0.0) + seconds * 1000
+    return {name: round(ms, 2) for name, ms in totals.items()}
+
+
+def server_timing_header(spans, total_ms):
+    """Format stage durations for the Server-Timing response header"""
+    entries = [f'{name};dur={ms}' for name, ms in spans.items()]
+    entries.append(f'total;dur={round(total_ms, 2)}')
+    return ', '.join(entries)
+
+
+def log_request(method, path, status, total_ms, spans, user_id=None):
+    """Print one JSON line describing a finished request"""
+    print(json.dumps({
+        'event': 'request',
+        'ts': round(time.time(), 3),
+        'method': method,
+        'path': path,
+        'status': status,
+        'user_id': user_id,
+        'duration_ms': round(total_ms, 2),
+        'spans': spans
+    }), flush=True)
+
+
+class RequestProfiler:
+    """
+    Profiles the next N requests with cProfile, writing one .prof file per
+    request (view with snakeviz, or convert to a flamegraph with flameprof).
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._written = []
+
+    def arm(self, requests: int):
+        """Profile the next `requests` requests (0 cancels)"""
+        with self._lock:
+            self._remaining = max(0, requests)
+
+    def start(self):
+        """Start profiling this request if armed, returning the profiler"""
+        with self._lock:
+            if self._remaining <= 0:
+                return None
+            self._remaining -= 1
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        return profile
+
+    def finish(self, profile, method, path):
+        """Stop a request's profiler and dump its stats to disk"""
+        profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_') or 'root'
+        filename = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{slug}-{time.perf_counter_ns() % 10**6}.prof")
+        profile.dump_stats(filename)
+        with self._lock:
+            self._written.append(filename)
+            del self._written[:-100]
+        return filename
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {
+                'remaining': self._remaining,
+                'directory': os.path.abspath(self.directory),
+                'recent_profiles': list(self._written[-20:])
+            }
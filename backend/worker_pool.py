@@ -0,0 +1,344 @@
+"""
+Multi-process inference worker pool for JailbrokeGPT
+Runs several llama.cpp instances side by side, one per worker process,
+each pinned to its own slice of the CPU cores. The GGUF file is mmap'd,
+so every worker shares the same page-cached weights.
+"""
+import atexit
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from scheduler import ModelNotReadyError
+
+
+def _worker_main(conn, model_path, llama_kwargs, cpus, kv_cache):
+    """Worker process entry point: load the model and serve requests from the pipe"""
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    from llama_cpp import Llama
+    from kv_cache import create_kv_cache
+
+    model = Llama(model_path=model_path, use_mmap=True, verbose=False, **llama_kwargs)
+    # Decode one token so this worker's first request doesn't pay for paging in the weights
+    model("Hello", max_tokens=1, echo=False)
+    if kv_cache:
+        cache = create_kv_cache(**kv_cache)
+        if cache is not None:
+            model.set_cache(cache)
+    conn.send(('ready', os.getpid()))
+
+    while True:
+        try:
+            request = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if request is None:
+            break
+        if request.get('cancel'):
+            # Cancel arrived after the stream had already finished
+            continue
+
+        try:
+            if request['stream']:
+                for chunk in model(request['prompt'], stream=True, **request['params']):
+                    conn.send(('token', chunk['choices'][0]['text']))
+                    if conn.poll() and conn.recv().get('cancel'):
+                        break
+                conn.send(('done', None))
+            else:
+                response = model(request['prompt'], **request['params'])
+                conn.send(('done', response['choices'][0]['text']))
+        except Exception as e:
+            conn.send(('error', str(e)))
+
+
+class WorkerCrashedError(RuntimeError):
+    """Raised when a worker process dies while serving a request"""
+
+
+class _Worker:
+    """Parent-side handle for one worker process"""
+
+    def __init__(self, index, cpus):
+        self.index = index
+        self.cpus = cpus
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.started_at = None
+        self.busy_seconds = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.restarts = -1  # The first start isn't a restart
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+
+class _PoolStream:
+    """Iterator over a streamed completion served by a worker"""
+
+    def __init__(self, pool, worker, started):
+        self._pool = pool
+        self._worker = worker
+        self._started = started
+        self._finished = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration
+        try:
+            kind, value = self._pool._recv(self._worker)
+        except BaseException:
+            self.close()
+            raise
+
+        if kind == 'token':
+            return {'choices': [{'text': value}]}
+
+        self._finished = True
+        self.close()
+        if kind == 'error':
+            raise RuntimeError(value)
+        raise StopIteration
+
+    def close(self):
+        """Cancel the generation if it is still running and free the worker"""
+        if self._closed:
+            return
+        self._closed = True
+
+        if not self._finished and self._worker.is_alive():
+            try:
+                self._worker.conn.send({'cancel': True})
+                while self._worker.conn.recv()[0] == 'token':
+                    pass
+            except (EOFError, OSError):
+                pass
+
+        self._pool._checkin(self._worker, self._started)
+
+
+class InferenceWorkerPool:
+    """
+    Pool of worker processes that each hold a llama.cpp model.
+
+    Requests go to whichever worker is free. Workers that crash are
+    replaced by the supervisor thread; requests skip them meanwhile, since
+    loading a model can take minutes.
+    """
+
+    def __init__(self, model_path: str, n_workers: int, llama_kwargs: dict = None,
+                 kv_cache: dict = None, ready_timeout: float = 600.0):
+        """
+        Args:
+            model_path: Path to the GGUF model file
+            n_workers: Number of worker processes
+            llama_kwargs: Extra Llama() arguments (n_ctx, n_batch, ...)
+            kv_cache: create_kv_cache() arguments for each worker's KV cache
+            ready_timeout: Seconds to wait for a worker to load the model
+        """
+        self.model_path = model_path
+        self.n_workers = n_workers
+        self.llama_kwargs = dict(llama_kwargs or {})
+        self.kv_cache = kv_cache
+        self.ready_timeout = ready_timeout
+
+        self._ctx = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(i, cpus) for i, cpus in enumerate(self._cpu_slices(n_workers))]
+        self._free = queue.Queue()
+        self._stopping = threading.Event()
+        self._wake_supervisor = threading.Event()
+        self._supervisor = None
+
+    @staticmethod
+    def _cpu_slices(n_workers):
+        """Split the CPUs this process may use into one contiguous slice per worker"""
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = sorted(os.sched_getaffinity(0))
+        else:
+            cpus = list(range(os.cpu_count() or 1))
+
+        per_worker = max(1, len(cpus) // n_workers)
+        slices = []
+        for i in range(n_workers):
+            chunk = cpus[i * per_worker:(i + 1) * per_worker]
+            slices.append(chunk or cpus[-per_worker:])
+        return slices
+
+    def start(self):
+        """Start every worker and wait for them to load the model"""
+        print(f"Starting {self.n_workers} inference workers...")
+        for worker in self._workers:
+            self._spawn(worker)
+            self._free.put(worker)
+
+        self._supervisor = threading.Thread(target=self._supervise, name='worker-supervisor', daemon=True)
+        self._supervisor.start()
+        atexit.register(self.shutdown)
+        print("Inference workers ready!")
+
+    def _spawn(self, worker):
+        """(Re)start a worker process and wait until its model is loaded"""
+        if worker.process is not None:
+            worker.process.kill()
+            worker.process.join(timeout=5)
+            worker.conn.close()
+
+        parent_conn, child_conn = self._ctx.Pipe()
+        llama_kwargs = dict(self.llama_kwargs, n_threads=len(worker.cpus))
+        kv_cache = self.kv_cache
+        if kv_cache and kv_cache.get('disk_dir'):
+            # The KV cache indexes its disk tier in RAM, so each worker gets a directory of its own
+            kv_cache = dict(kv_cache, disk_dir=os.path.join(kv_cache['disk_dir'], f'worker-{worker.index}'))
+        worker.process = self._ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.model_path, llama_kwargs, worker.cpus, kv_cache),
+            name=f'inference-worker-{worker.index}',
+            daemon=True
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.conn = parent_conn
+
+        if not parent_conn.poll(self.ready_timeout):
+            raise RuntimeError(f"Inference worker {worker.index} did not load the model in time")
+        try:
+            _, worker.pid = parent_conn.recv()
+        except EOFError:
+            raise WorkerCrashedError(f"Inference worker {worker.index} exited while loading the model")
+
+        if worker.started_at is None:
+            worker.started_at = time.time()
+        worker.restarts += 1
+        print(f"Inference worker {worker.index} ready (pid {worker.pid}, cpus {worker.cpus})")
+
+    def _supervise(self):
+        """Replace idle workers that have died"""
+        while True:
+            self._wake_supervisor.wait(5.0)
+            self._wake_supervisor.clear()
+            if self._stopping.is_set():
+                return
+            for worker in self._workers:
+                if worker.is_alive() or not worker.lock.acquire(blocking=False):
+                    continue
+                try:
+                    print(f"Inference worker {worker.index} died, restarting...")
+                    self._spawn(worker)
+                except Exception as e:
+                    print(f"Failed to restart inference worker {worker.index}: {e}")
+                finally:
+                    worker.lock.release()
+
+    def _checkout(self):
+        """
+        Take a free worker that is alive
+
+        Dead workers, and ones the supervisor is restarting, are passed over.
+
+        Raises:
+            ModelNotReadyError: If every free worker is down
+        """
+        skipped = 0
+        while True:
+            worker = self._free.get()
+            if worker.lock.acquire(blocking=False):
+                if worker.is_alive():
+                    return worker, time.perf_counter()
+                worker.lock.release()
+                self._wake_supervisor.set()
+            self._free.put(worker)
+            skipped += 1
+            if skipped >= self.n_workers:
+                raise ModelNotReadyError("Inference workers are restarting", retry_after=10)
+
+    def _checkin(self, worker, started):
+        """Record utilization and return a worker to the free list"""
+        worker.busy_seconds += time.perf_counter() - started
+        worker.requests += 1
+        worker.lock.release()
+        self._free.put(worker)
+
+    def _recv(self, worker):
+        """Read one message from a worker, translating a dead pipe into WorkerCrashedError"""
+        try:
+            return worker.conn.recv()
+        except (EOFError, OSError):
+            worker.errors += 1
+            raise WorkerCrashedError(f"Inference worker {worker.index} crashed")
+
+    def __call__(self, prompt: str, stream: bool = False, **params):
+        """
+        Run a completion on a free worker. Mirrors Llama.__call__.
+
+        Returns:
+            Completion dict, or an iterator of chunk dicts when stream=True
+        """
+        worker, started = self._checkout()
+        try:
+            worker.conn.send({'prompt': prompt, 'stream': stream, 'params': params})
+        except (EOFError, OSError):
+            self._checkin(worker, started)
+            raise WorkerCrashedError(f"Inference worker {worker.index} crashed")
+
+        if stream:
+            return _PoolStream(self, worker, started)
+
+        try:
+            kind, value = self._recv(worker)
+        finally:
+            self._checkin(worker, started)
+
+        if kind == 'error':
+            worker.errors += 1
+            raise RuntimeError(value)
+        return {'choices': [{'text': value}]}
+
+    def get_stats(self) -> dict:
+        """Get per-worker utilization"""
+        now = time.time()
+        workers = []
+        for worker in self._workers:
+            uptime = now - worker.started_at if worker.started_at else 0.0
+            workers.append({
+                'index': worker.index,
+                'pid': worker.pid,
+                'alive': worker.is_alive(),
+                'busy': worker.lock.locked(),
+                'cpus': worker.cpus,
+                'requests': worker.requests,
+                'errors': worker.errors,
+                'restarts': max(worker.restarts, 0),
+                'utilization': round(worker.busy_seconds / uptime, 4) if uptime else 0.0
+            })
+
+        return {
+            'workers': workers,
+            'n_workers': self.n_workers,
+            'free': self._free.qsize()
+        }
+
+    def shutdown(self):
+        """Stop every worker process"""
+        self._stopping.set()
+        self._wake_supervisor.set()
+        for worker in self._workers:
+            if worker.is_alive():
+                try:
+                    worker.conn.send(None)
+                except (EOFError, OSError):
+                    pass
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
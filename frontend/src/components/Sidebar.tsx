@@ -28,18 +28,30 @@ export default function Sidebar({
   const loadConversations = async () => {
     try {
       const token = localStorage.getItem('token');
-      const response = await fetch('http://localhost:5000/api/conversations', {
-        headers: {
-          'Authorization': `Bearer ${token}`,
-        },
-      });
-
-      if (!response.ok) {
-        throw new Error('Failed to load conversations');
-      }
-
-      const data = await response.json();
-      setConversations(data.conversations);
+      const loaded: Conversation[] = [];
+      let beforeId: number | null = null;
+
+      // The list comes in pages; follow next_before_id until the last one
+      do {
+        const url: string = beforeId === null
+          ? 'http://localhost:5000/api/conversations'
+          : `http://localhost:5000/api/conversations?before_id=${beforeId}`;
+        const response = await fetch(url, {
+          headers: {
+            'Authorization': `Bearer ${token}`,
+          },
+        });
+
+        if (!response.ok) {
+          throw new Error('Failed to load conversations');
+        }
+
+        const data = await response.json();
+        loaded.push(...data.conversations);
+        beforeId = data.next_before_id;
+      } while (beforeId !== null);
+
+      setConversations(loaded);
       setError('');
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to load conversations');